@@ -0,0 +1,1716 @@
+"""Offline benchmarks for Agni.
+
+    python bench.py looplag [--players 50] [--turns 20]
+    python bench.py commits [--players 50] [--turns 20] [--flush-secs 0.1]
+    python bench.py reads [--players 50] [--turns 20]
+    python bench.py stats
+    python bench.py stress [--players 50] [--turns 20] [--workers 1]
+    python bench.py load [--players 50] [--turns 20] [--think 0] [--json out.json]
+    python bench.py metrics [--players 50] [--turns 20]
+    python bench.py memory [--guilds 5] [--members 10000]
+    python bench.py battles [--players 50] [--turns 20]
+    python bench.py auto [--turns 20]
+    python bench.py ledger [--players 50] [--turns 20]
+    python bench.py migrate [--rows 200000]
+    python bench.py export [--rows 200000]
+    python bench.py ui [--turns 2000]
+    python bench.py regen [--rows 200000]
+    python bench.py boss [--players 5000] [--secs 10]
+    python bench.py backup [--rows 200000] [--players 50]
+    python bench.py spike [--players 3000] [--sessions 3] [--slow-ms 4] [--ramp 1]
+
+Each benchmark runs against a throwaway database and prints a short report;
+``--json`` also saves it, with the git revision, for comparing versions.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+os.environ.setdefault("AGNI_DB", os.path.join(tempfile.mkdtemp(prefix="agni-bench-"), "bench.db"))
+
+import discord  # noqa: E402
+from discord.ui.select import selected_values  # noqa: E402
+
+import main  # noqa: E402
+import manage  # noqa: E402
+
+
+# ==============================================================================
+# 📏 HELPERS
+# ==============================================================================
+
+class LagProbe:
+    """Measures event-loop lag: how late a short sleep wakes up."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - t - self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+    def summary(self):
+        s = sorted(self.samples) or [0.0]
+        return {
+            "lag_mean_ms": round(statistics.fmean(s) * 1000, 3),
+            "lag_p99_ms": percentiles(s)["p99"],
+            "lag_max_ms": round(s[-1] * 1000, 3),
+        }
+
+
+def fresh_db_path(tag):
+    path = os.path.join(os.path.dirname(main.DB_PATH), f"{tag}.db")
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return path
+
+
+def use_db(path):
+    """Point the bot's command handlers at a player cache over this file."""
+    main.db = (main.SharedPlayerCache if main.SHARED_DB else main.PlayerCache)(main.Database(path))
+    main.leaderboards = main.Leaderboards(main.db)
+    main.battles = main.BattleSessions()
+    main.ledger = main.Ledger(main.db)
+    main.bosses = main.WorldBosses(main.db)
+    main.dispatcher = main.Dispatcher()
+    return main.db
+
+
+def use_fresh_db(tag):
+    return use_db(fresh_db_path(tag))
+
+
+def percentiles(samples, ms=True):
+    s = sorted(samples) or [0.0]
+    scale = 1000 if ms else 1
+    return {f"p{p}": round(s[min(len(s) - 1, int(len(s) * p / 100))] * scale, 3) for p in (50, 95, 99)}
+
+
+def report(title, rows):
+    print(f"\n== {title}")
+    for name, data in rows.items():
+        print(f"  {name:<18} " + "  ".join(f"{k}={v}" for k, v in data.items()))
+
+
+class FakeResponse:
+    """Records what a handler sent instead of calling Discord."""
+
+    def __init__(self, inter=None):
+        self.inter = inter
+        self.sent = []
+
+    async def send_message(self, content=None, **kwargs):
+        # Like discord.py 2.3: a view passed here must be a View (None raises), edit_message takes None
+        if "view" in kwargs: kwargs["view"].is_finished()
+        await self.edit_message(content, **kwargs)
+
+    async def edit_message(self, content=None, **kwargs):
+        self.sent.append((content, kwargs))
+        if self.inter: self.inter.answered()
+
+    async def defer(self, **kwargs):
+        self.sent.append((None, {"deferred": True}))
+        if self.inter: self.inter.answered(final=False)
+
+    def is_done(self):
+        return bool(self.sent)
+
+    @property
+    def last(self):
+        return self.sent[-1] if self.sent else (None, {})
+
+
+class FakeUser:
+    def __init__(self, uid):
+        self.id = uid
+        self.name = self.display_name = f"hero{uid}"
+
+
+class FakeFollowup:
+    def __init__(self, inter):
+        self.inter = inter
+
+    async def send(self, content=None, **kwargs):
+        if "view" in kwargs: kwargs["view"].is_finished()  # as Webhook.send does
+        self.inter.response.inner.sent.append((content, kwargs))
+        self.inter.answered()
+
+
+class FakeInteraction:
+    """Records when it was first answered (acked_at) and when its reply was complete (replied_at)."""
+
+    def __init__(self, uid, guild_id=1, data=None):
+        self.user = FakeUser(uid)
+        self.guild_id = guild_id
+        self.channel_id = 1
+        self.data = data or {}
+        self.type = discord.InteractionType.application_command if "name" in self.data else discord.InteractionType.component
+        self.message = None
+        self.created = time.perf_counter()
+        self.acked_at = self.replied_at = None
+        self._cs_response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+    @property
+    def response(self):
+        return self._cs_response  # the dispatcher swaps it, as on a discord.Interaction
+
+    def answered(self, final=True):
+        now = time.perf_counter() - self.created
+        if self.acked_at is None: self.acked_at = now
+        if final and self.replied_at is None: self.replied_at = now
+
+    async def edit_original_response(self, **kwargs):
+        await self.response.inner.edit_message(**kwargs)  # view=None is fine here, as in discord.py
+
+    async def delete_original_response(self):
+        pass
+
+
+async def run_command(name, uid, **options):
+    """Invoke a slash command's handler the way the tree would, in its own task."""
+    inter = FakeInteraction(uid, data={"name": name})
+
+    async def invoke():
+        if await main.bot.tree.interaction_check(inter):
+            await main.bot.tree.get_command(name).callback(inter, **options)
+    await asyncio.create_task(invoke())
+    return inter
+
+
+async def click(view, item, uid, value=None):
+    """Press a button, or pick ``value`` from a select, on a view a command sent."""
+    inter = FakeInteraction(uid, data={"custom_id": item.custom_id})
+
+    async def invoke():
+        if value is not None:
+            selected_values.set({item.custom_id: [value]})
+        if await view.interaction_check(inter):
+            await item.callback(inter)
+    await asyncio.create_task(invoke())
+    return inter
+
+
+# ==============================================================================
+# ⏱️ LOOP LAG: BLOCKING SQLITE VS ASYNC STORE
+# ==============================================================================
+
+async def _battle_traffic(get_user, update_user, players, turns, gap=0.0):
+    async def player(uid):
+        for _ in range(turns):
+            u = await get_user(uid)
+            u['hp'] = max(10, u['hp'] - 7)
+            u['materials']["Loha (Iron)"] = u['materials'].get("Loha (Iron)", 0) + 1
+            await update_user(uid, u)
+            await asyncio.sleep(gap)
+    await asyncio.gather(*(player(uid) for uid in range(1, players + 1)))
+
+
+async def looplag_blocking(players, turns):
+    # The pre-aiosqlite code path: the same SQL run inline on the loop thread
+    conn = sqlite3.connect(fresh_db_path("blocking"))
+    conn.execute("""CREATE TABLE users (user_id INTEGER PRIMARY KEY, hp INTEGER, materials TEXT)""")
+    conn.executemany("INSERT INTO users VALUES (?, 100, '{}')", [(i,) for i in range(1, players + 1)])
+    conn.commit()
+
+    async def get_user(uid):
+        hp, mats = conn.execute("SELECT hp, materials FROM users WHERE user_id=?", (uid,)).fetchone()
+        return {"hp": hp, "materials": json.loads(mats)}
+
+    async def update_user(uid, u):
+        conn.execute("UPDATE users SET hp=?, materials=? WHERE user_id=?", (u['hp'], json.dumps(u['materials']), uid))
+        conn.commit()
+
+    with LagProbe() as probe:
+        t = time.perf_counter()
+        await _battle_traffic(get_user, update_user, players, turns)
+        elapsed = time.perf_counter() - t
+    conn.close()
+    return {"wall_s": round(elapsed, 3), **probe.summary()}
+
+
+async def looplag_async(players, turns):
+    store = main.Database(fresh_db_path("async"))
+    await store.connect()
+    for uid in range(1, players + 1):
+        await store.create_user(uid)
+
+    with LagProbe() as probe:
+        t = time.perf_counter()
+        await _battle_traffic(store.get_user, store.update_user, players, turns)
+        elapsed = time.perf_counter() - t
+    await store.close()
+    return {"wall_s": round(elapsed, 3), **probe.summary()}
+
+
+async def bench_looplag(args):
+    rows = {
+        "blocking": await looplag_blocking(args.players, args.turns),
+        "async": await looplag_async(args.players, args.turns),
+    }
+    report(f"Event-loop lag under /battle traffic ({args.players} players x {args.turns} turns)", rows)
+    return rows
+
+
+# ==============================================================================
+# 💾 COMMITS: WRITE-THROUGH VS WRITE-BEHIND CACHE
+# ==============================================================================
+
+async def bench_commits(args):
+    main.FLUSH_INTERVAL = args.flush_secs
+    rows = {}
+    for name in ("direct", "cached"):
+        store = main.Database(fresh_db_path(name))
+        target = store if name == "direct" else main.PlayerCache(store)
+        await target.connect()
+        for uid in range(1, args.players + 1):
+            await target.create_user(uid)
+        before = store.commits
+        t = time.perf_counter()
+        await _battle_traffic(target.get_user, target.update_user, args.players, args.turns, gap=0.01)
+        await target.close()
+        clicks = args.players * args.turns
+        commits = store.commits - before
+        rows[name] = {"clicks": clicks, "commits": commits, "clicks_per_commit": round(clicks / max(1, commits), 1),
+                      "wall_s": round(time.perf_counter() - t, 3)}
+    report(f"Commits per click (flush every {args.flush_secs}s)", rows)
+    return rows
+
+
+# ==============================================================================
+# 📖 READS: READER POOL VS SHARED WRITER CONNECTION
+# ==============================================================================
+
+async def bench_reads(args):
+    rows = {}
+    for name, readers in (("writer-only", 0), ("pool", main.DB_READERS)):
+        store = main.Database(fresh_db_path(name), readers=readers)
+        await store.connect()
+        for uid in range(1, args.players + 1):
+            await store.create_user(uid)
+        stop, latencies = False, []
+
+        async def writer():
+            # Combat-style flushes: every player touched, one commit per batch
+            while not stop:
+                await store.write_many([(uid, {"hp": 50, "gold": uid, "materials": {"Loha (Iron)": 1, "Asura Blood": 2}})
+                                        for uid in range(1, args.players + 1)])
+
+        async def reader(uid):
+            # /profile-style lookups arriving alongside the writes
+            for _ in range(args.turns):
+                t = time.perf_counter()
+                await store.get_user(uid)
+                latencies.append(time.perf_counter() - t)
+                await asyncio.sleep(0.001)
+
+        w = asyncio.create_task(writer())
+        await asyncio.gather(*(reader(uid) for uid in range(1, main.DB_READERS + 1)))
+        stop = True
+        await w
+        await store.close()
+        rows[name] = {"reads": len(latencies), **{f"{k}_ms": v for k, v in percentiles(latencies).items()}}
+    report("get_user latency while combat writes commit", rows)
+    return rows
+
+
+# ==============================================================================
+# 📊 DERIVED STATS: MEMOIZED VS FROM SCRATCH
+# ==============================================================================
+
+def _stat_builds():
+    weapons = ["None"] + [k for k, v in main.RECIPES.items() if v['type'] == 'wep']
+    mounts = ["None"] + list(main.VAHANAS)
+    for path in main.PATHS:
+        for level in (1, 10, 50, 120):
+            for rebirths in (0, 3):
+                for wep in weapons:
+                    for mount in mounts:
+                        yield {"path": path, "level": level, "rebirths": rebirths,
+                               "equipment": {"wep": wep, "arm": "Kavacha Armor", "mount": mount}}
+
+
+async def bench_stats(args):
+    import timeit
+    builds = list(_stat_builds())
+    scratch = main.derived_stats.__wrapped__
+
+    def uncached():
+        for u in builds:
+            eq = u['equipment']
+            scratch(u['path'], u['level'], u['rebirths'], eq['wep'], eq['arm'], eq['mount'])
+
+    def cached():
+        for u in builds:
+            main.calculate_stats(u)
+
+    for u in builds:
+        eq = u['equipment']
+        assert main.calculate_stats(u) == scratch(u['path'], u['level'], u['rebirths'], eq['wep'], eq['arm'], eq['mount'])
+    rows = {}
+    for name, fn in (("scratch", uncached), ("memoized", cached)):
+        runs = 200
+        best = min(timeit.repeat(fn, number=runs, repeat=5)) / (runs * len(builds))
+        rows[name] = {"ns_per_call": round(best * 1e9, 1)}
+    rows["memoized"]["cache"] = str(main.derived_stats.cache_info())
+    report(f"calculate_stats over {len(builds)} builds", rows)
+    return rows
+
+
+# ==============================================================================
+# 🔒 STRESS: CONCURRENT INTERACTIONS FOR THE SAME PLAYER
+# ==============================================================================
+
+WON = re.compile(r"Won \*\*(\d+) Gold")
+HP = re.compile(r"`(-?\d+)/(\d+)`")
+STRESS_START = {"gold": 1_000_000, "materials": {m: 500 for m in main.MATERIALS}, "inventory": {"Soma": 5},
+                "level": 30, "hp": 10_000}
+
+
+async def _stress_shop(uid, ledger):
+    view = (await run_command("shop", uid)).response.last[1]["view"]
+    item = random.choice(list(main.ITEMS))
+    if (await click(view, view.children[0], uid, item)).response.last[0] == f"Bought {item}.":
+        ledger["gold"] -= main.ITEMS[item]["price"]
+        ledger["soma"] += item == "Soma"
+
+
+async def _stress_spin(uid, ledger):
+    embed = (await run_command("spin", uid, amount=100)).response.last[1].get("embed")
+    if embed:
+        won = WON.search(embed.description)
+        ledger["gold"] += int(won.group(1)) - 100 if won else -100
+
+
+async def _stress_stables(uid, ledger):
+    view = (await run_command("stables", uid)).response.last[1]["view"]
+    if "now riding" in (await click(view, view.children[0], uid, random.choice(list(main.VAHANAS)))).response.last[0]:
+        ledger["gold"] -= 500
+
+
+async def _stress_forge(uid, ledger):
+    view = (await run_command("forge", uid)).response.last[1]["view"]
+    recipe = random.choice(list(main.RECIPES))
+    if "FUSION SUCCESSFUL" in (await click(view, view.children[0], uid, recipe)).response.last[0]:
+        ledger["materials"].subtract(main.RECIPES[recipe]["cost"])
+
+
+async def _stress_battle(uid, ledger):
+    # Battle turns are charged to the ledger by tally_battles()
+    view = (await run_command("battle", uid)).response.last[1].get("view")
+    for _ in range(random.randint(1, 6)):
+        if view is None: break
+        view = (await click(view, random.choice((view.attack, view.heal, view.auto)), uid)).response.last[1].get("view")
+
+
+def tally_battles(ledgers):
+    """Wrap BattleSession.play to charge each turn's Soma, drops and gold to its player.
+
+    A battle message only shows the last few log lines, so the engine is
+    the one place that sees every turn. Returns a function that unwraps it.
+    """
+    play = main.BattleSession.play
+
+    def tallied(self, u, action):
+        soma, gold, mats = u['inventory'].get("Soma", 0), u['gold'], Counter(u['materials'])
+        outcome = play(self, u, action)
+        led = ledgers[self.uid]
+        led["soma"] += u['inventory'].get("Soma", 0) - soma
+        led["gold"] += u['gold'] - gold
+        led["materials"].update(Counter(u['materials']) - mats)
+        return outcome
+
+    main.BattleSession.play = tallied
+    return lambda: setattr(main.BattleSession, "play", play)
+
+
+STRESS_ACTIONS = (_stress_shop, _stress_spin, _stress_stables, _stress_forge, _stress_battle)
+
+
+async def stress_sessions(args, players):
+    """args.sessions concurrent sessions per player. Returns what the responses say changed."""
+    ledgers = {uid: {"gold": 0, "materials": Counter(), "soma": 0} for uid in players}
+    # Every session runs at once: this tests the per-player locks, not the dispatcher's per-player cap
+    main.dispatcher = main.Dispatcher(player_inflight=args.sessions)
+
+    async def session(uid):
+        for _ in range(args.turns):
+            await random.choice(STRESS_ACTIONS)(uid, ledgers[uid])
+            await asyncio.sleep(0)
+
+    untally = tally_battles(ledgers)
+    t = time.perf_counter()
+    try:
+        with LagProbe() as probe:
+            await asyncio.gather(*(session(uid) for uid in players for _ in range(args.sessions)))
+    finally:
+        untally()
+    return ledgers, time.perf_counter() - t, probe.summary()
+
+
+async def bench_stress(args):
+    """Many interactions in flight per player; every gold/material change must survive.
+
+    With --workers N, N processes share the database file (AGNI_SHARED_DB)
+    and all of them play the same players at once.
+    """
+    main.CACHE_SIZE = max(1, args.players // 4)  # evictions put real awaits inside each handler
+    main.FLUSH_INTERVAL = args.flush_secs
+    players = range(1, args.players + 1)
+
+    if args.worker_db:
+        db = use_db(args.worker_db)
+        await db.connect()
+        try:
+            ledgers, elapsed, lag = await stress_sessions(args, players)
+        finally:
+            await db.close()
+        print("RESULT " + json.dumps({"ledgers": ledgers, "wall_s": elapsed, **lag}))
+        return
+
+    db = use_fresh_db("stress")
+    await db.connect()
+    try:
+        for uid in players:
+            await db.create_user(uid)
+            await db.update_user(uid, STRESS_START)
+        if args.workers > 1:
+            await db.close()
+            cmd = [sys.executable, os.path.abspath(__file__), "stress", "--worker-db", db.store.db_name,
+                   "--players", str(args.players), "--turns", str(args.turns), "--sessions", str(args.sessions),
+                   "--flush-secs", str(args.flush_secs)]
+            env = dict(os.environ, AGNI_SHARED_DB="1")
+            procs = [subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, text=True) for _ in range(args.workers)]
+            results = [json.loads(p.communicate()[0].split("RESULT ", 1)[1]) for p in procs]
+            ledgers = {uid: {"gold": 0, "materials": Counter(), "soma": 0} for uid in players}
+            for r in results:
+                for uid, led in r["ledgers"].items():
+                    mine = ledgers[int(uid)]
+                    mine["gold"] += led["gold"]
+                    mine["soma"] += led["soma"]
+                    mine["materials"].update(led["materials"])
+            elapsed = max(r["wall_s"] for r in results)
+            lag = {k: max(r[k] for r in results) for k in ("lag_mean_ms", "lag_p99_ms", "lag_max_ms")}
+        else:
+            ledgers, elapsed, lag = await stress_sessions(args, players)
+    finally:
+        await db.close()
+
+    def conserved(u, led):
+        mats = Counter(STRESS_START["materials"])
+        mats.update(led["materials"])
+        return (u["gold"] == STRESS_START["gold"] + led["gold"] and u["inventory"].get("Soma", 0) == 5 + led["soma"]
+                and {k: v for k, v in u["materials"].items() if v} == {k: v for k, v in mats.items() if v})
+
+    # Check what reached the file, after every process flushed and closed
+    store = main.Database(db.store.db_name)
+    await store.connect()
+    try:
+        lost = [uid for uid in players if not conserved(await store.get_user(uid), ledgers[uid])]
+        # The economy ledger on disk must explain the same changes, and its rollup must match it
+        recorded = {uid: {"gold": 0, "materials": Counter(), "soma": 0} for uid in players}
+        for uid, item, total in await store.fetch("SELECT user_id, item, SUM(delta) FROM ledger GROUP BY user_id, item"):
+            if item == "gold": recorded[uid]["gold"] = total
+            elif item == "Soma": recorded[uid]["soma"] = total
+            elif item in main.MATERIALS: recorded[uid]["materials"][item] = total
+        unexplained = [uid for uid in players if not conserved(await store.get_user(uid), recorded[uid])]
+        raw, rolled = await store.fetch("SELECT COUNT(*), SUM(delta) FROM ledger"), \
+            await store.fetch("SELECT SUM(events), SUM(gained) - SUM(spent) FROM ledger_daily")
+    finally:
+        await store.close()
+
+    interactions = args.players * args.sessions * args.turns * args.workers
+    rows = {"stress": {"players": args.players, "workers": args.workers, "sessions_per_player": args.sessions * args.workers,
+                       "commands": interactions, "wall_s": round(elapsed, 3), "players_with_lost_updates": len(lost),
+                       "unexplained_by_ledger": len(unexplained), "ledger_events": raw[0][0], "rollup_matches": raw == rolled, **lag}}
+    report("Concurrent commands for the same players: gold, materials and Soma conserved", rows)
+    if lost or unexplained or raw != rolled:
+        print(f"  FAILED: lost updates for players {sorted(lost)[:10]}, unexplained by the ledger {sorted(unexplained)[:10]}")
+        sys.exit(1)
+    return rows
+
+
+# ==============================================================================
+# 🚦 LOAD: N PLAYERS THROUGH EVERY COMMAND
+# ==============================================================================
+
+async def bench_load(args):
+    """Closed-loop players running the real handlers; latency per command and button."""
+    main.FLUSH_INTERVAL = args.flush_secs
+    db = use_fresh_db("load")
+    await db.connect()
+    latencies = defaultdict(list)
+
+    async def timed(label, call):
+        t = time.perf_counter()
+        inter = await call
+        latencies[label].append(time.perf_counter() - t)
+        return inter
+
+    async def pick(name, uid, value):
+        view = (await timed(f"/{name}", run_command(name, uid))).response.last[1].get("view")
+        if view: await timed(f"{name}.select", click(view, view.children[0], uid, value))
+
+    async def battle(uid):
+        view = (await timed("/battle", run_command("battle", uid))).response.last[1].get("view")
+        hp, max_hp = 1, 1
+        for _ in range(10):
+            if view is None: break
+            heal = hp < 0.35 * max_hp
+            inter = await timed("battle.heal" if heal else "battle.strike", click(view, view.heal if heal else view.attack, uid))
+            view, embed = inter.response.last[1].get("view"), inter.response.last[1].get("embed")
+            if embed is not None: hp, max_hp = map(int, HP.search(embed.to_dict()["fields"][0]["value"]).groups())
+
+    async def reincarnate(uid):
+        view = (await timed("/reincarnate", run_command("reincarnate", uid))).response.last[1].get("view")
+        if view: await timed("reincarnate.ascend", click(view, view.children[0], uid))
+
+    mix = {
+        battle: 4,
+        lambda uid: timed("/profile", run_command("profile", uid)): 2,
+        lambda uid: timed("/spin", run_command("spin", uid, amount=100)): 1,
+        lambda uid: pick("shop", uid, random.choice(list(main.ITEMS))): 1,
+        lambda uid: pick("forge", uid, random.choice(list(main.RECIPES))): 1,
+        lambda uid: pick("travel", uid, random.choice(list(main.LOCATIONS))): 1,
+        reincarnate: 1,
+    }
+    actions, weights = list(mix), list(mix.values())
+
+    async def player(uid):
+        await timed("/start", run_command("start", uid))
+        # Enough of everything that commands take their success paths
+        await db.update_user(uid, {"gold": 50_000, "level": 50 if uid % 5 == 0 else 20,
+                                   "materials": {m: 100 for m in main.MATERIALS}})
+        for _ in range(args.turns):
+            await random.choices(actions, weights)[0](uid)
+            await asyncio.sleep(args.think)
+
+    before = db.store.commits
+    try:
+        t = time.perf_counter()
+        with LagProbe() as probe:
+            await asyncio.gather(*(player(uid) for uid in range(1, args.players + 1)))
+        elapsed = time.perf_counter() - t
+    finally:
+        await db.close()
+    commits = db.store.commits - before
+
+    rows = {label: {"n": len(s), **{f"{k}_ms": v for k, v in percentiles(s).items()}}
+            for label, s in sorted(latencies.items())}
+    everything = [x for s in latencies.values() for x in s]
+    rows["total"] = {"n": len(everything), **{f"{k}_ms": v for k, v in percentiles(everything).items()},
+                     "per_s": round(len(everything) / elapsed), "wall_s": round(elapsed, 3),
+                     "commits": commits, "commits_per_s": round(commits / elapsed, 1),
+                     "cache_hit": round(db.hits / max(1, db.hits + db.misses), 3), **probe.summary()}
+    report(f"Handler latency, {args.players} players x {args.turns} actions (think {args.think}s)", rows)
+    return rows
+
+
+# ==============================================================================
+# 📈 METRICS: RECORDING OVERHEAD
+# ==============================================================================
+
+async def bench_metrics(args):
+    import timeit
+    h, rows = main.Histogram(), {}
+    per_observe = min(timeit.repeat(lambda: h.observe(0.003), number=100_000, repeat=5)) / 100_000
+
+    # The same load run with recording stubbed out, alternating to share any drift
+    real = (main.Metrics.time_handler, main.Histogram.observe)
+    runs = {"off": [], "on": []}
+    for _ in range(3):
+        for mode in ("off", "on"):
+            if mode == "off":
+                main.Metrics.time_handler = main.Histogram.observe = lambda *a: None
+            else:
+                main.Metrics.time_handler, main.Histogram.observe = real
+            quiet = sys.stdout
+            sys.stdout = open(os.devnull, "w")
+            try:
+                runs[mode].append((await bench_load(args))["total"])
+            finally:
+                sys.stdout.close()
+                sys.stdout = quiet
+    main.Metrics.time_handler, main.Histogram.observe = real
+    for mode, totals in runs.items():
+        best = max(totals, key=lambda r: r["per_s"])
+        rows[f"metrics {mode}"] = {"per_s": best["per_s"], "p50_ms": best["p50_ms"], "p99_ms": best["p99_ms"]}
+
+    t = time.perf_counter()
+    text = main.metrics.render()
+    rows["observe"] = {"ns": round(per_observe * 1e9, 1)}
+    rows["scrape"] = {"ms": round((time.perf_counter() - t) * 1000, 3), "bytes": len(text), "series": text.count("\n")}
+    report("Metrics recording overhead (best of 3 load runs each)", rows)
+    return rows
+
+
+# ==============================================================================
+# 🧠 MEMORY: GATEWAY PROFILES
+# ==============================================================================
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _user(uid):
+    return {"id": str(uid), "username": f"hero{uid}", "discriminator": "0", "avatar": None, "global_name": None}
+
+
+def guild_create(gid, members, intents):
+    """A GUILD_CREATE as Discord sends it for these intents (members delivered inline, not chunked)."""
+    uids = range(gid * 10**7, gid * 10**7 + members)
+    return {
+        "id": str(gid), "name": f"Realm {gid}", "owner_id": str(uids[0]), "member_count": members, "large": members > 250,
+        "features": [], "emojis": [], "stickers": [], "threads": [], "voice_states": [], "stage_instances": [],
+        "roles": [{"id": str(gid), "name": "@everyone", "permissions": "0", "position": 0, "color": 0,
+                   "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(gid + 1), "type": 0, "name": "general", "position": 0, "permission_overwrites": []}],
+        "members": [{"user": _user(uid), "roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0}
+                    for uid in uids] if intents.members else [],
+        "presences": [{"user": {"id": str(uid)}, "status": "online", "activities": [], "client_status": {"desktop": "online"}}
+                      for uid in uids] if intents.presences else [],
+    }
+
+
+def message_create(gid, uid, n):
+    return {"id": str(10**15 + n), "channel_id": str(gid + 1), "guild_id": str(gid), "author": _user(uid),
+            "member": {"roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0},
+            "content": "gg", "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [], "embeds": [],
+            "pinned": False, "type": 0}
+
+
+async def measure_profile(args):
+    import gc
+    bot = main.AgniBot(args.profile)
+    await bot._async_setup_hook()  # what login() does first: binds the client to this loop
+    state, intents = bot._connection, bot.intents
+    state._chunk_guilds = False  # members arrive inline in GUILD_CREATE instead of over the network
+    gc.collect()
+    before = rss_bytes()
+    for gid in range(1, args.guilds + 1):
+        state.parse_guild_create(guild_create(gid, args.members, intents))
+        if intents.guild_messages:
+            # Chat traffic: one message per member, kept as far as the message cache allows
+            for n in range(args.members):
+                state.parse_message_create(message_create(gid, gid * 10**7 + n, gid * 10**7 + n))
+                if n % 1000 == 0: await asyncio.sleep(0)
+    await asyncio.sleep(0.1)
+    gc.collect()
+    grown = rss_bytes() - before
+    total = args.guilds * args.members
+    return {"intents": intents.value, "members_cached": sum(len(g.members) for g in bot.guilds),
+            "messages_cached": len(state._messages or ()), "rss_grown_mb": round(grown / 2**20, 1),
+            "kb_per_1k_members": round(grown / 1024 / (total / 1000), 1)}
+
+
+async def bench_memory(args):
+    if args.profile:
+        print("RESULT " + json.dumps(await measure_profile(args)))
+        return
+    # Each profile in a fresh interpreter so one can't inherit the other's heap
+    rows = {}
+    for profile in ("full", "lean"):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), "memory", "--profile", profile,
+                              "--guilds", str(args.guilds), "--members", str(args.members)],
+                             capture_output=True, text=True, check=True).stdout
+        rows[profile] = json.loads(out.split("RESULT ", 1)[1])
+    report(f"Gateway cache growth, {args.guilds} guilds x {args.members:,} members", rows)
+    return rows
+
+
+# ==============================================================================
+# ⚔️ BATTLES: MEMORY PER ACTIVE BATTLE
+# ==============================================================================
+
+async def bench_battles(args):
+    """What each open battle keeps in memory between clicks, through the real handlers."""
+    import gc
+    import timeit
+    import tracemalloc
+    main.FLUSH_INTERVAL = args.flush_secs
+    db = use_fresh_db("battles")
+    await db.connect()
+    players = range(1, args.players + 1)
+    rows = {}
+
+    async def fight(uid, turns):
+        # Healing only, so every battle is still open at the end
+        view = (await run_command("battle", uid)).response.last[1].get("view")
+        for _ in range(turns):
+            view = (await click(view, view.heal, uid)).response.last[1].get("view")
+
+    try:
+        for uid in players:
+            await db.create_user(uid)
+            await db.update_user(uid, {"hp": 10_000})  # survives the turns below
+        for turns in (0, args.turns):
+            main.battles = main.BattleSessions()
+            for uid in players:
+                await db.get_user(uid)  # already cached, so only battle state is counted
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.get_traced_memory()[0]
+            for uid in players:
+                await fight(uid, turns)
+            await db.flush()
+            gc.collect()
+            held = tracemalloc.get_traced_memory()[0] - before
+            tracemalloc.stop()
+            n = len(main.battles.sessions)
+            rows[f"after {turns} turns"] = {"battles": n, "bytes_per_battle": round(held / max(1, n)),
+                                            "estimated": round(main.battles.bytes / max(1, n))}
+
+        # Over the cap the oldest sessions are dropped and re-decoded on their next click
+        state = next(iter(main.battles.sessions.values())).state
+        loads = min(timeit.repeat(lambda: main.BattleSession.loads(1, state), number=2000, repeat=5)) / 2000
+        main.battles.cap = main.battles.bytes // 4
+        for uid in players:
+            await fight(uid, 1)
+        rows["capped at 1/4"] = {"battles": len(main.battles.sessions), "evictions": main.battles.evictions,
+                                 "decode_us": round(loads * 1e6, 2)}
+    finally:
+        await db.close()
+    report(f"Memory per open battle, {args.players} players", rows)
+    return rows
+
+
+# ==============================================================================
+# 🤖 AUTO-BATTLE: ROUND TRIPS PER DUNGEON
+# ==============================================================================
+
+async def bench_auto(args):
+    """The same dungeons clicked through by hand and with /battle auto:true.
+
+    Runs on the shared-database store, where every player write is its own
+    commit. Two identical players each play --turns dungeons, the clicker
+    following the auto policy, with the dice reseeded per dungeon, so they
+    must end up identical. Passive regeneration is off: clicking takes
+    longer, and would earn the clicker more HP.
+    """
+    main.SHARED_DB = True
+    main.REGEN_PER_MIN = 0
+    db = use_fresh_db("auto")
+    await db.connect()
+    rows, players = {}, {"manual": 1, "auto": 2}
+
+    async def manual(uid):
+        u = await db.get_user(uid)
+        hp, max_hp = u['hp'], main.calculate_stats(u)['max_hp']
+        inter = await run_command("battle", uid)
+        calls, view = 1, inter.response.last[1].get("view")
+        while view is not None:
+            heal = min(hp, max_hp) < main.AUTO_HEAL_BELOW * max_hp
+            inter = await click(view, view.heal if heal else view.attack, uid)
+            calls += 1
+            view, embed = inter.response.last[1].get("view"), inter.response.last[1].get("embed")
+            if embed is not None: hp, max_hp = map(int, HP.search(embed.to_dict()["fields"][0]["value"]).groups())
+        return calls
+
+    async def auto(uid):
+        await run_command("battle", uid, auto=True)
+        return 1
+
+    try:
+        for uid in players.values():
+            await db.create_user(uid)
+            await db.update_user(uid, {"level": 10, "gold": 0})
+        for mode, play in (("manual", manual), ("auto", auto)):
+            uid, calls, commits = players[mode], 0, db.store.commits
+            t = time.perf_counter()
+            for n in range(args.turns):
+                random.seed(n)
+                calls += await play(uid)
+            elapsed = time.perf_counter() - t
+            rows[mode] = {"dungeons": args.turns, "api_calls_per_dungeon": round(calls / args.turns, 1),
+                          "commits_per_dungeon": round((db.store.commits - commits) / args.turns, 1),
+                          "ms_per_dungeon": round(elapsed / args.turns * 1000, 2)}
+        a, b = [await db.get_user(uid) for uid in players.values()]
+        same = all(a[k] == b[k] for k in a if k not in ("user_id", "battle", "last_regen_at"))
+        rows["auto"]["same_rewards"] = same
+    finally:
+        await db.close()
+    report(f"Manual vs auto-battle, {args.turns} dungeons each", rows)
+    if not same:
+        print(f"  FAILED: manual ended as {a}, auto as {b}")
+        sys.exit(1)
+    return rows
+
+
+# ==============================================================================
+# 📒 LEDGER: GROUP COMMITS AND BACKPRESSURE
+# ==============================================================================
+
+async def _ledger_producers(ledger, producers, events):
+    """``producers`` coroutines each recording ``events`` events; returns record() latencies."""
+    waits = []
+
+    async def produce(uid):
+        for n in range(events):
+            t = time.perf_counter()
+            await ledger.record(uid, "bench", {"gold": n + 1})
+            waits.append(time.perf_counter() - t)
+            await asyncio.sleep(0)
+    await asyncio.gather(*(produce(uid) for uid in range(1, producers + 1)))
+    return waits
+
+
+async def bench_ledger(args):
+    """What recording costs the handlers, how many events share a commit, and what a full queue does."""
+    rows = {}
+    batches = []
+    write_ledger = main.Database.write_ledger
+
+    async def counted(self, events):
+        batches.append(len(events))
+        await write_ledger(self, events)
+    main.Database.write_ledger = counted
+
+    # End to end: the load run with record() stubbed out, then for real
+    real = main.Ledger.record
+    quiet = sys.stdout
+    for mode in ("off", "on", "off", "on"):
+        main.Ledger.record = real if mode == "on" else (lambda self, *a: asyncio.sleep(0))
+        sys.stdout = open(os.devnull, "w")
+        try:
+            total = (await bench_load(args))["total"]
+        finally:
+            sys.stdout.close()
+            sys.stdout = quiet
+        best = rows.get(f"load, ledger {mode}")
+        if best is None or total["per_s"] > best["per_s"]:
+            rows[f"load, ledger {mode}"] = {"per_s": total["per_s"], "p50_ms": total["p50_ms"], "p99_ms": total["p99_ms"]}
+    main.Ledger.record = real
+
+    for name, slow, maxsize in (("group commit", 0, main.LEDGER_QUEUE), ("slow disk, q=100", 0.02, 100)):
+        db = use_fresh_db("ledger")
+        await db.connect()
+        ledger = main.Ledger(db, maxsize=maxsize)
+        batches.clear()
+        if slow:
+            main.Database.write_ledger = lambda self, events: asyncio.gather(counted(self, events), asyncio.sleep(slow))
+        try:
+            t = time.perf_counter()
+            waits = await _ledger_producers(ledger, args.players, args.turns * 10)
+            await ledger.close()
+            elapsed = time.perf_counter() - t
+        finally:
+            main.Database.write_ledger = counted
+            await db.close()
+        rows[name] = {"events": ledger.written, "commits": len(batches),
+                      "events_per_commit": round(ledger.written / max(1, len(batches)), 1),
+                      "events_per_s": round(ledger.written / elapsed), "full_queue_waits": ledger.waits,
+                      **{f"record_{k}_us": round(v * 1000, 1) for k, v in percentiles(waits).items()}}
+    main.Database.write_ledger = write_ledger
+
+    # Shutting down while a batch is committing: close() must wait for it, not drop it
+    db = use_fresh_db("ledger")
+    await db.connect()
+    ledger = main.Ledger(db)
+
+    async def slow_commit(self, events):
+        await asyncio.sleep(0.2)
+        await write_ledger(self, events)
+    main.Database.write_ledger = slow_commit
+    try:
+        await ledger.record(1, "bench", {"gold": 5, "Soma": 1})
+        await asyncio.sleep(0.05)
+        await db.close()
+    finally:
+        main.Database.write_ledger = write_ledger
+    with sqlite3.connect(db.store.db_name) as conn:
+        saved = conn.execute("SELECT COUNT(*) FROM ledger").fetchone()[0]
+    rows["close mid-commit"] = {"recorded": 2, "saved": saved}
+
+    # A ledger that can't be written at shutdown: the rest of close() still runs
+    db = use_fresh_db("ledger")
+    await db.connect()
+    ledger = main.Ledger(db)
+
+    async def broken(self, events):
+        raise sqlite3.OperationalError("injected")
+    main.Database.write_ledger = broken
+    try:
+        await ledger.record(1, "bench", {"gold": 5})
+        await db.close()
+        closed = db.store.conn is None
+    except Exception:
+        closed = False
+    finally:
+        main.Database.write_ledger = write_ledger
+    rows["close, ledger failing"] = {"store_closed": closed}
+
+    report(f"Economy ledger, {args.players} players", rows)
+    if saved != 2 or not closed:
+        print("  FAILED: events were lost when the ledger closed mid-commit, or a failing ledger stopped close()")
+        sys.exit(1)
+    return rows
+
+
+# ==============================================================================
+# 🧱 SCHEMA MIGRATIONS AND BACKFILLS
+# ==============================================================================
+
+def make_v14_db(path, rows, seed=14):
+    """An agni_v14 database: inventories as JSON on users, no schema_version. Returns the blobs."""
+    rng = random.Random(seed)
+    items = list(main.ITEMS)
+    mats = ["Iron", "Wood", "Gem", "Hide"]
+    blobs = {}
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+        CREATE TABLE users (
+            user_id INTEGER PRIMARY KEY, path TEXT DEFAULT 'None', level INTEGER DEFAULT 1,
+            xp INTEGER DEFAULT 0, hp INTEGER DEFAULT 100, max_hp INTEGER DEFAULT 100,
+            gold INTEGER DEFAULT 0, location TEXT DEFAULT 'Ayodhya',
+            inventory TEXT, materials TEXT, equipment TEXT
+        )
+    """)
+    for start in range(1, rows + 1, 10000):
+        batch = []
+        for uid in range(start, min(rows, start + 9999) + 1):
+            blob = ({"Soma": rng.randint(0, 9), **{i: 1 for i in rng.sample(items, rng.randint(0, 3))}},
+                    {m: rng.randint(1, 50) for m in rng.sample(mats, rng.randint(0, 4))},
+                    {**main.DEFAULT_EQUIPMENT, "wep": rng.choice(items)})
+            blobs[uid] = blob
+            batch.append((uid, rng.randint(0, 5000), *map(json.dumps, blob)))
+        conn.executemany("INSERT INTO users (user_id, gold, inventory, materials, equipment) VALUES (?, ?, ?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+    return blobs
+
+
+async def _traffic_during_backfill(store, rows, seconds):
+    """Reads and writes of random players while the backfill runs. Returns (read, write) latencies."""
+    reads, writes = [], []
+    rng = random.Random(1)
+
+    async def reader():
+        while store._backfills and not store._backfills.done():
+            t = time.perf_counter()
+            await store.get_user(rng.randint(1, rows))
+            reads.append(time.perf_counter() - t)
+            await asyncio.sleep(0.001)
+
+    async def writer():
+        while store._backfills and not store._backfills.done():
+            t = time.perf_counter()
+            await store.update_user(rng.randint(1, rows), {"gold": rng.randint(0, 5000)})
+            writes.append(time.perf_counter() - t)
+            await asyncio.sleep(0.005)
+    await asyncio.wait_for(asyncio.gather(reader(), reader(), writer()), seconds)
+    return reads, writes
+
+
+async def bench_migrate(args):
+    """Upgrading an agni_v14 database: boot time, the pause it causes, and resuming after a restart."""
+    rows = {}
+    chunk = main.BACKFILL_CHUNK
+    src = fresh_db_path("migrate-v14")
+    t = time.perf_counter()
+    blobs = make_v14_db(src, args.rows)
+    print(f"built {args.rows:,} v14 players in {time.perf_counter() - t:.1f}s")
+
+    for name, size in (("all at once", args.rows + 1), (f"chunks of {chunk}", chunk)):
+        path = fresh_db_path("migrate")
+        for suffix in ("", "-wal"):
+            if os.path.exists(src + suffix):
+                with open(src + suffix, "rb") as f, open(path + suffix, "wb") as g:
+                    g.write(f.read())
+        main.BACKFILL_CHUNK = size
+        store = main.Database(path)
+        with LagProbe() as probe:
+            t = time.perf_counter()
+            await store.connect()
+            boot = time.perf_counter() - t
+            reads, writes = await _traffic_during_backfill(store, args.rows, 3600)
+            await store._backfills
+            total = time.perf_counter() - t
+        await store.close()
+        rows[name] = {"boot_s": round(boot, 3), "backfill_s": round(total, 2),
+                      **{f"read_{k}_ms": v for k, v in percentiles(reads).items()},
+                      "write_max_ms": round(max(writes or [0]) * 1000, 1),
+                      **{f"write_{k}_ms": v for k, v in percentiles(writes).items()},
+                      "lag_max_ms": probe.summary()["lag_max_ms"]}
+    main.BACKFILL_CHUNK = chunk
+
+    # Stop a quarter of the way in, start again: it should carry on, not start over
+    path = fresh_db_path("migrate")
+    with open(src, "rb") as f, open(path, "wb") as g:
+        g.write(f.read())
+    store = main.Database(path)
+    await store.connect()
+    while int(await store.get_meta("backfill:json_inventories") or 0) < args.rows // 4:
+        await asyncio.sleep(0.01)
+    await store.close()
+    check = sqlite3.connect(path)
+    stopped_at = json.loads(check.execute("SELECT value FROM meta WHERE key = 'backfill:json_inventories'").fetchone()[0])
+    left = check.execute("SELECT COUNT(*) FROM users WHERE inventory IS NOT NULL").fetchone()[0]
+    check.close()
+    store = main.Database(path)
+    await store.connect()
+    await store._backfills
+    version = (await store.fetch("SELECT MAX(version) FROM schema_version"))[0][0]
+    wrong = 0
+    for uid, (inv, mats, eq) in blobs.items():
+        u = await store.get_user(uid)
+        wrong += (u["inventory"], u["materials"], u["equipment"]) != (inv, mats, eq)
+    await store.close()
+    rows["resume"] = {"stopped_at": stopped_at, "rows_left": left, "schema_version": version,
+                      "players_checked": len(blobs), "players_wrong": wrong}
+    report(f"Upgrading {args.rows:,} agni_v14 players", rows)
+    if wrong or left != args.rows - stopped_at:
+        print("  FAILED: players lost inventory, or the restart did not resume")
+        sys.exit(1)
+    return rows
+
+
+# ==============================================================================
+# 📤 EXPORT AND IMPORT
+# ==============================================================================
+
+async def make_players_db(path, rows):
+    """A current database with ``rows`` players (an upgraded agni_v14 one). Returns their items."""
+    blobs = make_v14_db(path, rows)
+    chunk, pause = main.BACKFILL_CHUNK, main.BACKFILL_PAUSE
+    main.BACKFILL_CHUNK, main.BACKFILL_PAUSE = 50000, 0
+    try:
+        store = main.Database(path)
+        await store.connect()
+        await store._backfills
+        await store.close()
+    finally:
+        main.BACKFILL_CHUNK, main.BACKFILL_PAUSE = chunk, pause
+    return blobs
+
+
+async def _players(store, uids):
+    return {uid: await store.get_user(uid) for uid in uids}
+
+
+async def bench_export(args):
+    """Streaming export: speed, memory against row count, incremental runs and a restore round trip."""
+    rows = {}
+    out = os.path.dirname(main.DB_PATH)
+    for n in (args.rows // 4, args.rows):
+        path = fresh_db_path(f"export-{n}")
+        await make_players_db(path, n)
+        for fmt in ("jsonl", "parquet"):
+            dest = os.path.join(out, f"players-{n}.{fmt}")
+            try:
+                t = time.perf_counter()
+                await manage.export(dest, path)
+                elapsed = time.perf_counter() - t
+            except SystemExit as e:
+                print(f"  skipping {fmt}: {e}")
+                continue
+            tracemalloc.start()
+            await manage.export(dest, path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows[f"{fmt}, {n:,}"] = {"players_per_s": round(n / elapsed), "mb": round(os.path.getsize(dest) / 2**20, 1),
+                                     "peak_traced_mb": round(peak / 2**20, 1)}
+
+    # Incremental: touch 1% of players, export what changed, restore full + incremental
+    state = os.path.join(out, "export-state.json")
+    if os.path.exists(state): os.remove(state)
+    full, delta = os.path.join(out, "full.jsonl"), os.path.join(out, "delta.jsonl")
+    await manage.export(full, path, state)
+    store = main.Database(path)
+    await store.connect()
+    touched = random.Random(2).sample(range(1, args.rows + 1), args.rows // 100)
+    for uid in touched:
+        await store.update_user(uid, {"gold": 1, "inventory": {"Soma": None, "Agni Scroll": 3}, "materials": {"Old Relic": 1}})
+    t = time.perf_counter()
+    changed = await manage.export(delta, path, state)
+    rows["incremental"] = {"touched": len(touched), "exported": changed,
+                           "ms": round((time.perf_counter() - t) * 1000, 1)}
+
+    restored = fresh_db_path("restore")
+    t = time.perf_counter()
+    await manage.import_players(full, restored)
+    await manage.import_players(delta, restored)
+    elapsed = time.perf_counter() - t
+    copy = main.Database(restored)
+    await copy.connect()
+    sample = random.Random(3).sample(range(1, args.rows + 1), min(args.rows, 20000)) + touched
+    wrong = sum(a != b for a, b in zip((await _players(store, sample)).values(), (await _players(copy, sample)).values()))
+    await copy.close()
+    await store.close()
+    rows["import"] = {"players_per_s": round((args.rows + changed) / elapsed), "players_checked": len(sample),
+                      "players_wrong": wrong}
+
+    # Mid-backfill: half the players still have their items as JSON on users
+    n = min(args.rows, 20000)
+    path = fresh_db_path("export-partial")
+    blobs = make_v14_db(path, n)
+    store = main.Database(path)
+    await store.connect()
+    while int(await store.get_meta("backfill:json_inventories") or 0) < n // 2:
+        await asyncio.sleep(0.01)
+    await store.close()
+    partial = os.path.join(out, "partial.jsonl")
+    await manage.export(partial, path)
+    restored = fresh_db_path("restore-partial")
+    await manage.import_players(partial, restored)
+    copy = main.Database(restored)
+    await copy.connect()
+    lost = 0
+    for uid, (inv, mats, eq) in blobs.items():
+        u = await copy.get_user(uid)
+        lost += (u["inventory"], u["materials"], u["equipment"]) != (inv, mats, eq)
+    await copy.close()
+    # Importing into it, with the last players' items gone: the backfill mustn't bring them back
+    emptied = os.path.join(out, "emptied.jsonl")
+    with open(partial) as f, open(emptied, "w") as g:
+        for line in f:
+            p = json.loads(line)
+            if p["user_id"] > n - 100:
+                g.write(json.dumps({k: v for k, v in p.items() if not k.startswith("inventory.")}) + "\n")
+    await manage.import_players(emptied, path)
+    store = main.Database(path)
+    await store.connect()
+    await store._backfills
+    back = sum(bool(u["inventory"]) for u in (await _players(store, range(n - 99, n + 1))).values())
+    await store.close()
+    rows["mid-backfill"] = {"players": n, "players_wrong": lost, "items_brought_back": back}
+
+    report(f"Export and import, up to {args.rows:,} players", rows)
+    if wrong or lost or back or changed < len(touched):
+        print("  FAILED: the restored players differ, an export mid-backfill lost items, or the incremental export missed some")
+        sys.exit(1)
+    return rows
+
+
+# ==============================================================================
+# 🧩 UI CONSTRUCTION
+# ==============================================================================
+
+async def bench_ui(args):
+    """What each select-menu command costs to answer: the handler, and the components it sends."""
+    db = use_fresh_db("ui")
+    await db.connect()
+    await run_command("start", 1)
+    rows = {}
+    try:
+        for name in ("shop", "travel", "stables", "forge"):
+            handler, payload = [], []
+            for n in range(args.turns + 100):
+                t = time.perf_counter()
+                inter = await run_command(name, 1)
+                elapsed = time.perf_counter() - t
+                view = inter.response.last[1]["view"]
+                t = time.perf_counter()
+                view.to_components()
+                if n >= 100:  # after warm-up
+                    handler.append(elapsed)
+                    payload.append(time.perf_counter() - t)
+            rows[f"/{name}"] = {**{f"{k}_us": round(v * 1000, 1) for k, v in percentiles(handler).items()},
+                                "components_us": round(statistics.median(payload) * 1e6, 1)}
+    finally:
+        await db.close()
+    report(f"Select-menu commands, {args.turns} runs each", rows)
+    return rows
+
+
+# ==============================================================================
+# ❤️ HP REGENERATION: SWEEP VS LAZY
+# ==============================================================================
+
+async def bench_regen(args):
+    """A once-a-minute regen sweep over every player against regen() on read."""
+    rows = {}
+    path = fresh_db_path("regen")
+    await make_players_db(path, args.rows)
+    store = main.Database(path)
+    await store.connect()
+    await store.run("UPDATE users SET hp = 10, last_regen_at = ?", (time.time(),))
+    await store.commit()
+    try:
+        # What a tasks.loop(minutes=1) would run each tick, while anyone is hurt
+        gain = 100 * main.REGEN_PER_MIN
+        t = time.perf_counter()
+        async with store._write_lock:
+            async with store.conn.execute("UPDATE users SET hp = MIN(max_hp, hp + ?) WHERE hp < max_hp", (gain,)) as cur:
+                swept = cur.rowcount
+            await store.commit()
+        rows["sweep, per minute"] = {"rows_written": swept, "ms": round((time.perf_counter() - t) * 1000, 1)}
+
+        # Lazy: nothing per minute; a read costs one regen() call, and only players who act are written
+        u = await store.get_user(1)
+        n = 100000
+        t = time.perf_counter()
+        for _ in range(n): main.regen(dict(u, hp=10))
+        per_call = (time.perf_counter() - t) / n
+        t = time.perf_counter()
+        for _ in range(n): dict(u, hp=10)
+        per_call -= (time.perf_counter() - t) / n
+        rows["lazy, per minute"] = {"rows_written": 0, "ms": 0, "regen_ns_per_read": round(per_call * 1e9)}
+
+        # Correctness, through the cache: a read regenerates without writing, the next write saves it
+        db = use_db(path)
+        await db.connect()
+        uid, minutes = 1, 3
+        await store.run("UPDATE users SET hp = 10, last_regen_at = ? WHERE user_id = ?", (time.time() - minutes * 60, uid))
+        await store.commit()
+        u = await db.get_user(uid)
+        read, max_hp = u["hp"], main.calculate_stats(u)["max_hp"]
+        expect = min(max_hp, 10 + int(minutes * main.REGEN_PER_MIN * max_hp))
+        stored_after_read = (await db.store.fetch("SELECT hp FROM users WHERE user_id = ?", (uid,)))[0][0]
+        async with db.edit(uid) as u:
+            u["gold"] += 1
+        await db.flush()
+        stored_after_write, at = (await db.store.fetch("SELECT hp, last_regen_at FROM users WHERE user_id = ?", (uid,)))[0]
+        again = (await db.get_user(uid))["hp"]
+
+        # At full HP an edit that changes nothing (as /profile's) writes nothing,
+        # and being hurt later doesn't credit the time spent full
+        uid, since = 2, time.time() - 3600
+        full = main.calculate_stats(await store.get_user(uid))["max_hp"]
+        await store.run("UPDATE users SET hp = ?, last_regen_at = ? WHERE user_id = ?", (full, since, uid))
+        await store.commit()
+        async with db.edit(uid) as u:
+            pass
+        await db.flush()
+        idle_write = (await db.store.fetch("SELECT last_regen_at FROM users WHERE user_id = ?", (uid,)))[0][0] != since
+        async with db.edit(uid) as u:
+            u["hp"] = 10
+        await db.flush()
+        hurt = (await db.get_user(uid))["hp"]
+        await db.close()
+        rows["regen check"] = {"minutes": minutes, "hp_read": read, "expected": expect, "stored_after_read": stored_after_read,
+                               "stored_after_write": stored_after_write, "read_again": again}
+        rows["full hp check"] = {"idle_edit_wrote": idle_write, "hp_after_hurt": hurt}
+    finally:
+        await store.close()
+    report(f"HP regeneration, {args.rows:,} hurt players", rows)
+    check = rows["regen check"]
+    if not (check["hp_read"] == check["expected"] == check["stored_after_write"] == check["read_again"]
+            and check["stored_after_read"] == 10 and not idle_write and hurt == 10):
+        print("  FAILED: regenerated HP was wrong, written by a read or an idle edit, or counted twice")
+        sys.exit(1)
+    return rows
+
+
+# ==============================================================================
+# 🐉 WORLD BOSS: THOUSANDS OF PLAYERS, ONE ENEMY
+# ==============================================================================
+
+async def _boss_fight(args, path, per_click):
+    """--players clicking Strike every time their cooldown is up, for --secs."""
+    db = use_db(path)
+    await db.connect()
+    edits = []
+
+    async def edit(boss, **fields):  # instead of Discord
+        main.bosses.edits += 1
+        edits.append(fields)
+    main.bosses.edit = edit
+    boss = main.bosses.live.get(1) or await main.bosses.summon(1)
+    await main.bosses.attach(boss, 1)
+    view = main.BossView()
+    clicks, commits, hp = 0, db.store.commits, boss.hp
+    deadline = time.perf_counter() + args.secs
+
+    async def player(uid):
+        nonlocal clicks
+        await asyncio.sleep(random.random() * main.BOSS_HIT_COOLDOWN)
+        while time.perf_counter() < deadline:
+            t = time.perf_counter()
+            await click(view, view.strike, uid)
+            clicks += 1
+            if per_click:
+                # What a commit and a message edit for every click would cost
+                d, n = boss.pending.pop(uid, (0, 0))
+                await db.store.write_boss_damage([(boss.id, max(0, boss.hp), [(uid, d, n)])])
+                await main.bosses.edit(boss, embed=main.boss_embed(boss))
+            # Each player clicks again as soon as their cooldown is up
+            await asyncio.sleep(max(0.0, main.BOSS_HIT_COOLDOWN - (time.perf_counter() - t)))
+
+    with LagProbe() as probe:
+        t = time.perf_counter()
+        await asyncio.gather(*(player(uid) for uid in range(1, args.players + 1)))
+        elapsed = time.perf_counter() - t
+    row = {"clicks_per_s": round(clicks / elapsed), "damage": hp - boss.hp, "commits": db.store.commits - commits,
+           "status_edits": len(edits), **probe.summary()}
+    return db, boss, row
+
+
+async def bench_boss(args):
+    """One world boss, --players clicking as fast as the cooldown allows: clicks/s kept up, commits,
+    edits and loop lag, then a restart part way through and the kill."""
+    rows = {}
+    for name, per_click in (("per click", True), ("batched", False)):
+        path = fresh_db_path("boss")
+        setup = use_db(path)
+        await setup.connect()
+        await setup.store.run_many("INSERT INTO users (user_id, path, hp, max_hp, last_regen_at) VALUES (?, 'Kshatriya', 260, 260, 0)",
+                                   [(uid,) for uid in range(1, args.players + 1)])
+        await setup.store.commit()
+        await setup.close()
+        db, boss, rows[name] = await _boss_fight(args, path, per_click)
+        await db.close()
+
+    # The batched boss after a restart: everything saved, and loaded again by the next click
+    hp, hits, totals = boss.hp, boss.hits, dict(boss.totals)
+    db = use_db(path)
+    await db.connect()
+    again = await main.bosses.get(1)
+    resumed = (again.hp, again.hits, dict(again.totals)) == (hp, hits, totals)
+
+    # And the kill: rewards for everyone who hit it, and the buttons taken off the message
+    edits = []
+
+    async def edit(boss, **fields):
+        edits.append(fields)
+    main.bosses.edit = edit
+    gold = {uid: (await db.get_user(uid))["gold"] for uid in totals}
+    again.hp = 1
+    view = main.BossView()
+    await click(view, view.strike, 1)
+    await again.finishing
+    paid = {uid: (await db.get_user(uid))["gold"] - g for uid, g in gold.items()}
+    ended = (await db.store.fetch("SELECT ended_at IS NOT NULL FROM world_bosses WHERE id = ?", (again.id,)))[0][0]
+    await db.close()
+    rows["restart and kill"] = {"resumed": resumed, "heroes": len(paid), "all_paid": min(paid.values()) >= main.BOSS_MIN_GOLD,
+                                "gold_paid": sum(paid.values()), "ended": bool(ended),
+                                "buttons_removed": bool(edits) and edits[-1].get("view", 0) is None}
+
+    # Rewards that fail for some players, then a restart part way: the rest are paid, nobody twice
+    db = use_db(path)
+    await db.connect()
+    main.bosses.edit = edit
+    boss = await main.bosses.summon(2)
+    uids = list(range(1, min(args.players, 100) + 1))
+    gold = {uid: (await db.get_user(uid))["gold"] for uid in uids}
+    for uid in uids:
+        main.bosses.hit(boss, uid, main.calculate_stats(await db.get_user(uid)))
+    real_edit, broken = db.edit, set(uids[::3])
+
+    def flaky_edit(uid, flush=False):
+        if uid in broken: raise RuntimeError("injected")
+        return real_edit(uid, flush)
+    db.edit = flaky_edit
+    boss.hp = 1
+    main.bosses.hit(boss, 1, main.calculate_stats(await db.get_user(1)), now=time.monotonic() + 10)
+    count = "SELECT COUNT(*) FROM boss_damage WHERE boss_id = ? AND paid = 1"
+    deadline = time.monotonic() + 10
+    while (await db.store.fetch(count, (boss.id,)))[0][0] < len(uids) - len(broken) and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    await db.close()
+    db = use_db(path)
+    await db.connect()
+    main.bosses.edit = edit
+    again = await main.bosses.get(2)
+    await again.finishing
+    shares = main.WorldBosses._shares(again, await db.store.boss_damage(again.id))
+    wrong = sum(u["gold"] - gold[uid] != shares[uid][0] for uid, u in (await _players(db, uids)).items())
+    ended = (await db.store.fetch("SELECT ended_at IS NOT NULL FROM world_bosses WHERE id = ?", (again.id,)))[0][0]
+    await db.close()
+    rows["failed rewards"] = {"heroes": len(uids), "failed_first": len(broken), "paid_wrong": wrong, "ended": bool(ended)}
+
+    # The flush that saves the rewards fails instead: the retry mustn't pay anyone again
+    db = use_db(path)
+    await db.connect()
+    main.bosses.edit = edit
+    boss = await main.bosses.summon(3)
+    gold = {uid: (await db.get_user(uid))["gold"] for uid in uids}
+    for uid in uids:
+        main.bosses.hit(boss, uid, main.calculate_stats(await db.get_user(uid)))
+    real_write, failures = db.store.write_many, []
+
+    async def flaky_write(rows_, members=(), paid=()):
+        if paid and not failures:
+            failures.append(len(paid))
+            raise sqlite3.OperationalError("injected")
+        await real_write(rows_, members, paid)
+    db.store.write_many, retry = flaky_write, main.BOSS_FLUSH_SECS
+    main.BOSS_FLUSH_SECS = 0.05
+    try:
+        boss.hp = 1
+        main.bosses.hit(boss, 1, main.calculate_stats(await db.get_user(1)), now=time.monotonic() + 10)
+        await boss.finishing
+    finally:
+        main.BOSS_FLUSH_SECS = retry
+    shares = main.WorldBosses._shares(boss, await db.store.boss_damage(boss.id))
+    twice = sum(u["gold"] - gold[uid] != shares[uid][0] for uid, u in (await _players(db, uids)).items())
+    ended_too = (await db.store.fetch("SELECT ended_at IS NOT NULL FROM world_bosses WHERE id = ?", (boss.id,)))[0][0]
+    await db.close()
+    rows["failed reward flush"] = {"heroes": len(uids), "flushes_failed": len(failures), "paid_wrong": twice,
+                                   "ended": bool(ended_too)}
+
+    report(f"World boss, {args.players:,} players clicking for {args.secs}s", rows)
+    r = rows["restart and kill"]
+    if not (r["resumed"] and r["all_paid"] and r["ended"] and r["buttons_removed"]) or wrong or not ended or twice or not ended_too:
+        print("  FAILED: the boss did not resume, end or pay out correctly")
+        sys.exit(1)
+    return rows
+
+
+# ==============================================================================
+# 💾 ONLINE BACKUP
+# ==============================================================================
+
+async def _commands_until(done, players, think):
+    """Players running /profile, /spin and /battle until done() is true. Returns the handler latencies."""
+    latencies = []
+    rng = random.Random(4)
+
+    async def player(uid):
+        while not done():
+            name, options = rng.choice((("profile", {}), ("spin", {"amount": 10}), ("battle", {})))
+            t = time.perf_counter()
+            await run_command(name, uid, **options)
+            latencies.append(time.perf_counter() - t)
+            await asyncio.sleep(think)
+    await asyncio.gather(*(player(uid) for uid in players))
+    return latencies
+
+
+async def bench_backup(args):
+    """Backing up a live database: how long it takes, what it does to command latency, and a restore."""
+    main.FLUSH_INTERVAL = args.flush_secs
+    path = fresh_db_path("backup-live")
+    await make_players_db(path, args.rows)
+    folder = os.path.join(os.path.dirname(main.DB_PATH), "backups")
+    for f in main.backup_files(path, folder): os.remove(f)
+    db = use_db(path)
+    await db.connect()
+    players = range(1, args.players + 1)
+    for uid in players:
+        await db.update_user(uid, {"path": "Kshatriya", "gold": 10**9, "hp": 260, "max_hp": 260})
+    backups = main.Backups(db, folder=folder, keep=2)
+    rows, took = {}, None
+
+    async def during(name, copy):
+        nonlocal took
+        task = asyncio.ensure_future(copy())
+        with LagProbe() as probe:
+            commits = db.store.commits
+            t = time.perf_counter()
+            latencies = await _commands_until(task.done, players, args.think)
+            elapsed = time.perf_counter() - t
+        dest = await task
+        took = took or elapsed
+        rows[name] = {"backup_s": round(elapsed, 2) if dest else None,
+                      "mb": round(os.path.getsize(dest) / 2**20, 1) if dest else None,
+                      "commands": len(latencies), **{f"{k}_ms": v for k, v in percentiles(latencies).items()},
+                      "commits_per_s": round((db.store.commits - commits) / elapsed, 1), **probe.summary()}
+
+    async def idle():
+        await asyncio.sleep(took)
+
+    async def one_step():
+        dest = os.path.join(folder, "one-step.db")
+        await asyncio.to_thread(main.backup_db, path, dest, pages=-1, pause=0)
+        return dest
+
+    try:
+        await during(f"stepped ({main.BACKUP_PAGES} pages)", backups.take)
+        await during("no backup", idle)
+        await during("one step", one_step)
+        os.remove(os.path.join(folder, "one-step.db"))
+
+        # Stopping part way leaves neither a backup nor its temporary file behind. One
+        # page a step, stopped as soon as the copy starts: however small --rows is,
+        # it has most of its pages still to go
+        before = set(os.listdir(folder))
+        slow = main.Backups(db, folder=folder, pages=1, pause=0.05)
+        task = asyncio.ensure_future(slow.take())
+        while not task.done() and set(os.listdir(folder)) == before:
+            await asyncio.sleep(0.001)
+        await slow.close()
+        await asyncio.wait([task])
+        stopped = task.done() and isinstance(task.exception(), main.BackupStopped)
+        clean = set(os.listdir(folder)) == before
+
+        # A quiet backup, restored over another database, gives back the same players
+        quiet = await backups.take()
+        sample = random.Random(5).sample(range(1, args.rows + 1), min(args.rows, 5000)) + list(players)
+        live = await _players(db.store, sample)
+    finally:
+        await db.close()
+    restored = fresh_db_path("backup-restore")
+    await make_players_db(restored, 100)
+    t = time.perf_counter()
+    manage.restore(quiet, restored)
+    restore_s = time.perf_counter() - t
+    await asyncio.sleep(1)  # a second restore gets a new .before-restore name rather than overwriting the first
+    manage.restore(quiet, restored)
+    kept_before = len([f for f in os.listdir(os.path.dirname(restored))
+                       if f.startswith(os.path.basename(restored) + ".before-restore-")])
+    try:
+        main.prune_backups(path, folder, keep=0)
+        keep_0 = "kept everything"
+    except ValueError:
+        keep_0 = "refused"
+    copy = main.Database(restored)
+    await copy.connect()
+    wrong = sum(a != b for a, b in zip(live.values(), (await _players(copy, sample)).values()))
+    await copy.close()
+    rows["stop and restore"] = {"stopped": stopped, "left_nothing": clean, "kept": len(main.backup_files(path, folder)),
+                                "prune_keep_0": keep_0, "restore_s": round(restore_s, 2), "before_restore_kept": kept_before,
+                                "players_checked": len(sample), "players_wrong": wrong}
+    report(f"Online backup of {args.rows:,} players, {args.players} players playing", rows)
+    if wrong or not (stopped and clean) or kept_before != 2 or keep_0 != "refused":
+        print("  FAILED: the restored players differ, a stopped backup left files behind, "
+              "or a restore or prune threw backups away")
+        sys.exit(1)
+    return rows
+
+
+# ==============================================================================
+# 🚦 TRAFFIC SPIKE: ANSWERED WITHIN DISCORD'S 3 SECONDS
+# ==============================================================================
+
+async def _spike(args, path, dispatcher):
+    """Every player sends --sessions commands, all within --ramp seconds. Returns the report row."""
+    db = use_db(path)
+    await db.connect()
+    main.dispatcher = dispatcher
+    rng = random.Random(6)
+    inters = []
+
+    async def send(uid):
+        await asyncio.sleep(rng.random() * args.ramp)
+        name, options = rng.choice((("profile", {}), ("spin", {"amount": 100}), ("battle", {})))
+        inter = FakeInteraction(uid, data={"name": name})
+        inters.append(inter)
+
+        async def invoke():
+            if await main.bot.tree.interaction_check(inter):
+                await main.bot.tree.get_command(name).callback(inter, **options)
+        await asyncio.create_task(invoke())
+
+    try:
+        with LagProbe() as probe:
+            t = time.perf_counter()
+            await asyncio.gather(*(send(uid) for uid in range(1, args.players + 1) for _ in range(args.sessions)))
+            elapsed = time.perf_counter() - t
+    finally:
+        await db.close()
+    acked = [i.acked_at for i in inters if i.acked_at is not None]
+    replied = [i.replied_at for i in inters if i.replied_at is not None]
+    return {"interactions": len(inters), "expired": sum(a is None or a > 3.0 for a in (i.acked_at for i in inters)),
+            "deferred_predicted": dispatcher.deferred["predicted"], "deferred_late": dispatcher.deferred["late"],
+            "turned_away": dispatcher.turned_away, "footers_shed": dispatcher.shed,
+            **{f"ack_{k}_ms": v for k, v in percentiles(acked).items() if k != "p95"},
+            **{f"reply_{k}_ms": v for k, v in percentiles(replied).items() if k != "p95"},
+            "wall_s": round(elapsed, 2), **probe.summary()}
+
+
+async def bench_spike(args):
+    """--players players (none of them cached) each sending --sessions commands within --ramp s, reads taking
+    --slow-ms on DB_READERS connections: how many Discord would drop, without and with the dispatcher."""
+    rows = {}
+    get_user = main.Database.get_user
+    disk = asyncio.Semaphore(main.DB_READERS)
+
+    async def slow_get_user(self, *a, **kw):
+        async with disk:
+            await asyncio.sleep(args.slow_ms / 1000)
+        return await get_user(self, *a, **kw)
+
+    unlimited = dict(defer_after=math.inf, predict=math.inf, max_inflight=10**9, max_queued=10**9,
+                     player_inflight=10**9, player_queued=0)
+    for name, dispatcher in (("no dispatcher", main.Dispatcher(**unlimited)), ("dispatcher", main.Dispatcher()),
+                             ("dispatcher, 1000 queued", main.Dispatcher(max_queued=1000))):
+        path = fresh_db_path("spike")
+        setup = use_db(path)
+        await setup.connect()
+        await setup.store.run_many("INSERT INTO users (user_id, path, gold, hp, max_hp, last_regen_at) "
+                                   "VALUES (?, 'Kshatriya', 100000, 260, 260, 0)",
+                                   [(uid,) for uid in range(1, args.players + 1)])
+        await setup.store.commit()
+        await setup.close()
+        main.Database.get_user = slow_get_user
+        try:
+            rows[name] = await _spike(args, path, dispatcher)
+        finally:
+            main.Database.get_user = get_user
+    report(f"Traffic spike: {args.players:,} players x {args.sessions} commands in {args.ramp}s, {args.slow_ms} ms reads", rows)
+    return rows
+
+
+# ==============================================================================
+# 🚀 ENTRY POINT
+# ==============================================================================
+
+BENCHMARKS = {
+    "looplag": bench_looplag,
+    "commits": bench_commits,
+    "reads": bench_reads,
+    "stats": bench_stats,
+    "stress": bench_stress,
+    "load": bench_load,
+    "metrics": bench_metrics,
+    "memory": bench_memory,
+    "battles": bench_battles,
+    "auto": bench_auto,
+    "ledger": bench_ledger,
+    "migrate": bench_migrate,
+    "export": bench_export,
+    "ui": bench_ui,
+    "regen": bench_regen,
+    "boss": bench_boss,
+    "backup": bench_backup,
+    "spike": bench_spike,
+}
+
+
+def git_rev():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agni offline benchmarks")
+    parser.add_argument("name", choices=sorted(BENCHMARKS))
+    parser.add_argument("--players", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--flush-secs", type=float, default=0.1)
+    parser.add_argument("--sessions", type=int, default=8, help="stress: concurrent interactions per player")
+    parser.add_argument("--workers", type=int, default=1, help="stress: processes sharing the database file")
+    parser.add_argument("--worker-db", help=argparse.SUPPRESS)
+    parser.add_argument("--secs", type=float, default=10, help="boss: seconds of clicking")
+    parser.add_argument("--ramp", type=float, default=1, help="spike: seconds the burst arrives over")
+    parser.add_argument("--slow-ms", type=float, default=4, help="spike: milliseconds per database read")
+    parser.add_argument("--think", type=float, default=0.0, help="load: seconds each player waits between actions")
+    parser.add_argument("--guilds", type=int, default=5, help="memory: guilds joined")
+    parser.add_argument("--members", type=int, default=10000, help="memory: members per guild")
+    parser.add_argument("--rows", type=int, default=200000, help="migrate, export, backup: players in the database")
+    parser.add_argument("--profile", choices=("full", "lean"), help="memory: measure just this gateway profile")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    rows = asyncio.run(BENCHMARKS[args.name](args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"benchmark": args.name, "rev": git_rev(), "args": vars(args), "results": rows}, f, indent=2)
@@ -1,13 +1,27 @@
 import discord
 from discord import app_commands, ui
 from discord.ext import commands, tasks
+from aiohttp import web
+import aiosqlite
+import asyncio
+import contextlib
+import signal
 import sqlite3
+import subprocess
+import sys
 import random
 import time
 import json
+import bisect
 import math
+import hashlib
 import os
-from typing import Optional, List, Dict, Any
+import weakref
+import contextvars
+from functools import lru_cache
+from collections import Counter, OrderedDict, defaultdict
+from types import MappingProxyType
+from typing import Optional, List, Dict, Any, Literal
 
 # ==============================================================================
 # ⚙️ CONFIGURATION
@@ -18,6 +32,81 @@ TOKEN = os.getenv("DISCORD_TOKEN")
 if not TOKEN:
     print("⚠️ WARNING: DISCORD_TOKEN not found in environment variables.")
 
+BOOT_TIME = time.perf_counter()
+# Slash commands are only pushed to Discord when their definitions change; set to 1 to push anyway
+FORCE_SYNC = os.getenv("AGNI_FORCE_SYNC", "0") == "1"
+# "lean": guilds intent only, no member/message caches (all the slash commands need).
+# "full": the old Intents.all() with discord.py's default caches and chunking.
+GATEWAY_PROFILE = os.getenv("AGNI_GATEWAY", "lean")
+
+# Sharding: AGNI_WORKERS processes split AGNI_SHARDS gateway shards (0 = Discord's
+# recommended count) and share the database file. The launcher hands each worker
+# its shards in AGNI_SHARD_IDS; with one worker, one process runs every shard.
+SHARD_COUNT = int(os.getenv("AGNI_SHARDS", "0")) or None
+SHARD_IDS = [int(x) for x in os.getenv("AGNI_SHARD_IDS", "").split(",") if x] or None
+WORKERS = int(os.getenv("AGNI_WORKERS", "1"))
+WORKER_INDEX = int(os.getenv("AGNI_WORKER", "0"))
+# Another process may write any player at any time, so nothing is trusted from memory
+SHARED_DB = os.getenv("AGNI_SHARED_DB", "1" if WORKERS > 1 else "0") == "1"
+LEADERBOARD_TTL = float(os.getenv("AGNI_LEADERBOARD_TTL", "30"))  # shared DB: rebuild boards this often
+
+DB_PATH = os.getenv("AGNI_DB", "agni_v14.db")
+
+# Write-behind cache: dirty players are flushed at least every FLUSH_INTERVAL
+# seconds, so this is also the most progress a crash can lose.
+FLUSH_INTERVAL = float(os.getenv("AGNI_FLUSH_SECS", "5"))
+FLUSH_BATCH = int(os.getenv("AGNI_FLUSH_BATCH", "500"))   # flush early once this many players are dirty
+CACHE_SIZE = int(os.getenv("AGNI_CACHE_SIZE", "50000"))   # clean players kept in memory
+
+# SQLite tuning: WAL journal, one writer connection plus a pool of read-only readers
+SQLITE_SYNCHRONOUS = os.getenv("AGNI_SQLITE_SYNC", "NORMAL")   # NORMAL is durable enough under WAL
+SQLITE_CACHE_KB = int(os.getenv("AGNI_SQLITE_CACHE_KB", "16384"))
+SQLITE_MMAP_MB = int(os.getenv("AGNI_SQLITE_MMAP_MB", "256"))
+SQLITE_STATEMENTS = int(os.getenv("AGNI_SQLITE_STATEMENTS", "256"))  # prepared statements cached per connection
+DB_READERS = int(os.getenv("AGNI_DB_READERS", "4"))
+
+STATS_CACHE_SIZE = int(os.getenv("AGNI_STATS_CACHE", "4096"))  # distinct stat builds memoized
+LEADERBOARD_K = int(os.getenv("AGNI_LEADERBOARD_K", "100"))     # ranks kept in memory per board
+
+# Battles live on the player's row; decoded sessions are kept in memory up to this size
+BATTLE_MEMORY_KB = int(os.getenv("AGNI_BATTLE_MEMORY_KB", "65536"))
+BATTLE_IDLE_SECS = float(os.getenv("AGNI_BATTLE_IDLE_SECS", "300"))  # untouched this long, a battle is over
+
+# Economy ledger: events queue in memory and are written in group commits
+LEDGER_QUEUE = int(os.getenv("AGNI_LEDGER_QUEUE", "10000"))  # events buffered before handlers wait
+LEDGER_BATCH = int(os.getenv("AGNI_LEDGER_BATCH", "1000"))   # most events per commit
+
+# Data backfills run after startup, this many rows per transaction, pausing between chunks
+BACKFILL_CHUNK = int(os.getenv("AGNI_BACKFILL_CHUNK", "1000"))
+BACKFILL_PAUSE = float(os.getenv("AGNI_BACKFILL_PAUSE", "0.05"))
+
+# World bosses: hits add up in memory, are saved every BOSS_FLUSH_SECS, and each
+# boss's status message is edited at most every BOSS_STATUS_SECS
+BOSS_FLUSH_SECS = float(os.getenv("AGNI_BOSS_FLUSH_SECS", "5"))
+BOSS_STATUS_SECS = float(os.getenv("AGNI_BOSS_STATUS_SECS", "2"))
+
+# Online backups: every BACKUP_SECS (0 = off) worker 0 copies the database into
+# BACKUP_DIR, BACKUP_PAGES pages at a time with BACKUP_PAUSE between them, and
+# keeps the newest BACKUP_KEEP copies
+BACKUP_DIR = os.getenv("AGNI_BACKUP_DIR", "backups")
+BACKUP_SECS = float(os.getenv("AGNI_BACKUP_SECS", "3600"))
+BACKUP_KEEP = int(os.getenv("AGNI_BACKUP_KEEP", "24"))
+BACKUP_PAGES = int(os.getenv("AGNI_BACKUP_PAGES", "256"))    # 1 MB with 4 KB pages
+BACKUP_PAUSE = float(os.getenv("AGNI_BACKUP_PAUSE", "0.02"))
+
+# Interaction dispatch (see Dispatcher). Discord drops an interaction that isn't answered within 3s.
+DEFER_AFTER_SECS = float(os.getenv("AGNI_DEFER_AFTER_SECS", "1.5"))    # still unanswered this long after arriving: defer
+DEFER_PREDICT_SECS = float(os.getenv("AGNI_DEFER_PREDICT_SECS", "1"))  # expected to take longer, queue included: defer on arrival
+MAX_INFLIGHT = int(os.getenv("AGNI_MAX_INFLIGHT", "256"))      # handlers running at once
+MAX_QUEUED = int(os.getenv("AGNI_MAX_QUEUED", "16384"))        # waiting for a slot; any more are turned away
+PLAYER_INFLIGHT = int(os.getenv("AGNI_PLAYER_INFLIGHT", "2"))  # the same, per player
+PLAYER_QUEUED = int(os.getenv("AGNI_PLAYER_QUEUED", "4"))
+SHED_AT = float(os.getenv("AGNI_SHED_AT", "0.75"))  # this share of MAX_INFLIGHT busy: leave out cosmetic footers
+
+# Prometheus-format metrics on http://METRICS_HOST:METRICS_PORT/metrics (port 0 turns it off)
+METRICS_HOST = os.getenv("AGNI_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("AGNI_METRICS_PORT", "9108"))
+
 COLORS = {
     "GOLD": 0xFFD700, "CRIMSON": 0xDC143C, "CYAN": 0x00FFFF, "PURPLE": 0x9400D3,
     "GREEN": 0x32CD32, "SAFFRON": 0xFF9933, "VOID": 0x2C2F33, "GATE": 0xFF1493,
@@ -82,172 +171,1741 @@ GAME_TIPS = [
     "Tip: The Naga Dagger heals you on every hit."
 ]
 
+VAHANA_STATS = ("gold_mult", "crit", "hp", "dodge")
+
+def check_game_data():
+    """Raise ValueError if the tables above disagree with each other, so a typo fails at startup, not mid-battle."""
+    problems = []
+    for name, p in PATHS.items():
+        if set(p['stats']) != {"atk", "hp", "crit"}: problems.append(f"path {name}: stats must be atk, hp and crit")
+    for name, r in RECIPES.items():
+        if r['type'] not in ("wep", "arm"): problems.append(f"recipe {name}: type {r['type']!r}")
+        elif ("atk" if r['type'] == "wep" else "hp") not in r: problems.append(f"recipe {name}: no bonus")
+        problems += [f"recipe {name}: unknown material {m!r}" for m in r['cost'] if m not in MATERIALS]
+    for name, v in VAHANAS.items():
+        if v['stat'] not in VAHANA_STATS: problems.append(f"vahana {name}: stat {v['stat']!r}")
+    for name, loc in LOCATIONS.items():
+        problems += [f"location {name}: unknown material {m!r}" for m in loc['mats'] if m not in MATERIALS]
+    if "Ayodhya" not in LOCATIONS: problems.append("no Ayodhya (the default location)")
+    for name, item in ITEMS.items():
+        if item['type'] not in ("heal", "dmg") or item['price'] <= 0: problems.append(f"item {name}: type or price")
+    # Inventory keys and materials share one namespace in the ledger (holdings())
+    names = Counter([*ITEMS, *RECIPES, *VAHANAS, *MATERIALS])
+    problems += [f"{name!r} is defined {n} times" for name, n in names.items() if n > 1]
+    if problems:
+        raise ValueError("Bad game data:\n  " + "\n  ".join(problems))
+
+def freeze(data):
+    """Read-only copy: dicts become mappingproxies and lists tuples."""
+    if isinstance(data, dict): return MappingProxyType({k: freeze(v) for k, v in data.items()})
+    if isinstance(data, list): return tuple(freeze(v) for v in data)
+    return data
+
+# Checked and frozen once at import; the option lists and stat tables built
+# from them below are shared by every command, so nothing may edit them.
+check_game_data()
+PATHS, MATERIALS, RECIPES, VAHANAS, LOCATIONS, ITEMS = map(freeze, (PATHS, MATERIALS, RECIPES, VAHANAS, LOCATIONS, ITEMS))
+
+def select_options(*options):
+    """A menu's SelectOptions, built once. Pass list(...) of them to each ui.Select."""
+    options = tuple(discord.SelectOption(**o) for o in options)
+    if len(options) > 25 or any(len(o.label) > 100 or len(o.description or "") > 100 for o in options):
+        raise ValueError(f"Discord allows 25 options with labels and descriptions of 100 characters: {options}")
+    return options
+
+# ==============================================================================
+# 📈 METRICS
+# ==============================================================================
+
+# Histogram bucket upper bounds in seconds; a final +Inf bucket is implied
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram:
+    __slots__ = ("counts", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+
+    def observe(self, secs):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, secs)] += 1
+        self.sum += secs
+
+class Metrics:
+    """Latency histograms recorded on the hot path, served as Prometheus text.
+
+    Recording is a dict lookup, a bisect and two adds. Everything else
+    (query counts, cache hit rates, live views) is read off the objects
+    that already track it when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self.handlers = defaultdict(Histogram)  # "/battle", "CombatView.attack", ... -> run time
+        self.sql = defaultdict(Histogram)       # "fetch", "run", "run_many", "commit" -> time
+        self.loop_lag = Histogram()
+        self.views = weakref.WeakSet()          # every AgniView made; live ones aren't finished
+        self.startup = {}                       # phase -> seconds, filled in by AgniBot
+        self._runner = None
+        self._lag_task = None
+
+    def time_handler(self, name):
+        """Record the current task's run time under name once it finishes.
+
+        discord.py runs every interaction in its own task, so this covers the
+        whole handler, including its response.
+        """
+        t = time.perf_counter()
+        asyncio.current_task().add_done_callback(lambda _: self.handlers[name].observe(time.perf_counter() - t))
+
+    async def start(self, host=METRICS_HOST, port=METRICS_PORT):
+        self._lag_task = asyncio.create_task(self._sample_lag())
+        if not port: return
+        app = web.Application()
+        app.router.add_get("/metrics", self._serve)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"📈 Metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._lag_task: self._lag_task.cancel()
+        if self._runner: await self._runner.cleanup()
+
+    async def _sample_lag(self, interval=0.5):
+        while True:
+            t = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.loop_lag.observe(max(0.0, time.perf_counter() - t - interval))
+
+    async def _serve(self, request):
+        return web.Response(body=self.render().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    def render(self):
+        out = []
+
+        def header(name, kind, text):
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        def histogram(name, text, series):
+            header(name, "histogram", text)
+            for labels, h in series:
+                total, lab = 0, f"{labels}," if labels else ""
+                for le, n in zip(LATENCY_BUCKETS + ("+Inf",), h.counts):
+                    total += n
+                    out.append(f'{name}_bucket{{{lab}le="{le}"}} {total}')
+                out.append(f"{name}_sum{{{labels}}} {h.sum:.6f}")
+                out.append(f"{name}_count{{{labels}}} {total}")
+
+        def sample(name, kind, text, series):
+            header(name, kind, text)
+            out.extend(f"{name}{{{labels}}} {value}" for labels, value in series)
+
+        histogram("agni_handler_seconds", "Time to handle a slash command or component interaction.",
+                  [(f'handler="{k}"', h) for k, h in sorted(self.handlers.items())])
+        histogram("agni_db_seconds", "Time spent in SQLite calls, by kind.",
+                  [(f'op="{k}"', h) for k, h in sorted(self.sql.items())])
+        histogram("agni_loop_lag_seconds", "How late a 0.5s sleep on the event loop wakes up.", [("", self.loop_lag)])
+        sample("agni_interactions_total", "counter", "Interactions handled.",
+               [(f'handler="{k}"', v) for k, v in sorted(COMMAND_CALLS.items())])
+        sample("agni_db_queries_total", "counter", "SQL statements executed, by the handler that caused them.",
+               [(f'handler="{k}"', v) for k, v in sorted(QUERY_COUNTS.items())])
+        sample("agni_db_commits_total", "counter", "Transactions committed.", [("", db.store.commits)])
+        # Battles and bosses each have one persistent view for every message, so they're counted on their own
+        live = Counter({"CraftingView": 0, "MountView": 0})
+        live.update(type(v).__name__ for v in list(self.views) if not v.is_finished() and not isinstance(v, (CombatView, BossView)))
+        sample("agni_live_views", "gauge", "Views still accepting clicks.", [(f'view="{k}"', v) for k, v in sorted(live.items())])
+        sample("agni_battles_active", "gauge", "Battles played on this worker in the last AGNI_BATTLE_IDLE_SECS.", [("", battles.active())])
+        stats = derived_stats.cache_info()
+        sample("agni_cache_hits_total", "counter", "Cache hits.", [('cache="players"', db.hits), ('cache="stats"', stats.hits)])
+        sample("agni_cache_misses_total", "counter", "Cache misses.", [('cache="players"', db.misses), ('cache="stats"', stats.misses)])
+        sample("agni_cache_entries", "gauge", "Entries held.",
+               [('cache="players"', len(db.users)), ('cache="stats"', stats.currsize), ('cache="battles"', len(battles.sessions))])
+        sample("agni_battle_session_bytes", "gauge", "Estimated memory held by decoded battle sessions.", [("", battles.bytes)])
+        sample("agni_dirty_players", "gauge", "Players with changes not yet flushed.", [("", len(db.dirty))])
+        sample("agni_ledger_events_total", "counter", "Economy events written to the ledger.", [("", ledger.written)])
+        sample("agni_ledger_queue", "gauge", "Ledger events waiting to be written.", [("", ledger.queue.qsize())])
+        sample("agni_ledger_waits_total", "counter", "Times a handler waited for room in the full ledger queue.", [("", ledger.waits)])
+        sample("agni_boss_hits_total", "counter", "World boss hits counted.", [("", bosses.hits)])
+        sample("agni_boss_unsaved", "gauge", "Players with world boss damage not yet saved.",
+               [("", sum(len(b.pending) for b in bosses.live.values()))])
+        sample("agni_boss_status_edits_total", "counter", "World boss status message edits.", [("", bosses.edits)])
+        sample("agni_interactions_deferred_total", "counter", "Interactions deferred by the dispatcher: predicted slow, or late.",
+               [(f'why="{k}"', dispatcher.deferred[k]) for k in ("predicted", "late")])
+        sample("agni_interactions_turned_away_total", "counter", "Interactions answered busy because the queues were full.",
+               [("", dispatcher.turned_away)])
+        sample("agni_interactions_running", "gauge", "Handlers running.", [("", dispatcher.running)])
+        sample("agni_interactions_queued", "gauge", "Interactions waiting for a slot.", [("", dispatcher.queued)])
+        sample("agni_footers_shed_total", "counter", "Embed footers left out under load.", [("", dispatcher.shed)])
+        sample("agni_backups_total", "counter", "Database backups, by result.",
+               [('result="ok"', backups.taken), ('result="failed"', backups.failed)])
+        if backups.last:
+            sample("agni_backup_last_timestamp", "gauge", "When the last backup finished (Unix time).", [("", round(backups.last[0]))])
+            sample("agni_backup_last_seconds", "gauge", "How long the last backup took.", [("", round(backups.last[1], 3))])
+            sample("agni_backup_last_bytes", "gauge", "Size of the last backup.", [("", backups.last[2])])
+        sample("agni_startup_seconds", "gauge", "Time spent in each startup phase.",
+               [(f'phase="{k}"', round(v, 6)) for k, v in self.startup.items()])
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+
+# ==============================================================================
+# 🚦 INTERACTION DISPATCH
+# ==============================================================================
+
+class DeferredReply:
+    """interaction.response for an interaction the Dispatcher has taken.
+
+    Until the dispatcher defers it, calls go straight to Discord. After
+    that, handlers still just call send_message/edit_message, and the reply
+    goes out the way a deferred interaction needs: as an edit of the
+    original response or as a follow-up.
+    """
+
+    def __init__(self, interaction, response, command, on_reply=None):
+        self.interaction = interaction
+        self.inner = response
+        self.command = command    # a slash command, rather than a button or select
+        self.deferred = False
+        self.private = False      # deferred ephemerally
+        self.on_reply = on_reply  # called with whether the handler's first reply is ephemeral
+        self._lock = asyncio.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.inner, name)
+
+    def is_done(self):
+        return self.inner.is_done()
+
+    async def defer_early(self, ephemeral=False):
+        """Defer, unless the handler has answered already. Returns whether it did."""
+        async with self._lock:
+            if self.inner.is_done(): return False
+            if self.command:
+                await self.inner.defer(ephemeral=ephemeral, thinking=True)
+            else:
+                await self.inner.defer()  # nothing shows; the message is edited or followed up later
+            self.deferred, self.private = True, ephemeral
+            return True
+
+    async def defer(self, **kwargs):
+        # The handler's own defer() does nothing if the dispatcher got there first
+        async with self._lock:
+            if not self.inner.is_done(): await self.inner.defer(**kwargs)
+
+    def _replying(self, ephemeral):
+        if self.on_reply:
+            self.on_reply(ephemeral)
+            self.on_reply = None
+
+    async def send_message(self, content=None, *, ephemeral=False, **kwargs):
+        self._replying(ephemeral)
+        async with self._lock:
+            if not self.deferred:
+                return await self.inner.send_message(content, ephemeral=ephemeral, **kwargs)
+        if content is not None: kwargs["content"] = content
+        if self.command and ephemeral == self.private:
+            return await self.interaction.edit_original_response(**kwargs)
+        if self.command:
+            # Deferred the other way: "thinking..." can't change who sees it, so it goes
+            await self.interaction.delete_original_response()
+        return await self.interaction.followup.send(ephemeral=ephemeral, **kwargs)
+
+    async def edit_message(self, **kwargs):
+        self._replying(False)
+        async with self._lock:
+            if not self.deferred:
+                return await self.inner.edit_message(**kwargs)
+        return await self.interaction.edit_original_response(**kwargs)
+
+class Dispatcher:
+    """Admission, deferral and load shedding for every interaction.
+
+    admit(), called from the tree's and the views' interaction_check:
+
+    - keeps a smoothed run time per handler (mean plus four deviations,
+      the way TCP estimates round trips) and defers on arrival whenever
+      that, plus the expected wait for a slot, is over DEFER_PREDICT_SECS;
+    - defers any other interaction still unanswered DEFER_AFTER_SECS after
+      it arrived, whether it's running or still waiting for a slot;
+    - runs at most PLAYER_INFLIGHT handlers per player and MAX_INFLIGHT in
+      all, with at most PLAYER_QUEUED / MAX_QUEUED waiting. Anything beyond
+      that is answered straight away with a busy message;
+    - is ``overloaded`` once SHED_AT of MAX_INFLIGHT is busy, and cosmetic
+      extras (embed footers) are left out.
+    """
+
+    def __init__(self, defer_after=DEFER_AFTER_SECS, predict=DEFER_PREDICT_SECS, max_inflight=MAX_INFLIGHT,
+                 max_queued=MAX_QUEUED, player_inflight=PLAYER_INFLIGHT, player_queued=PLAYER_QUEUED, shed_at=SHED_AT):
+        self.defer_after, self.predict = defer_after, predict
+        self.max_inflight, self.max_queued = max_inflight, max_queued
+        self.player_inflight, self.player_queued = player_inflight, player_queued
+        self.shed_at = shed_at
+        self.slots = asyncio.Semaphore(max_inflight)
+        self.running = 0
+        self.queued = 0
+        self.players = {}          # uid -> [Semaphore, interactions admitted and not finished]
+        self.estimates = {}        # handler -> [mean, deviation] of its run time, seconds
+        self.service = 0.0         # smoothed run time of every handler, for the wait in the queue
+        self.private = {}          # handler -> smoothed share of first replies that were ephemeral
+        self.deferred = Counter()  # "predicted" / "late" -> interactions deferred
+        self.turned_away = 0
+        self.shed = 0              # footers left out
+
+    @property
+    def overloaded(self):
+        return self.running + self.queued >= self.shed_at * self.max_inflight
+
+    def expected(self, name):
+        """How long an interaction for handler name arriving now should take to run, queue included."""
+        mean, dev = self.estimates.get(name, (0.0, 0.0))
+        return mean + 4 * dev + self.queued / self.max_inflight * self.service
+
+    def _observe(self, name, secs):
+        self.service += (secs - self.service) / 8
+        e = self.estimates.get(name)
+        if e is None:
+            self.estimates[name] = [secs, secs / 2]
+            return
+        e[1] += (abs(secs - e[0]) - e[1]) / 4
+        e[0] += (secs - e[0]) / 8
+
+    def _note_reply(self, name, ephemeral):
+        share = self.private.get(name, 0.0)
+        self.private[name] = share + (ephemeral - share) / 8
+
+    async def _defer(self, reply, name, why):
+        try:
+            if await reply.defer_early(ephemeral=self.private.get(name, 0.0) >= 0.5):
+                self.deferred[why] += 1
+        except discord.HTTPException as e:
+            print(f"⚠️ Could not defer {name}: {e}")
+
+    async def admit(self, interaction, name):
+        """Take an interaction for handler ``name``. False if it was turned away (it has been answered)."""
+        uid = interaction.user.id
+        p = self.players.setdefault(uid, [asyncio.Semaphore(self.player_inflight), 0])
+        if p[1] >= self.player_inflight + self.player_queued or (self.slots.locked() and self.queued >= self.max_queued):
+            if not p[1]: del self.players[uid]
+            self.turned_away += 1
+            await interaction.response.send_message("⏳ Agni is very busy right now. Try again in a moment.", ephemeral=True)
+            return False
+        p[1] += 1
+        reply = DeferredReply(interaction, interaction.response,
+                              interaction.type == discord.InteractionType.application_command,
+                              lambda ephemeral: self._note_reply(name, ephemeral))
+        interaction._cs_response = reply  # where discord.py caches interaction.response
+        watchdog, held, started = None, [], None
+        if self.expected(name) > self.predict:
+            await self._defer(reply, name, "predicted")
+        elif self.defer_after != math.inf:
+            watchdog = asyncio.get_running_loop().call_later(
+                self.defer_after, lambda: asyncio.ensure_future(self._defer(reply, name, "late")))
+
+        def done(_):
+            if watchdog: watchdog.cancel()
+            for slots in held: slots.release()
+            if started is not None:
+                self.running -= 1
+                self._observe(name, time.perf_counter() - started)
+            p[1] -= 1
+            if not p[1]: self.players.pop(uid, None)
+        asyncio.current_task().add_done_callback(done)
+        self.queued += 1
+        try:
+            for slots in (p[0], self.slots):
+                await slots.acquire()
+                held.append(slots)
+        finally:
+            self.queued -= 1
+        self.running += 1
+        started = time.perf_counter()
+        return True
+
+dispatcher = Dispatcher()
+
 # ==============================================================================
 # 🗄️ DATABASE
 # ==============================================================================
 
+# battle: the player's BattleSession as JSON (NULL when not fighting)
+USER_COLS = ["user_id", "path", "level", "xp", "hp", "max_hp", "gold", "rebirths", "location", "battle", "last_regen_at"]
+
+# Dict-valued player fields live in child tables, one row per key:
+# field -> (table, key column, value column)
+CHILD_TABLES = {
+    "inventory": ("inventory", "item", "qty"),
+    "materials": ("materials", "mat", "qty"),
+    "equipment": ("equipment", "slot", "item"),
+}
+DEFAULT_EQUIPMENT = {"wep": "None", "arm": "None", "mount": "None"}
+START_INVENTORY = {"Soma": 5}
+
+# Per-command query accounting. The tree and AgniView tag each interaction with
+# a name; every statement Database runs is charged to whatever is current.
+current_command = contextvars.ContextVar("current_command", default="startup")
+COMMAND_CALLS = Counter()  # name -> interactions handled
+QUERY_COUNTS = Counter()   # name -> SQL statements executed
+
+def start_command(name):
+    current_command.set(name)
+    COMMAND_CALLS[name] += 1
+    metrics.time_handler(name)
+
+def queries_per_command():
+    return {name: round(QUERY_COUNTS[name] / max(1, COMMAND_CALLS[name]), 2) for name in sorted(QUERY_COUNTS)}
+
+# One statement (so one round trip and one snapshot): the users row repeated
+# next to each child-table row, or once with NULLs if there are none.
+GET_USER_SQL = (
+    f"SELECT {', '.join('u.' + c for c in USER_COLS)}, c.field, c.k, c.v FROM users u LEFT JOIN ("
+    + " UNION ALL ".join(
+        f"SELECT '{field}' AS field, {key} AS k, {val} AS v FROM {table} WHERE user_id = :uid"
+        for field, (table, key, val) in CHILD_TABLES.items()
+    )
+    + ") c ON 1 WHERE u.user_id = :uid"
+)
+
+BOSS_PAID_SQL = "UPDATE boss_damage SET paid = 1 WHERE boss_id = ? AND user_id = ?"
+
 class Database:
-    def __init__(self, db_name="agni_v14.db"):
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
-
-    def create_tables(self):
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                path TEXT DEFAULT 'None',
-                level INTEGER DEFAULT 1,
-                xp INTEGER DEFAULT 0,
-                hp INTEGER DEFAULT 100,
-                max_hp INTEGER DEFAULT 100,
-                gold INTEGER DEFAULT 0,
-                rebirths INTEGER DEFAULT 0,
-                location TEXT DEFAULT 'Ayodhya',
-                inventory TEXT DEFAULT '{}',
-                materials TEXT DEFAULT '{}',
-                equipment TEXT DEFAULT '{"wep": "None", "arm": "None", "mount": "None"}'
+    """Async SQLite store. All queries run on aiosqlite's worker threads so
+    the gateway event loop never blocks on disk I/O.
+
+    The file runs in WAL mode with one writer connection (``conn``) and a
+    pool of read-only connections, so reads never queue behind a commit.
+    """
+
+    def __init__(self, db_name=DB_PATH, readers=DB_READERS):
+        self.db_name = db_name
+        self.conn = None
+        self.readers = None
+        self.n_readers = readers if db_name != ":memory:" else 0
+        self.commits = 0
+        self._write_lock = asyncio.Lock()  # one transaction at a time on the writer
+        self.backfilling = set()           # BACKFILLS names not finished yet
+        self._backfills = None
+        self._closing = False
+
+    async def _open(self, readonly=False):
+        if readonly:
+            conn = await aiosqlite.connect(f"file:{self.db_name}?mode=ro", uri=True,
+                                           cached_statements=SQLITE_STATEMENTS, isolation_level=None)
+        else:
+            conn = await aiosqlite.connect(self.db_name, cached_statements=SQLITE_STATEMENTS)
+        for pragma in (f"synchronous={SQLITE_SYNCHRONOUS}", f"cache_size=-{SQLITE_CACHE_KB}",
+                       f"mmap_size={SQLITE_MMAP_MB * 1024 * 1024}", "busy_timeout=5000", "temp_store=MEMORY"):
+            await conn.execute_fetchall(f"PRAGMA {pragma}")
+        if readonly:
+            await conn.execute_fetchall("PRAGMA query_only=1")
+        return conn
+
+    async def connect(self):
+        self.conn = await self._open()
+        await self.conn.execute_fetchall("PRAGMA journal_mode=WAL")
+        await self.migrate()
+        self.backfilling = {name for name, _ in BACKFILLS if await self.get_meta(f"backfill:{name}") != "done"}
+        if "inventory" not in await self.columns("users"):
+            self.backfilling.discard("json_inventories")  # made after agni_v14: nothing to move
+        if self.n_readers:
+            # A Semaphore rather than a Queue: it hands freed readers to waiters
+            # in FIFO order, so a busy coroutine can't keep grabbing one back.
+            self.readers = [await self._open(readonly=True) for _ in range(self.n_readers)]
+            self._reader_slots = asyncio.Semaphore(self.n_readers)
+        if self.backfilling:
+            self._backfills = asyncio.create_task(self.run_backfills())
+
+    async def close(self):
+        if self._backfills:
+            # Let the current chunk commit; the next start carries on from there
+            self._closing = True
+            await self._backfills
+            self._backfills = None
+        if self.readers:
+            for conn in self.readers:
+                await conn.close()
+            self.readers = None
+        if self.conn:
+            await self.conn.close()
+            self.conn = None
+
+    async def fetch(self, sql, params=()):
+        """Run a read query on a pooled reader (or the writer if there are none)."""
+        QUERY_COUNTS[current_command.get()] += 1
+        t = time.perf_counter()
+        try:
+            if not self.readers:
+                return await self.conn.execute_fetchall(sql, params)
+            async with self._reader_slots:
+                conn = self.readers.pop()
+                try:
+                    return await conn.execute_fetchall(sql, params)
+                finally:
+                    self.readers.append(conn)
+        finally:
+            metrics.sql["fetch"].observe(time.perf_counter() - t)
+
+    async def run(self, sql, params=()):
+        # Close cursors straight away: sqlite3 can't rebind a cached statement
+        # that a lingering cursor from another coroutine still holds.
+        QUERY_COUNTS[current_command.get()] += 1
+        t = time.perf_counter()
+        async with self.conn.execute(sql, params): pass
+        metrics.sql["run"].observe(time.perf_counter() - t)
+
+    async def run_many(self, sql, rows):
+        QUERY_COUNTS[current_command.get()] += 1
+        t = time.perf_counter()
+        async with self.conn.executemany(sql, rows): pass
+        metrics.sql["run_many"].observe(time.perf_counter() - t)
+
+    async def commit(self):
+        QUERY_COUNTS[current_command.get()] += 1
+        t = time.perf_counter()
+        await self.conn.commit()
+        metrics.sql["commit"].observe(time.perf_counter() - t)
+        self.commits += 1
+
+    async def columns(self, table):
+        return {row[1] for row in await self.conn.execute_fetchall(f"PRAGMA table_info({table})")}
+
+    async def add_column(self, table, column, decl):
+        if column not in await self.columns(table):
+            await self.run(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+    async def migrate(self):
+        """Apply every MIGRATIONS entry not yet in schema_version, in order.
+
+        Each runs in its own BEGIN IMMEDIATE transaction together with its
+        schema_version row, so it is either applied or not, and when several
+        workers start at once only one applies it. Migrations only change the
+        schema; rewriting existing rows is a BACKFILLS entry (run_backfills).
+        """
+        await self.run("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at REAL NOT NULL
             )
         """)
-        # Migration: Add rebirths if missing for old DBs
-        try:
-            self.cursor.execute("ALTER TABLE users ADD COLUMN rebirths INTEGER DEFAULT 0")
-        except:
-            pass
-        self.conn.commit()
-
-    def get_user(self, uid):
-        self.cursor.execute("SELECT * FROM users WHERE user_id = ?", (uid,))
-        res = self.cursor.fetchone()
-        if res:
-            cols = ["user_id", "path", "level", "xp", "hp", "max_hp", "gold", "rebirths", "location", "inventory", "materials", "equipment"]
-            d = dict(zip(cols, res))
-            for k in ["inventory", "materials", "equipment"]:
-                d[k] = json.loads(d[k])
+        await self.conn.commit()
+        applied = {v for v, in await self.conn.execute_fetchall("SELECT version FROM schema_version")}
+        for version, name, apply in MIGRATIONS:
+            if version in applied: continue
+            async with self.transaction():
+                if await self.conn.execute_fetchall("SELECT 1 FROM schema_version WHERE version = ?", (version,)):
+                    continue  # another worker got there first
+                await apply(self)
+                await self.run("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                               (version, name, time.time()))
+            print(f"🧱 Schema migration {version} applied: {name}")
+
+    async def run_backfills(self):
+        """Work through every unfinished BACKFILLS entry, BACKFILL_CHUNK rows per transaction.
+
+        The cursor is saved with each chunk (meta "backfill:<name>"), so a
+        restart carries on where it stopped, and the writer is free for
+        handlers between chunks. Rows not reached yet are migrated when read.
+        """
+        current_command.set("backfill")
+        for name, step in BACKFILLS:
+            if name not in self.backfilling: continue
+            key, chunks, t = f"backfill:{name}", 0, time.perf_counter()
+            while not self._closing:
+                async with self.transaction():
+                    # Read under the write lock: with several workers each chunk is done once
+                    saved = await self.conn.execute_fetchall("SELECT value FROM meta WHERE key = ?", (key,))
+                    if saved and saved[0][0] == "done":
+                        cursor = None  # another worker finished it
+                    else:
+                        cursor = await step(self, json.loads(saved[0][0]) if saved else None, BACKFILL_CHUNK)
+                    await self.run("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                                   (key, "done" if cursor is None else json.dumps(cursor)))
+                chunks += 1
+                if cursor is None:
+                    self.backfilling.discard(name)
+                    print(f"📦 Backfill {name} finished: {chunks} chunks in {time.perf_counter() - t:.1f}s")
+                    break
+                if chunks % 100 == 0:
+                    print(f"📦 Backfill {name}: {chunks} chunks, at {cursor}")
+                await asyncio.sleep(BACKFILL_PAUSE)
+
+    async def _copy_json(self, rows):
+        """(user_id, inventory, materials, equipment) JSON rows into the child tables; NULLs the blobs."""
+        for (table, key, val), i in zip(CHILD_TABLES.values(), range(1, 4)):
+            await self.run_many(
+                # OR IGNORE: never clobber rows written since by the new code
+                f"INSERT OR IGNORE INTO {table} (user_id, {key}, {val}) VALUES (?, ?, ?)",
+                [(r[0], k, v) for r in rows for k, v in json.loads(r[i] or "{}").items()])
+        await self.run_many("UPDATE users SET inventory=NULL, materials=NULL, equipment=NULL WHERE user_id=?",
+                            [(r[0],) for r in rows])
+
+    async def _migrate_json_user(self, uid, writer):
+        # A player the json_inventories backfill hasn't reached yet: move them now, before the read
+        sql = "SELECT user_id, inventory, materials, equipment FROM users WHERE user_id = ? AND inventory IS NOT NULL"
+        if writer:
+            rows = await self.conn.execute_fetchall(sql, (uid,))  # already inside the caller's transaction
+            if rows: await self._copy_json(rows)
+        elif await self.fetch(sql, (uid,)):
+            async with self.transaction():
+                await self._copy_json(await self.conn.execute_fetchall(sql, (uid,)))
+
+    async def get_user(self, uid, writer=False):
+        if "json_inventories" in self.backfilling:
+            await self._migrate_json_user(uid, writer)
+        if writer:
+            # Inside a transaction(): read on the writer so the row is locked in
+            QUERY_COUNTS[current_command.get()] += 1
+            rows = await self.conn.execute_fetchall(GET_USER_SQL, {"uid": uid})
+        else:
+            rows = await self.fetch(GET_USER_SQL, {"uid": uid})
+        if rows:
+            n = len(USER_COLS)
+            d = dict(zip(USER_COLS, rows[0][:n]))
+            d["inventory"], d["materials"], d["equipment"] = {}, {}, dict(DEFAULT_EQUIPMENT)
+            for field, k, v in (r[n:] for r in rows):
+                if field: d[field][k] = v
             return d
         return None
 
-    def create_user(self, uid, path="Kshatriya"):
-        if not self.get_user(uid):
-            p_stats = PATHS[path]["stats"]
-            hp = 100 + p_stats["hp"]
-            inv = json.dumps({"Soma": 5}) # Start with 5 Soma
-            self.cursor.execute("INSERT INTO users (user_id, path, hp, max_hp, inventory) VALUES (?, ?, ?, ?, ?)", (uid, path, hp, hp, inv))
-            self.conn.commit()
-            return True
-        return False
+    async def create_user(self, uid, path="Kshatriya"):
+        p_stats = PATHS[path]["stats"]
+        hp = 100 + p_stats["hp"]
+        async with self._write_lock:
+            QUERY_COUNTS[current_command.get()] += 1
+            now = time.time()
+            async with self.conn.execute("INSERT OR IGNORE INTO users (user_id, path, hp, max_hp, last_regen_at, updated_at) "
+                                         "VALUES (?, ?, ?, ?, ?, ?)", (uid, path, hp, hp, now, now)) as cur:
+                created = cur.rowcount == 1
+            if created:
+                await self.run_many("INSERT INTO inventory (user_id, item, qty) VALUES (?, ?, ?)",
+                                    [(uid, item, qty) for item, qty in START_INVENTORY.items()])
+            await self.commit()
+        return created
+
+    async def update_user(self, uid, data):
+        await self.write_many([(uid, data)])
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT on the writer.
+
+        IMMEDIATE takes SQLite's write lock up front, so reads inside see the
+        latest committed rows and no other process can write until COMMIT.
+        Use _write() for the changes; an exception rolls everything back.
+        """
+        async with self._write_lock:
+            await self.run("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                await self.conn.rollback()
+                raise
+            await self.commit()
+
+    async def get_meta(self, key):
+        rows = await self.fetch("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0][0] if rows else None
 
-    def update_user(self, uid, data):
-        clauses, vals = [], []
-        for k, v in data.items():
-            if k == "user_id": continue
-            clauses.append(f"{k}=?")
-            vals.append(json.dumps(v) if isinstance(v, (list, dict)) else v)
-        vals.append(uid)
-        self.cursor.execute(f"UPDATE users SET {', '.join(clauses)} WHERE user_id=?", vals)
-        self.conn.commit()
+    async def set_meta(self, key, value):
+        async with self._write_lock:
+            await self.run("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+            await self.commit()
 
-db = Database()
+    async def write_ledger(self, events):
+        """Append (at, user_id, kind, item, delta) events and fold them into ledger_daily, in one transaction."""
+        daily = defaultdict(lambda: [0, 0, 0])  # (user_id, day, kind, item) -> [events, gained, spent]
+        for at, uid, kind, item, delta in events:
+            r = daily[(uid, time.strftime("%Y-%m-%d", time.gmtime(at)), kind, item)]
+            r[0] += 1
+            r[1 if delta > 0 else 2] += abs(delta)
+        async with self._write_lock:
+            await self.run_many("INSERT INTO ledger (at, user_id, kind, item, delta) VALUES (?, ?, ?, ?, ?)", events)
+            await self.run_many(
+                "INSERT INTO ledger_daily (user_id, day, kind, item, events, gained, spent) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (user_id, day, kind, item) DO UPDATE SET events = events + excluded.events, "
+                "gained = gained + excluded.gained, spent = spent + excluded.spent",
+                [(*k, *v) for k, v in daily.items()])
+            await self.commit()
+
+    async def player_history(self, uid, days=7):
+        """[(day, kind, item, events, gained, spent)] for uid's last ``days`` days, newest first."""
+        since = time.strftime("%Y-%m-%d", time.gmtime(time.time() - (days - 1) * 86400))
+        return await self.fetch(
+            "SELECT day, kind, item, events, gained, spent FROM ledger_daily WHERE user_id = ? AND day >= ? "
+            "ORDER BY day DESC, kind, item", (uid, since))
+
+    async def economy_report(self, first_day, last_day=None):
+        """[(kind, item, events, gained, spent)] across every player, for UTC days first_day..last_day."""
+        return await self.fetch(
+            "SELECT kind, item, SUM(events), SUM(gained), SUM(spent) FROM ledger_daily WHERE day BETWEEN ? AND ? "
+            "GROUP BY kind, item ORDER BY kind, item", (first_day, last_day or first_day))
+
+    async def create_boss(self, channel_id, name, lvl, max_hp):
+        """A new live boss in channel_id; returns its row, or None if the channel already has one."""
+        async with self._write_lock:
+            try:
+                async with self.conn.execute(
+                        "INSERT INTO world_bosses (channel_id, name, lvl, max_hp, hp, started_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (channel_id, name, lvl, max_hp, max_hp, time.time())) as cur:
+                    boss_id = cur.lastrowid
+            except aiosqlite.IntegrityError:
+                return None
+            await self.commit()
+        return (boss_id, channel_id, None, name, lvl, max_hp, max_hp)
+
+    async def live_boss(self, channel_id):
+        """(id, channel_id, message_id, name, lvl, max_hp, hp) of channel_id's live boss, or None."""
+        rows = await self.fetch("SELECT id, channel_id, message_id, name, lvl, max_hp, hp FROM world_bosses "
+                                "WHERE channel_id = ? AND ended_at IS NULL", (channel_id,))
+        return rows[0] if rows else None
+
+    async def boss_damage(self, boss_id):
+        """[(user_id, damage, hits, paid)] saved for a boss, most damage first."""
+        return await self.fetch("SELECT user_id, damage, hits, paid FROM boss_damage WHERE boss_id = ? "
+                                "ORDER BY damage DESC, user_id", (boss_id,))
+
+    async def write_boss_damage(self, bosses):
+        """Add [(boss_id, hp, [(user_id, damage, hits)])] to the saved totals, in one transaction."""
+        async with self._write_lock:
+            await self.run_many(
+                "INSERT INTO boss_damage (boss_id, user_id, damage, hits) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (boss_id, user_id) DO UPDATE SET damage = damage + excluded.damage, hits = hits + excluded.hits",
+                [(boss_id, *c) for boss_id, _, contributions in bosses for c in contributions])
+            await self.run_many("UPDATE world_bosses SET hp = ? WHERE id = ?", [(hp, boss_id) for boss_id, hp, _ in bosses])
+            await self.commit()
+
+    async def update_boss(self, boss_id, **fields):
+        async with self._write_lock:
+            await self.run(f"UPDATE world_bosses SET {', '.join(f'{k} = ?' for k in fields)} WHERE id = ?",
+                           (*fields.values(), boss_id))
+            await self.commit()
+
+    async def write_many(self, rows, members=(), paid=()):
+        """Apply a batch of (uid, changes) in one transaction (see _write)."""
+        async with self._write_lock:
+            await self._write(rows, members, paid)
+            await self.commit()
+
+    async def _write(self, rows, members=(), paid=()):
+        """Apply a batch of (uid, changes) to the open transaction.
+
+        Scalar fields are written as columns. Dict fields (CHILD_TABLES) are
+        patches: each key is upserted, and a value of None deletes the key.
+        Every row written gets a new updated_at, for incremental exports.
+        ``members`` are new (guild_id, user_id) pairs to record, and
+        ``paid`` (boss_id, user_id) world boss rewards to mark as paid.
+        """
+        updates, upserts, deletes = {}, {}, {}
+        now = time.time()
+        for uid, data in rows:
+            cols = ["updated_at"]
+            for k, v in data.items():
+                if k == "user_id": continue
+                if k in CHILD_TABLES:
+                    for key, qty in v.items():
+                        if qty is None: deletes.setdefault(k, []).append((uid, key))
+                        else: upserts.setdefault(k, []).append((uid, key, qty))
+                else:
+                    cols.append(k)
+            # Group rows touching the same columns into one executemany
+            cols.sort()
+            updates.setdefault(tuple(cols), []).append([now if k == "updated_at" else data[k] for k in cols] + [uid])
+
+        for cols, vals in updates.items():
+            sets = ", ".join(f"{k}=?" for k in cols)
+            await self.run_many(f"UPDATE users SET {sets} WHERE user_id=?", vals)
+        for field, vals in upserts.items():
+            table, key, val = CHILD_TABLES[field]
+            await self.run_many(
+                f"INSERT INTO {table} (user_id, {key}, {val}) VALUES (?, ?, ?) "
+                f"ON CONFLICT (user_id, {key}) DO UPDATE SET {val}=excluded.{val}", vals)
+        for field, vals in deletes.items():
+            table, key, _ = CHILD_TABLES[field]
+            await self.run_many(f"DELETE FROM {table} WHERE user_id=? AND {key}=?", vals)
+        if members:
+            await self.run_many("INSERT OR IGNORE INTO guild_members (guild_id, user_id) VALUES (?, ?)", members)
+        if paid:
+            await self.run_many(BOSS_PAID_SQL, paid)
+
+# Schema history, applied in order by Database.migrate(). Append only: never
+# change a migration once released. Each is written to be a no-op on
+# databases made before schema_version existed.
+
+async def _m1_base(db):
+    await db.run("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            path TEXT DEFAULT 'None',
+            level INTEGER DEFAULT 1,
+            xp INTEGER DEFAULT 0,
+            hp INTEGER DEFAULT 100,
+            max_hp INTEGER DEFAULT 100,
+            gold INTEGER DEFAULT 0,
+            rebirths INTEGER DEFAULT 0,
+            location TEXT DEFAULT 'Ayodhya'
+        )
+    """)
+    await db.add_column("users", "rebirths", "INTEGER DEFAULT 0")  # agni_v13 and older
+    await db.run("""
+        CREATE TABLE IF NOT EXISTS guild_members (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        ) WITHOUT ROWID
+    """)
+
+async def _m2_child_tables(db):
+    # agni_v14 kept these as JSON on users; the json_inventories backfill moves them
+    for table, key, val in CHILD_TABLES.values():
+        await db.run(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                user_id INTEGER NOT NULL,
+                {key} TEXT NOT NULL,
+                {val} NOT NULL,
+                PRIMARY KEY (user_id, {key})
+            ) WITHOUT ROWID
+        """)
+
+async def _m3_leaderboard_indexes(db):
+    # Each board is an ordered walk of its index
+    for board, cols in LEADERBOARDS.items():
+        order = ", ".join(f"{c} DESC" for c in cols)
+        await db.run(f"CREATE INDEX IF NOT EXISTS idx_users_{board} ON users ({order}, user_id)")
+
+async def _m4_meta(db):
+    await db.run("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        ) WITHOUT ROWID
+    """)
+
+async def _m5_battle(db):
+    await db.add_column("users", "battle", "TEXT")
+
+async def _m6_ledger(db):
+    await db.run("""
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY,
+            at REAL NOT NULL,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            item TEXT NOT NULL,
+            delta INTEGER NOT NULL
+        )
+    """)
+    await db.run("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (user_id, id)")
+    for op in ("UPDATE", "DELETE"):
+        await db.run(f"""
+            CREATE TRIGGER IF NOT EXISTS ledger_no_{op.lower()} BEFORE {op} ON ledger
+            BEGIN SELECT RAISE(ABORT, 'ledger is append-only'); END
+        """)
+    # One row per player, UTC day, kind and item, kept up to date as events are written
+    await db.run("""
+        CREATE TABLE IF NOT EXISTS ledger_daily (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            item TEXT NOT NULL,
+            events INTEGER NOT NULL,
+            gained INTEGER NOT NULL,
+            spent INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day, kind, item)
+        ) WITHOUT ROWID
+    """)
+    await db.run("CREATE INDEX IF NOT EXISTS idx_ledger_daily_day ON ledger_daily (day, kind, item)")
+
+async def _m7_updated_at(db):
+    # Set by every write; manage.py export --state walks the index for what changed
+    await db.add_column("users", "updated_at", "REAL NOT NULL DEFAULT 0")
+    await db.run("CREATE INDEX IF NOT EXISTS idx_users_updated ON users (updated_at)")
+
+async def _m8_last_regen_at(db):
+    # When hp was last brought up to date by regen(); 0 means long ago, so older rows start healed
+    await db.add_column("users", "last_regen_at", "REAL NOT NULL DEFAULT 0")
+
+async def _m9_world_bosses(db):
+    await db.run("""
+        CREATE TABLE IF NOT EXISTS world_bosses (
+            id INTEGER PRIMARY KEY,
+            channel_id INTEGER NOT NULL,
+            message_id INTEGER,
+            name TEXT NOT NULL,
+            lvl INTEGER NOT NULL,
+            max_hp INTEGER NOT NULL,
+            hp INTEGER NOT NULL,
+            started_at REAL NOT NULL,
+            ended_at REAL
+        )
+    """)
+    # At most one live boss per channel
+    await db.run("CREATE UNIQUE INDEX IF NOT EXISTS idx_world_bosses_live ON world_bosses (channel_id) WHERE ended_at IS NULL")
+    await db.run("""
+        CREATE TABLE IF NOT EXISTS boss_damage (
+            boss_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            damage INTEGER NOT NULL,
+            hits INTEGER NOT NULL,
+            PRIMARY KEY (boss_id, user_id)
+        ) WITHOUT ROWID
+    """)
+
+async def _m10_boss_paid(db):
+    # Set in the same transaction as the player's reward, so a restart pays only those left
+    await db.add_column("boss_damage", "paid", "INTEGER NOT NULL DEFAULT 0")
+
+MIGRATIONS = [
+    (1, "users and guild_members", _m1_base),
+    (2, "inventory, materials and equipment tables", _m2_child_tables),
+    (3, "leaderboard indexes", _m3_leaderboard_indexes),
+    (4, "meta", _m4_meta),
+    (5, "users.battle", _m5_battle),
+    (6, "economy ledger", _m6_ledger),
+    (7, "users.updated_at", _m7_updated_at),
+    (8, "users.last_regen_at", _m8_last_regen_at),
+    (9, "world bosses", _m9_world_bosses),
+    (10, "boss_damage.paid", _m10_boss_paid),
+]
+
+async def _backfill_json_inventories(db, after, limit):
+    """agni_v14 JSON inventory/materials/equipment on users -> child tables. Cursor: last user_id."""
+    rows = await db.conn.execute_fetchall(
+        "SELECT user_id, inventory, materials, equipment FROM users WHERE user_id > ? AND inventory IS NOT NULL "
+        "ORDER BY user_id LIMIT ?", (after or -1, limit))
+    await db._copy_json(rows)
+    return rows[-1][0] if len(rows) == limit else None
+
+# Data migrations, run in chunks in the background after startup:
+# (name, step(db, cursor, limit) -> next cursor, or None once done)
+BACKFILLS = [
+    ("json_inventories", _backfill_json_inventories),
+]
+
+# ==============================================================================
+# 🧠 PLAYER CACHE (WRITE-BEHIND)
+# ==============================================================================
+
+def copy_user(u):
+    return {k: (dict(v) if isinstance(v, dict) else v) for k, v in u.items()}
+
+def user_patch(old, new):
+    """What changed from old to new, as a write_many patch (None deletes a key)."""
+    patch = {}
+    for k, v in new.items():
+        if k == "user_id" or old.get(k) == v: continue
+        if k in CHILD_TABLES:
+            patch[k] = {key: v.get(key) for key in old[k].keys() | v.keys() if old[k].get(key) != v.get(key)}
+        else:
+            patch[k] = v
+    # regen() moves last_regen_at on every read at full HP: on its own that's
+    # no reason to write. Any real change takes it along, so hp is never saved
+    # without the time it was worked out at
+    if list(patch) == ["last_regen_at"]: return {}
+    return patch
+
+class PlayerCache:
+    """In-memory players in front of Database.
+
+    Reads are served from memory, updates only record which columns (or, for
+    inventory/materials/equipment, which keys) changed, and a background task
+    writes every dirty player in a single transaction every FLUSH_INTERVAL
+    seconds (or sooner once FLUSH_BATCH are dirty).
+
+    ``watchers`` are called as watcher(uid, player, changed_fields) after
+    every update that changed something.
+
+    Handlers that read a player and write it back should do so inside
+    ``async with db.edit(uid) as u``, which holds that player's lock so two
+    interactions for the same player can't overwrite each other's changes.
+    Different players never wait on each other.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.users = OrderedDict()  # uid -> player dict, least recently used first
+        self.dirty = {}             # uid -> {column, or (field, key) for child tables}
+        self.writing = Counter()    # uid -> flushes committing it right now
+        self.members = set()        # (guild_id, uid) pairs known to be recorded
+        self.new_members = []       # ... and those still to be written
+        self.new_paid = []          # (boss_id, uid) world boss rewards to mark paid with the next flush
+        self.watchers = []
+        self.before_close = []      # coroutine functions awaited by close() while the store is still open
+        self.locks = weakref.WeakValueDictionary()  # uid -> asyncio.Lock, while someone holds it
+        self.hits = 0
+        self.misses = 0
+        self._wake = asyncio.Event()
+        self._writes = set()        # write_many calls of flushes still committing
+        self._closing = False
+        self._task = None
+
+    async def connect(self):
+        await self.store.connect()
+        self._closing = False
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task:
+            # Not cancelled: a flush under way has to finish, or its batch is lost
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        current_command.set("shutdown")
+        try:
+            for hook in self.before_close:
+                # One failing (the ledger's last drain, say) mustn't keep the rest from running
+                try:
+                    await hook()
+                except Exception as e:
+                    print(f"⚠️ Shutdown step {hook.__qualname__} failed: {e}")
+            await self.flush()
+        finally:
+            # Always closed: aiosqlite's threads would otherwise keep the process alive
+            await self.store.close()
+
+    async def get_user(self, uid):
+        u = self.users.get(uid)
+        if u is None:
+            self.misses += 1
+            u = await self.store.get_user(uid)
+            if u is None: return None
+            # Another coroutine may have loaded (and changed) it while we awaited
+            u = self.users.setdefault(uid, u)
+            self._evict()
+        else:
+            self.hits += 1
+            self.users.move_to_end(uid)
+        # Regenerate the copy only: the cached row stays what the database has,
+        # so the new hp is saved with this player's next write, not by a read
+        return regen(copy_user(u))
+
+    async def create_user(self, uid, path="Kshatriya"):
+        if uid in self.users: return False
+        created = await self.store.create_user(uid, path)
+        if created:
+            u = await self.get_user(uid)
+            for watch in self.watchers: watch(uid, u, set(u))
+        return created
+
+    @contextlib.asynccontextmanager
+    async def edit(self, uid, flush=False):
+        """Read-modify-write one player under their lock. Yields None if they don't exist."""
+        lock = self.locks.get(uid)
+        if lock is None:
+            lock = self.locks[uid] = asyncio.Lock()
+        async with lock:
+            u = await self.get_user(uid)
+            yield u
+            if u is not None:
+                await self.update_user(uid, u, flush=flush)
+
+    def note_member(self, guild_id, uid):
+        """Record that uid plays in guild_id. Returns True the first time."""
+        if (guild_id, uid) in self.members: return False
+        self.members.add((guild_id, uid))
+        self.new_members.append((guild_id, uid))
+        return True
+
+    async def note_boss_paid(self, boss_id, uid):
+        """Inside edit(uid): mark uid's boss_id reward paid, saved in the same transaction as the edit."""
+        # Taken by the same flush as the edit: nothing awaits between the two
+        self.new_paid.append((boss_id, uid))
+
+    async def update_user(self, uid, data, flush=False):
+        u = self.users.get(uid)
+        if u is None:
+            # Not through get_user: it may evict the row again before we mark it dirty
+            self.misses += 1
+            u = self.users.setdefault(uid, await self.store.get_user(uid))
+        changed = self.dirty.setdefault(uid, set())
+        for k, v in user_patch(u, data).items():
+            if k in CHILD_TABLES:
+                changed.update((k, key) for key in v)
+                u[k] = dict(data[k])
+            else:
+                u[k] = v
+                changed.add(k)
+        if not changed:
+            del self.dirty[uid]
+        else:
+            for watch in self.watchers: watch(uid, u, changed)
+        if flush:
+            await self.flush()
+        elif len(self.dirty) >= FLUSH_BATCH:
+            self._wake.set()
+
+    async def flush(self):
+        """Write every change made so far. Returns once they have all committed, or raises."""
+        # A flush already under way (the loop's, say) may hold some of them
+        earlier = list(self._writes)
+        if self.dirty or self.new_members or self.new_paid:
+            await self._flush_dirty()
+        if earlier:
+            await asyncio.wait(earlier)  # not gather: our caller being cancelled mustn't cancel theirs
+            if any(w.cancelled() or w.exception() for w in earlier):
+                raise RuntimeError("a flush under way failed; its changes are dirty again")
+
+    async def _flush_dirty(self):
+        batch, self.dirty = self.dirty, {}
+        members, self.new_members = self.new_members, []
+        paid, self.new_paid = self.new_paid, []
+        self.writing.update(batch.keys())
+        rows = []
+        for uid, fields in batch.items():
+            u, data = self.users[uid], {}
+            for f in fields:
+                if isinstance(f, tuple):
+                    field, key = f
+                    data.setdefault(field, {})[key] = u[field].get(key)  # None deletes the key
+                else:
+                    data[f] = u[f]
+            rows.append((uid, data))
+        write = asyncio.ensure_future(self.store.write_many(rows, members, paid))
+        self._writes.add(write)
+        write.add_done_callback(self._writes.discard)
+        try:
+            await write
+        except BaseException:
+            # Keep the changes dirty so the next flush retries them (cancelled too)
+            for uid, fields in batch.items():
+                self.dirty.setdefault(uid, set()).update(fields)
+            self.new_members.extend(members)
+            self.new_paid.extend(paid)
+            raise
+        finally:
+            self.writing.subtract(batch.keys())
+        self._evict()
+
+    def _evict(self):
+        if len(self.users) <= CACHE_SIZE: return
+        for uid in list(self.users):
+            if len(self.users) <= CACHE_SIZE: break
+            # Until its flush commits, the database still has the old row
+            if uid not in self.dirty and self.writing[uid] <= 0:
+                del self.users[uid]
+
+    async def _flush_loop(self):
+        current_command.set("flush")
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ Player flush failed, will retry: {e}")
+
+class SharedPlayerCache(PlayerCache):
+    """PlayerCache for a database file shared by several worker processes.
+
+    Another process can change any player at any moment, so no player is
+    kept between interactions: reads go to the reader pool, and edit()
+    re-reads and writes the player inside one BEGIN IMMEDIATE transaction.
+    SQLite's write lock then orders per-player edits across every process,
+    the same way the per-player asyncio locks do within one.
+    """
+
+    async def get_user(self, uid):
+        self.misses += 1
+        return regen(await self.store.get_user(uid))
+
+    async def create_user(self, uid, path="Kshatriya"):
+        created = await self.store.create_user(uid, path)
+        if created:
+            u = await self.get_user(uid)
+            for watch in self.watchers: watch(uid, u, set(u))
+        return created
+
+    @contextlib.asynccontextmanager
+    async def edit(self, uid, flush=False):
+        patch = None
+        async with self.store.transaction():
+            u = await self.store.get_user(uid, writer=True)
+            old = copy_user(u) if u else None
+            yield regen(u)
+            if u is not None:
+                patch = user_patch(old, u)
+                if patch: await self.store._write([(uid, patch)])
+        if patch:
+            for watch in self.watchers: watch(uid, u, set(patch))
+
+    async def update_user(self, uid, data, flush=False):
+        async with self.edit(uid) as u:
+            if u is not None: u.update(data)
+
+    async def note_boss_paid(self, boss_id, uid):
+        await self.store.run(BOSS_PAID_SQL, (boss_id, uid))  # inside edit()'s transaction
+
+# ==============================================================================
+# 📒 ECONOMY LEDGER
+# ==============================================================================
+
+def holdings(u):
+    """Gold, items and materials as one flat {name: amount}, for diffing with holdings_delta()."""
+    return {"gold": u['gold'], **u['inventory'], **u['materials']}
+
+def equip_delta(old, new):
+    """The ledger deltas for swapping equipment old for new (nothing if it's the same piece)."""
+    if old == new: return {}
+    return {new: 1, **({old: -1} if old != "None" else {})}
+
+def holdings_delta(before, u):
+    after = holdings(u)
+    return {k: after.get(k, 0) - before.get(k, 0) for k in before.keys() | after.keys() if after.get(k, 0) != before.get(k, 0)}
+
+class Ledger:
+    """Append-only record of every gold and item movement.
+
+    Equipment counts as holdings too: a swap records the new piece +1 and
+    the one it replaces -1, so an item's sum is how many players hold it.
+
+    Handlers call record() once their edit has gone through; a background
+    task drains the queue and writes whatever has piled up (up to
+    LEDGER_BATCH events) with one executemany and one commit, updating the
+    ledger_daily rollup in the same transaction. The queue holds at most
+    LEDGER_QUEUE events: when it is full record() waits, so a slow disk
+    slows handlers down rather than growing memory without bound.
+    """
+
+    def __init__(self, cache, maxsize=LEDGER_QUEUE, batch=LEDGER_BATCH):
+        self.store = cache.store
+        self.queue = asyncio.Queue(maxsize)
+        self.batch = batch
+        self.pending = []   # a batch whose write failed, retried first
+        self.written = 0
+        self.waits = 0      # record() calls that found the queue full
+        self._task = None
+        self._writing = None  # the batch being committed, outlives a cancelled _run
+        cache.before_close.append(self.close)
+
+    async def record(self, uid, kind, deltas):
+        """Queue one event per nonzero {item: delta}; "gold" is the gold item."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        at = time.time()
+        for item, delta in deltas.items():
+            if not delta: continue
+            if self.queue.full(): self.waits += 1
+            await self.queue.put((at, uid, kind, item, delta))
+
+    def _fill(self, events):
+        """Top events up from the queue, to at most one batch."""
+        self.pending = []
+        while len(events) < self.batch and not self.queue.empty():
+            events.append(self.queue.get_nowait())
+        return events
+
+    async def _write(self, events):
+        try:
+            await self.store.write_ledger(events)
+        except Exception:
+            self.pending = events
+            raise
+        self.written += len(events)
+
+    async def _run(self):
+        current_command.set("ledger")
+        while True:
+            # Whatever queued while the last batch was committing goes in this one
+            events = self._fill(self.pending or [await self.queue.get()])
+            try:
+                # Shielded: close() cancelling us mustn't abandon a half-written batch
+                self._writing = asyncio.ensure_future(self._write(events))
+                await asyncio.shield(self._writing)
+            except Exception as e:
+                print(f"⚠️ Ledger write failed, will retry: {e}")
+                await asyncio.sleep(1)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._writing:
+            # Let the batch under way commit before the store closes; if it fails it is back in pending
+            with contextlib.suppress(Exception):
+                await self._writing
+            self._writing = None
+        while self.pending or not self.queue.empty():
+            await self._write(self._fill(self.pending))
+
+# ==============================================================================
+# 🏆 LEADERBOARDS
+# ==============================================================================
+
+# board -> score columns, compared in order (ties go to the lower user_id)
+LEADERBOARDS = {
+    "level":    ("level", "xp"),
+    "rebirths": ("rebirths", "level", "xp"),
+    "gold":     ("gold",),
+}
+
+class TopK:
+    """The best K players of one board, kept sorted in memory.
+
+    Entries are (negated score..., uid) so plain tuple order is rank order.
+    If a ranked player drops below the cut, someone not in memory may now
+    outrank them, so the board goes stale and is rebuilt on its next read.
+    """
+
+    def __init__(self, k):
+        self.k = k
+        self.entries = []
+        self.keys = {}  # uid -> entry
+        self.stale = True
+        self.loaded_at = 0.0
+
+    def load(self, rows):
+        self.entries = sorted((tuple(-x for x in score), uid) for uid, *score in rows)
+        self.keys = {e[-1]: e for e in self.entries}
+        self.stale = False
+        self.loaded_at = time.monotonic()
+
+    def update(self, uid, score):
+        entry = (tuple(-x for x in score), uid)
+        # A board with room holds every player; a full one only the top K
+        full = len(self.entries) >= self.k
+        old = self.keys.pop(uid, None)
+        if old is not None:
+            del self.entries[bisect.bisect_left(self.entries, old)]
+        # Still ranked if above the cut, or if they were ranked and only went up
+        # (with K=1 that leaves no cut to compare with)
+        if not full or (self.entries and entry < self.entries[-1]) or (old is not None and entry <= old):
+            bisect.insort(self.entries, entry)
+            self.keys[uid] = entry
+            if len(self.entries) > self.k:
+                del self.keys[self.entries.pop()[-1]]
+        elif old is not None:
+            self.stale = True
+
+    def page(self, offset, limit):
+        return [(e[-1], [-x for x in e[0]]) for e in self.entries[offset:offset + limit]]
+
+class Leaderboards:
+    """Global and per-guild top-K boards fed by the PlayerCache write path.
+
+    Boards are built lazily (an index walk for global, one join for a
+    guild) and then updated in place, so reading any page inside the top K
+    costs no queries. Deeper pages read straight from the index.
+
+    With a ``ttl`` (a database shared with other processes, whose writes
+    never reach this process's watchers) boards are also rebuilt once they
+    are older than ttl seconds.
+
+    A guild's board has the players in guild_members: those who have used a
+    command or button in that guild since the table was added. Nothing
+    recorded before then says which guild a player played in.
+    """
+
+    def __init__(self, cache, k=LEADERBOARD_K, ttl=None):
+        self.cache = cache
+        self.k = k
+        self.ttl = ttl
+        self.boards = {}                      # (guild_id or None, board) -> TopK
+        self.user_guilds = defaultdict(set)   # uid -> guilds whose boards are built
+        self.guild_members = defaultdict(set) # guild_id -> members, for built guilds
+        cache.watchers.append(self)
+
+    def __call__(self, uid, u, changed):
+        for name, cols in LEADERBOARDS.items():
+            if changed.isdisjoint(cols): continue
+            score = [u[c] for c in cols]
+            for guild in (None, *self.user_guilds.get(uid, ())):
+                board = self.boards.get((guild, name))
+                if board and not board.stale: board.update(uid, score)
+
+    def note_member(self, guild_id, uid):
+        if guild_id in self.guild_members and uid not in self.guild_members[guild_id]:
+            self.guild_members[guild_id].add(uid)
+            self.user_guilds[uid].add(guild_id)
+            u = self.cache.users.get(uid)
+            if u: self(uid, u, set(u))
+
+    def _sql(self, name, guild_id, limit, offset=0):
+        cols = LEADERBOARDS[name]
+        order = ", ".join(f"u.{c} DESC" for c in cols) + ", u.user_id"
+        select = f"SELECT u.user_id, {', '.join('u.' + c for c in cols)} FROM users u"
+        if guild_id is None:
+            return f"{select} ORDER BY {order} LIMIT {limit} OFFSET {offset}", ()
+        return (f"{select} JOIN guild_members g ON g.user_id = u.user_id WHERE g.guild_id = ? "
+                f"ORDER BY {order} LIMIT {limit} OFFSET {offset}", (guild_id,))
+
+    async def _board(self, name, guild_id):
+        board = self.boards.setdefault((guild_id, name), TopK(self.k))
+        if board.stale or (self.ttl and time.monotonic() - board.loaded_at > self.ttl):
+            # The index only sees flushed rows; write pending changes first
+            await self.cache.flush()
+            if guild_id is not None and guild_id not in self.guild_members:
+                rows = await self.cache.store.fetch("SELECT user_id FROM guild_members WHERE guild_id = ?", (guild_id,))
+                self.guild_members[guild_id] = {uid for uid, in rows}
+                for uid in self.guild_members[guild_id]: self.user_guilds[uid].add(guild_id)
+            board.load(await self.cache.store.fetch(*self._sql(name, guild_id, self.k)))
+        return board
+
+    async def page(self, name, guild_id=None, page=1, per_page=10):
+        """Returns [(rank, uid, score)] for one page of a board."""
+        offset = (page - 1) * per_page
+        board = await self._board(name, guild_id)
+        if offset + per_page <= board.k:
+            rows = board.page(offset, per_page)
+        else:
+            await self.cache.flush()
+            rows = [(uid, score) for uid, *score in await self.cache.store.fetch(*self._sql(name, guild_id, per_page, offset))]
+        return [(offset + i + 1, uid, score) for i, (uid, score) in enumerate(rows)]
+
+db = (SharedPlayerCache if SHARED_DB else PlayerCache)(Database())
+leaderboards = Leaderboards(db, ttl=LEADERBOARD_TTL if SHARED_DB else None)
+ledger = Ledger(db)
+
+# ==============================================================================
+# 💾 BACKUPS
+# ==============================================================================
+
+class BackupStopped(Exception):
+    pass
+
+def backup_db(src, dest, pages=BACKUP_PAGES, pause=BACKUP_PAUSE, stop=None):
+    """Copy the database at src to a new file dest with SQLite's online backup API. Returns dest's size.
+
+    Blocking, so the bot runs it in a thread. It copies ``pages`` pages per
+    step and sleeps ``pause`` between steps. The whole copy reads one WAL
+    snapshot: without one, each commit the bot made would restart the copy
+    from the first page, and a busy bot would never finish. Writers are
+    never blocked, though the WAL can't be checkpointed past the snapshot
+    until the copy is done. The copy is checked, synced and only then
+    renamed to dest, so dest is either a complete backup or not there.
+    If stop() returns true between steps, the copy is abandoned.
+    """
+    tmp = dest + ".tmp"
+    source = sqlite3.connect(f"file:{src}?mode=ro", uri=True, isolation_level=None)
+    target = sqlite3.connect(tmp, isolation_level=None)
+
+    def step(status, remaining, total):
+        if stop and stop(): raise BackupStopped(f"backup of {src} stopped")
+        time.sleep(pause)
+    try:
+        source.execute("BEGIN")
+        source.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchall()  # takes the snapshot
+        source.backup(target, pages=pages, progress=step)
+        source.execute("COMMIT")
+        target.execute("PRAGMA journal_mode=DELETE")  # one self-contained file
+        problems = target.execute("PRAGMA quick_check").fetchall()
+        if problems != [("ok",)]:
+            raise sqlite3.DatabaseError(f"backup of {src} failed its check: {problems[:3]}")
+        target.close()
+        with open(tmp, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, dest)
+    except BaseException:
+        target.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp)
+        raise
+    finally:
+        source.close()
+    return os.path.getsize(dest)
+
+def restore_db(backup, dest):
+    """Overwrite the database at dest with a backup. Blocking; stop the bot first.
+
+    Goes through the backup API rather than copying the file, so dest's
+    WAL can't be replayed over the restored pages.
+    """
+    source = sqlite3.connect(f"file:{backup}?mode=ro", uri=True)
+    try:
+        problems = source.execute("PRAGMA quick_check").fetchall()
+        if problems != [("ok",)]:
+            raise sqlite3.DatabaseError(f"{backup} failed its check: {problems[:3]}")
+        target = sqlite3.connect(dest)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+
+def backup_files(db_path=DB_PATH, folder=BACKUP_DIR):
+    """db_path's backups in folder, oldest first."""
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    if not os.path.isdir(folder): return []
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                  if f.startswith(stem + "-") and f.endswith(".db"))
+
+def new_backup(db_path=DB_PATH, folder=BACKUP_DIR):
+    """Where the next backup of db_path goes: folder/<name>-<UTC time>.db"""
+    os.makedirs(folder, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(folder, f"{stem}-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}.db")
+
+def prune_backups(db_path=DB_PATH, folder=BACKUP_DIR, keep=BACKUP_KEEP):
+    # [:-0] would be nothing, so keep=0 would quietly keep every backup
+    if keep < 1: raise ValueError(f"keep must be at least 1, not {keep}")
+    for old in backup_files(db_path, folder)[:-keep]:
+        os.remove(old)
+
+class Backups:
+    """Backs the database up every BACKUP_SECS in a thread (see backup_db), keeping the newest BACKUP_KEEP.
+
+    Dirty players are flushed first, so a backup has everything up to the
+    moment it starts. The schedule carries on from the newest backup on
+    disk, so restarting the bot doesn't put the next one off.
+    """
+
+    def __init__(self, cache, folder=BACKUP_DIR, every=BACKUP_SECS, keep=BACKUP_KEEP, pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+        if keep < 1: raise ValueError(f"keep must be at least 1, not {keep}")  # at startup, not after the first backup
+        self.cache = cache
+        self.folder, self.every, self.keep = folder, every, keep
+        self.pages, self.pause = pages, pause
+        self.taken = 0
+        self.failed = 0
+        self.last = None    # (finished at, seconds, bytes) of the last backup taken
+        self._stopping = False
+        self._copy = None   # the thread's future while a backup is being copied
+        self._task = None
+        cache.before_close.append(self.close)
+
+    def start(self):
+        if self.every and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def take(self):
+        """Back up now. Returns the new backup's path."""
+        db_path = self.cache.store.db_name
+        await self.cache.flush()
+        dest = new_backup(db_path, self.folder)
+        t = time.perf_counter()
+        self._copy = asyncio.ensure_future(asyncio.to_thread(backup_db, db_path, dest, self.pages, self.pause,
+                                                    stop=lambda: self._stopping))
+        size = await asyncio.shield(self._copy)
+        self.last = (time.time(), time.perf_counter() - t, size)
+        self.taken += 1
+        prune_backups(db_path, self.folder, self.keep)
+        print(f"💾 Backed up to {dest}: {size / 2**20:.1f} MB in {self.last[1]:.1f}s")
+        return dest
+
+    async def _run(self):
+        current_command.set("backup")
+        files = backup_files(self.cache.store.db_name, self.folder)
+        last = os.path.getmtime(files[-1]) if files else 0
+        while True:
+            await asyncio.sleep(max(0.0, last + self.every - time.time()))
+            try:
+                await self.take()
+            except Exception as e:
+                self.failed += 1
+                print(f"⚠️ Backup failed, will try again in {self.every:.0f}s: {e}")
+            last = time.time()
+
+    async def close(self):
+        # A backup under way stops at its next step and leaves nothing behind
+        self._stopping = True
+        if self._task:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        if self._copy:
+            with contextlib.suppress(Exception):  # failures were reported by take()
+                await self._copy
+
+backups = Backups(db)
 
 # ==============================================================================
 # 🎨 UI HELPERS
 # ==============================================================================
 
 class DharmaEmbed(discord.Embed):
-    def __init__(self, title, description=None, color=COLORS["SAFFRON"], user=None):
+    def __init__(self, title, description=None, color=COLORS["SAFFRON"], u=None):
+        # u: the player snapshot the command already loaded, never re-queried here
         super().__init__(title=f"🕉️ {title}", description=description, color=color)
-        if user:
-            u = db.get_user(user.id)
-            if u:
-                path = u.get('path', 'Unknown')
-                lvl = u.get('level', 1)
-                rebirth = f"🌀 {u['rebirths']} " if u['rebirths'] > 0 else ""
-                self.set_footer(text=f"{path} • {rebirth}Lvl {lvl} • {ICONS['gold']} {u['gold']}")
+        if dispatcher.overloaded:
+            dispatcher.shed += 1  # the footer is decoration: the first thing to go under load
+        elif u:
+            path = u.get('path', 'Unknown')
+            lvl = u.get('level', 1)
+            rebirth = f"🌀 {u['rebirths']} " if u['rebirths'] > 0 else ""
+            self.set_footer(text=f"{path} • {rebirth}Lvl {lvl} • {ICONS['gold']} {u['gold']}")
         else:
             self.set_footer(text=f"💡 {random.choice(GAME_TIPS)}")
 
+def note_member(interaction):
+    """Server boards only know the players seen playing in that server: record this one."""
+    if interaction.guild_id and db.note_member(interaction.guild_id, interaction.user.id):
+        leaderboards.note_member(interaction.guild_id, interaction.user.id)
+
+class AgniView(ui.View):
+    """Base for every view: tags each click for query accounting and metrics, and admits it (Dispatcher)."""
+
+    def __init__(self, name=None, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name or type(self).__name__
+        metrics.views.add(self)
+
+    async def interaction_check(self, interaction):
+        cid = (interaction.data or {}).get("custom_id")
+        item = next((c for c in self.children if getattr(c, "custom_id", None) == cid), None)
+        cb = getattr(item.callback, "callback", item.callback) if item else None
+        name = f"{self.name}.{getattr(cb, '__name__', 'click')}"
+        start_command(name)
+        note_member(interaction)
+        return await dispatcher.admit(interaction, name)
+
 def render_hp(curr, max_val, length=10):
     pct = max(0, min(1, curr / max(1, max_val)))
     filled = int(length * pct)
     c = "🟩" if pct > 0.5 else "🟥"
     return f"{c*filled}{'⬛'*(length-filled)} `{curr}/{max_val}`"
 
-def calculate_stats(u):
+# Base (atk, max_hp) per path and level before rebirths and gear, built once
+STAT_TABLE_LEVELS = 200
+BASE_STATS = {
+    name: [((lvl * 4) + p['stats']['atk'], 100 + p['stats']['hp'] + (lvl * 10)) for lvl in range(STAT_TABLE_LEVELS + 1)]
+    for name, p in PATHS.items()
+}
+
+@lru_cache(maxsize=STATS_CACHE_SIZE)
+def derived_stats(path, level, rebirths, wep, arm, mount):
+    """Stats for one build. Memoized on exactly the inputs that change them, so
+    forging, bonding, levelling or reincarnating simply misses into a new
+    entry. PATHS, RECIPES and VAHANAS are frozen, so entries never go stale."""
     # Base Stats
-    path_stats = PATHS.get(u['path'], PATHS['Kshatriya'])['stats']
+    if path not in PATHS: path = 'Kshatriya'
+    path_stats = PATHS[path]['stats']
     
     # REBIRTH MULTIPLIER (The Addiction Hook)
     # Each rebirth adds +20% to ALL stats. Infinite scaling.
-    mult = 1.0 + (u['rebirths'] * 0.20)
+    mult = 1.0 + (rebirths * 0.20)
     
-    atk = int(((u['level'] * 4) + path_stats['atk']) * mult)
-    max_hp = int((100 + path_stats['hp'] + (u['level'] * 10)) * mult)
+    if 0 <= level <= STAT_TABLE_LEVELS:
+        base_atk, base_hp = BASE_STATS[path][level]
+    else:
+        base_atk, base_hp = (level * 4) + path_stats['atk'], 100 + path_stats['hp'] + (level * 10)
+    atk = int(base_atk * mult)
+    max_hp = int(base_hp * mult)
     crit = path_stats['crit']
     
     # Gear Stats
-    eq = u['equipment']
-    if eq['wep'] in RECIPES: atk += int(RECIPES[eq['wep']]['atk'] * mult)
-    if eq['arm'] in RECIPES: max_hp += int(RECIPES[eq['arm']]['hp'] * mult)
+    if wep in RECIPES: atk += int(RECIPES[wep]['atk'] * mult)
+    if arm in RECIPES: max_hp += int(RECIPES[arm]['hp'] * mult)
     
     # Mount Stats
-    if eq['mount'] in VAHANAS:
-        v = VAHANAS[eq['mount']]
+    if mount in VAHANAS:
+        v = VAHANAS[mount]
         if v['stat'] == 'hp': max_hp += int(v['val'] * mult)
         if v['stat'] == 'crit': crit += v['val']
         
     return {"atk": atk, "max_hp": max_hp, "crit": crit}
 
+def calculate_stats(u):
+    eq = u['equipment']
+    # Copy so callers can't corrupt the shared cached entry
+    return dict(derived_stats(u['path'], u['level'], u['rebirths'], eq['wep'], eq['arm'], eq['mount']))
+
+REGEN_PER_MIN = 0.05  # passive regeneration: this fraction of max HP a minute, in or out of battle
+
+def regen(u, now=None):
+    """Bring u's hp (in place) up to date with passive regeneration, and return u.
+
+    Nothing sweeps the table: u['last_regen_at'] says when hp was last
+    brought up to date, and the HP earned since is worked out whenever the
+    player is read. The caches only regenerate the copy they hand out, so
+    hp and last_regen_at reach the database together with the next write.
+    """
+    if u is None: return None
+    now = time.time() if now is None else now
+    eq = u['equipment']
+    max_hp = derived_stats(u['path'], u['level'], u['rebirths'], eq['wep'], eq['arm'], eq['mount'])['max_hp']
+    per_sec = max_hp * REGEN_PER_MIN / 60
+    if u['hp'] >= max_hp or per_sec <= 0:
+        u['last_regen_at'] = now  # nothing builds up while full
+        return u
+    gained = int((now - u['last_regen_at']) * per_sec)
+    if gained <= 0: return u
+    if u['hp'] + gained >= max_hp:
+        u['hp'], u['last_regen_at'] = max_hp, now
+    else:
+        # Only the time the whole points took, so the fraction carries over
+        u['hp'] += gained
+        u['last_regen_at'] += gained / per_sec
+    return u
+
 # ==============================================================================
 # ⚔️ COMBAT SYSTEM (WAVE + GOLDEN ENEMIES)
 # ==============================================================================
 
-class CombatView(ui.View):
-    def __init__(self, user, location):
-        super().__init__(timeout=300)
-        self.user = user
-        self.u = db.get_user(user.id)
-        self.stats = calculate_stats(self.u)
+ENEMY_NAMES = ["Rakshasa", "Asura Soldier", "Pishacha", "Yaksha Rogue"]
+MAX_WAVES = 3
+GOLDEN_CHANCE = 0.05  # 5% Chance
+SOMA_HEAL = 150       # Buffed Potion
+REST_HEAL = 0.40      # BUFFED REST: 40% Heal
+WAVE_REGEN = 0.3      # Wave Regen (Buffed to 30%)
+LIFESTEAL = 0.1       # Naga Dagger
+BATTLE_LOG_LINES = 5  # log lines shown (and kept) per battle
+AUTO_HEAL_BELOW = 0.35  # auto-battle heals below this fraction of max HP
+AUTO_MAX_TURNS = 500    # ... and gives up (leaving the battle open) after this many turns
+
+def enemy_hp(lvl):
+    return 50 + (lvl * 15)
+
+def roll_hit(stats, rng=random):
+    """(damage, crit) for one Strike with these stats."""
+    dmg = int(stats['atk'] * rng.uniform(0.9, 1.1))
+    crit = rng.random() < stats['crit']
+    return (dmg * 2 if crit else dmg), crit
+
+class BattleLog:
+    """The last ``size`` lines of a battle log, in a fixed ring (oldest overwritten first)."""
+    __slots__ = ("lines", "head")
+
+    def __init__(self, lines=(), size=BATTLE_LOG_LINES):
+        self.lines = [None] * size
+        self.head = 0
+        for line in lines: self.append(line)
+
+    def append(self, line):
+        self.lines[self.head] = line
+        self.head = (self.head + 1) % len(self.lines)
+
+    def __iter__(self):
+        return filter(None, self.lines[self.head:] + self.lines[:self.head])
+
+class Battle:
+    """The combat rules for one dungeon run, with no Discord in sight.
+
+    CombatView renders it and the balance simulator (simulate.py) checks
+    itself against it. ``rng`` only needs random()/uniform()/randint()/choice().
+    Only the last BATTLE_LOG_LINES log lines are kept, which is all the embed shows.
+    """
+    __slots__ = ("u", "stats", "loc", "rng", "wave", "max_waves", "logs", "rewards", "enemy", "turns")
+
+    def __init__(self, u, stats, location, rng=random):
+        self.u = u
+        self.stats = stats
         self.loc = location
-        
+        self.rng = rng
+
         # Sync HP cap
         if self.u['hp'] > self.stats['max_hp']: self.u['hp'] = self.stats['max_hp']
-        
+
         self.wave = 1
-        self.max_waves = 3
-        self.logs = ["⚔️ **Encounter Started!**"]
+        self.max_waves = MAX_WAVES
+        self.logs = BattleLog(["⚔️ **Encounter Started!**"])
+        self.rewards = None
+        self.turns = 0
         self.spawn_enemy()
-        self.update_buttons()
-
-    def update_buttons(self):
-        inv = self.u['inventory']
-        # Find heal button dynamically
-        heal_btn = None
-        for child in self.children:
-            if getattr(child, "custom_id", "") == "heal_btn":
-                heal_btn = child
-                break
-        
-        if heal_btn:
-            if inv.get("Soma", 0) > 0:
-                heal_btn.label = f"Soma ({inv['Soma']})"
-                heal_btn.style = discord.ButtonStyle.success
-                heal_btn.emoji = "🧪"
-            else:
-                heal_btn.label = "Rest (40%)"
-                heal_btn.style = discord.ButtonStyle.secondary
-                heal_btn.emoji = "💤"
 
     def spawn_enemy(self):
         # GOLDEN ENEMY CHECK (Dopamine Spike)
-        is_golden = random.random() < 0.05 # 5% Chance
-        
+        is_golden = self.rng.random() < GOLDEN_CHANCE
+
         lvl = self.u['level'] + (self.wave - 1) * 2
-        names = ["Rakshasa", "Asura Soldier", "Pishacha", "Yaksha Rogue"]
         mats = LOCATIONS.get(self.loc, LOCATIONS["Ayodhya"])["mats"]
-        
+
         if is_golden:
             self.enemy = {
-                "name": f"✨ GOLDEN {random.choice(names)} ✨",
+                "name": f"✨ GOLDEN {self.rng.choice(ENEMY_NAMES)} ✨",
                 "lvl": lvl,
                 "hp": 30, # Weak HP, easy kill
                 "max_hp": 30,
@@ -258,74 +1916,85 @@ class CombatView(ui.View):
             self.logs.append(f"⚠️ **A GOLDEN ENEMY APPEARED!** (Huge Loot!)")
         else:
             self.enemy = {
-                "name": f"{random.choice(names)}",
+                "name": f"{self.rng.choice(ENEMY_NAMES)}",
                 "lvl": lvl,
-                "hp": 50 + (lvl * 15),
-                "max_hp": 50 + (lvl * 15),
+                "hp": enemy_hp(lvl),
+                "max_hp": enemy_hp(lvl),
                 "atk": 10 + (lvl * 3),
-                "drop_mat": random.choice(mats),
+                "drop_mat": self.rng.choice(mats),
                 "is_golden": False
             }
             self.logs.append(f"Wave {self.wave}: {self.enemy['name']} appeared!")
 
-    def get_embed(self, status="FIGHT"):
-        c = COLORS["GOLD"] if self.enemy.get('is_golden') else (COLORS["CRIMSON"] if status=="FIGHT" else COLORS["GREEN"])
-        e = discord.Embed(title=f"⚔️ {self.loc} (Wave {self.wave})", color=c)
-        e.add_field(name="🛡️ You", value=render_hp(self.u['hp'], self.stats['max_hp']), inline=True)
-        e.add_field(name=f"👹 {self.enemy['name']}", value=render_hp(self.enemy['hp'], self.enemy['max_hp']), inline=True)
-        
-        log_txt = "\n".join(self.logs[-5:])
-        e.add_field(name="📜 Log", value=f"```diff\n{log_txt}\n```", inline=False)
-        return e
+    def strike(self):
+        dmg, crit = roll_hit(self.stats, self.rng)
+        if crit:
+            self.logs.append(f"💥 **CRIT!** {dmg} DMG!")
+        else:
+            self.logs.append(f"+ Hit for {dmg}.")
 
-    async def end_turn(self, interaction):
+        # LIFESTEAL MECHANIC
+        if self.u['equipment']['wep'] == "Naga Dagger":
+            heal = int(dmg * LIFESTEAL)
+            self.u['hp'] = min(self.stats['max_hp'], self.u['hp'] + heal)
+
+        self.enemy['hp'] -= dmg
+
+    def heal(self):
+        inv = self.u['inventory']
+        if inv.get("Soma", 0) > 0:
+            inv["Soma"] -= 1
+            self.u['hp'] = min(self.stats['max_hp'], self.u['hp'] + SOMA_HEAL)
+            self.logs.append(f"+ Soma (+{SOMA_HEAL} HP)")
+        else:
+            heal = int(self.stats['max_hp'] * REST_HEAL)
+            self.u['hp'] = min(self.stats['max_hp'], self.u['hp'] + heal)
+            self.logs.append(f"💤 Deep Rest (+{heal} HP).")
+
+    def end_turn(self):
+        """Resolve the turn. Returns "wave", "win", "lose" or "turn"."""
+        self.turns += 1
         if self.enemy['hp'] <= 0:
             # Rewards
             gold_mult = 10 if self.enemy.get('is_golden') else 1
             if self.u['equipment']['mount'] == "Mushika": gold_mult += 0.2
-            
+
             # Drop
             mat = self.enemy['drop_mat']
             self.u['materials'][mat] = self.u['materials'].get(mat, 0) + 1
             self.logs.append(f"📦 Dropped: {mat}")
 
             if self.wave < self.max_waves:
-                # Wave Regen (Buffed to 30%)
-                regen = int(self.stats['max_hp'] * 0.3)
+                regen = int(self.stats['max_hp'] * WAVE_REGEN)
                 self.u['hp'] = min(self.stats['max_hp'], self.u['hp'] + regen)
                 self.logs.append(f"💚 Restored {regen} HP between waves.")
-                
+
                 self.wave += 1
                 self.spawn_enemy()
-                self.update_buttons()
-                await interaction.response.edit_message(embed=self.get_embed(), view=self)
-            else:
-                # Clear Dungeon
-                gold = int(50 * self.u['level'] * gold_mult)
-                xp = int(100 * self.u['level'] * gold_mult)
-                self.u['gold'] += gold
-                self.u['xp'] += xp
-                
-                # Level Up (Full Heal)
-                if self.u['xp'] >= self.u['level'] * 150:
-                    self.u['level'] += 1
-                    self.u['xp'] = 0
-                    self.u['hp'] = self.stats['max_hp'] # Full Heal on Level Up
-                    self.logs.append("✨ **LEVEL UP!** Fully Healed.")
-                
-                db.update_user(self.user.id, self.u)
-                
-                embed = self.get_embed("WIN")
-                embed.add_field(name="Victory!", value=f"🪙 +{gold} Gold\n✨ +{xp} XP\n📦 {mat}")
-                await interaction.response.edit_message(embed=embed, view=None)
-            return
+                return "wave"
+
+            # Clear Dungeon
+            gold = int(50 * self.u['level'] * gold_mult)
+            xp = int(100 * self.u['level'] * gold_mult)
+            self.u['gold'] += gold
+            self.u['xp'] += xp
+
+            # Level Up (Full Heal)
+            if self.u['xp'] >= self.u['level'] * 150:
+                self.u['level'] += 1
+                self.u['xp'] = 0
+                self.u['hp'] = self.stats['max_hp'] # Full Heal on Level Up
+                self.logs.append("✨ **LEVEL UP!** Fully Healed.")
+
+            self.rewards = {"gold": gold, "xp": xp, "mat": mat}
+            return "win"
 
         # Enemy Turn
-        dmg = random.randint(int(self.enemy['atk']*0.8), int(self.enemy['atk']*1.2))
-        
+        dmg = self.rng.randint(int(self.enemy['atk']*0.8), int(self.enemy['atk']*1.2))
+
         # Dodge Check
         dodge_chance = 0.25 if self.u['equipment']['mount'] == "Suparna" else 0.05
-        if random.random() < dodge_chance:
+        if self.rng.random() < dodge_chance:
             self.logs.append("💨 DODGED the attack!")
         else:
             self.u['hp'] -= dmg
@@ -333,122 +2002,584 @@ class CombatView(ui.View):
 
         if self.u['hp'] <= 0:
             self.u['hp'] = 10
-            db.update_user(self.user.id, self.u)
-            embed = self.get_embed("LOSE")
+            return "lose"
+        return "turn"
+
+    def auto(self, heal_below=AUTO_HEAL_BELOW, max_turns=AUTO_MAX_TURNS):
+        """Play on until the dungeon is won or lost: heal (Soma, else Rest) below
+        heal_below of max HP, otherwise Strike. Returns the last end_turn()."""
+        outcome = "turn"
+        for _ in range(max_turns):
+            self.heal() if self.u['hp'] < heal_below * self.stats['max_hp'] else self.strike()
+            outcome = self.end_turn()
+            if outcome in ("win", "lose"): break
+        return outcome
+
+class BattleSession(Battle):
+    """A player's battle between clicks: the Battle without the player.
+
+    The player and their stats are only attached for the length of a turn
+    (each click re-reads the player under their lock anyway), so all that
+    stays in memory is the enemy, the wave and the last few log lines.
+    dumps() goes in the player's ``battle`` column, so a battle is saved
+    with the player it belongs to and outlives a restart.
+    """
+    __slots__ = ("uid", "message_id", "last_used", "state", "footprint")
+
+    def __init__(self, u, rng=random):
+        super().__init__(u, calculate_stats(u), u['location'], rng)
+        self.uid = u['user_id']
+        self.message_id = None  # the message whose buttons drive it, once one is clicked
+        self.last_used = time.time()
+        self.state = self.footprint = None
+
+    @classmethod
+    def loads(cls, uid, state, rng=random):
+        d = json.loads(state)
+        s = cls.__new__(cls)
+        s.u = s.stats = s.rewards = None
+        s.rng, s.max_waves, s.uid, s.state = rng, MAX_WAVES, uid, state
+        s.loc, s.wave, s.enemy, s.message_id, s.last_used = d["loc"], d["wave"], d["enemy"], d["msg"], d["at"]
+        s.turns = d.get("turns", 0)
+        s.logs = BattleLog(d["logs"])
+        return s
+
+    def dumps(self):
+        return json.dumps({"loc": self.loc, "wave": self.wave, "enemy": self.enemy, "logs": list(self.logs),
+                           "msg": self.message_id, "at": self.last_used, "turns": self.turns})
+
+    def play(self, u, action):
+        """A turn for u ("strike" or "heal"), or the rest of the dungeon ("auto").
+        Returns what end_turn() last did."""
+        self.u, self.stats = u, calculate_stats(u)
+        if u['hp'] > self.stats['max_hp']: u['hp'] = self.stats['max_hp']
+        if action == "auto": return self.auto()
+        getattr(self, action)()
+        return self.end_turn()
+
+    def nbytes(self):
+        """Rough heap size: the object, its enemy, log and saved state."""
+        parts = [self, self.enemy, self.logs, self.logs.lines, self.state, *self.enemy.values(), *self.logs]
+        return sum(map(sys.getsizeof, parts))
+
+class BattleSessions:
+    """Every player's current battle, by user id.
+
+    The player's ``battle`` column is the source of truth. This keeps the
+    decoded sessions of recently active players, least recently used first,
+    and drops the oldest once they add up to more than ``cap`` bytes; a
+    session that isn't here (dropped, or from before a restart) is decoded
+    from the player on its next click. A session whose state no longer
+    matches the player's (another process moved the battle on) is decoded
+    afresh too. Battles untouched for ``idle`` seconds are over.
+
+    Call everything inside ``db.edit(uid)``: the session changes with u.
+    """
+
+    def __init__(self, cap=BATTLE_MEMORY_KB * 1024, idle=BATTLE_IDLE_SECS):
+        self.cap = cap
+        self.idle = idle
+        self.sessions = OrderedDict()  # uid -> BattleSession
+        self.bytes = 0
+        self.evictions = 0
+
+    def start(self, u):
+        """Begin a new battle for u, replacing any they had."""
+        s = BattleSession(u)
+        self.save(s, u)
+        return s
+
+    def get(self, u):
+        """u's battle, or None if they have none (or it timed out)."""
+        uid, state = u['user_id'], u.get('battle')
+        s = self.sessions.get(uid)
+        if s is None or s.state != state:
+            self._drop(uid)
+            if not state: return None
+            s = BattleSession.loads(uid, state)
+        if time.time() - s.last_used > self.idle:
+            self.end(u)
+            return None
+        return s
+
+    def save(self, s, u):
+        """Store s on u (written with the player) after a turn, and detach the player."""
+        s.u = s.stats = None
+        s.last_used = time.time()
+        s.state = u['battle'] = s.dumps()
+        self._drop(s.uid)
+        s.footprint = s.nbytes()
+        self.sessions[s.uid] = s
+        self.bytes += s.footprint
+        while self.bytes > self.cap and len(self.sessions) > 1:
+            _, old = self.sessions.popitem(last=False)
+            self.bytes -= old.footprint
+            self.evictions += 1
+
+    def active(self):
+        """Sessions used in the last ``idle`` seconds. Newest are last, so this stops at the first idle one."""
+        cutoff, n = time.time() - self.idle, 0
+        for s in reversed(self.sessions.values()):
+            if s.last_used < cutoff: break
+            n += 1
+        return n
+
+    def end(self, u):
+        self._drop(u['user_id'])
+        u['battle'] = None
+
+    def _drop(self, uid):
+        s = self.sessions.pop(uid, None)
+        if s is not None: self.bytes -= s.footprint
+
+battles = BattleSessions()
+
+class CombatView(AgniView):
+    """Strike/Heal for every battle.
+
+    One instance, registered at startup with bot.add_view(), takes the
+    clicks on all battle messages, including ones sent before a restart:
+    the custom_ids are fixed and the battle is the clicking player's
+    session. The copies that render a message's buttons (battle_buttons)
+    are stopped, so discord.py doesn't keep one View per battle message.
+    """
+
+    def __init__(self, soma=None):
+        super().__init__(timeout=None)
+        if soma is not None:
+            self.update_buttons(soma)
+            self.stop()
+
+    def update_buttons(self, soma):
+        if soma > 0:
+            self.heal.label = f"Soma ({soma})"
+            self.heal.style = discord.ButtonStyle.success
+            self.heal.emoji = "🧪"
+        else:
+            self.heal.label = "Rest (40%)"
+            self.heal.style = discord.ButtonStyle.secondary
+            self.heal.emoji = "💤"
+
+    @staticmethod
+    def get_embed(b, status="FIGHT"):
+        c = COLORS["GOLD"] if b.enemy.get('is_golden') else (COLORS["CRIMSON"] if status=="FIGHT" else COLORS["GREEN"])
+        e = discord.Embed(title=f"⚔️ {b.loc} (Wave {b.wave})", color=c)
+        e.add_field(name="🛡️ You", value=render_hp(b.u['hp'], b.stats['max_hp']), inline=True)
+        e.add_field(name=f"👹 {b.enemy['name']}", value=render_hp(b.enemy['hp'], b.enemy['max_hp']), inline=True)
+        
+        log_txt = "\n".join(b.logs)
+        e.add_field(name="📜 Log", value=f"```diff\n{log_txt}\n```", inline=False)
+        return e
+
+    @classmethod
+    def render(cls, b, outcome="turn"):
+        """(embed, view) for the battle message after a turn; b must still have its player."""
+        if outcome == "win":
+            r = b.rewards
+            embed = cls.get_embed(b, "WIN")
+            embed.add_field(name="Victory!", value=f"🪙 +{r['gold']} Gold\n✨ +{r['xp']} XP\n📦 {r['mat']}")
+            return embed, None
+        if outcome == "lose":
+            embed = cls.get_embed(b, "LOSE")
             embed.description = "You fell... but your legacy remains."
-            await interaction.response.edit_message(embed=embed, view=None)
-            return
+            return embed, None
+        return cls.get_embed(b), battle_buttons(b.u['inventory'].get("Soma", 0))
 
-        db.update_user(self.user.id, self.u)
-        self.update_buttons()
-        await interaction.response.edit_message(embed=self.get_embed(), view=self)
+    @classmethod
+    def resolve(cls, s, u, action):
+        """Play action on s for u and store the result. Returns (embed, view) for the message."""
+        soma = u['inventory'].get("Soma", 0)
+        outcome = s.play(u, action)
+        embed, view = cls.render(s, outcome)
+        if action == "auto":
+            embed.set_footer(text=f"🤖 Auto-battle • {s.turns} turns • {soma - u['inventory'].get('Soma', 0)} Soma used")
+        if outcome in ("win", "lose"): battles.end(u)
+        else: battles.save(s, u)
+        return embed, view
 
-    @ui.button(label="Strike", style=discord.ButtonStyle.danger, emoji="⚔️")
+    async def end_turn(self, interaction, action):
+        owner = getattr(getattr(interaction.message, "interaction", None), "user", None)
+        if owner is not None and owner.id != interaction.user.id:
+            return await interaction.response.send_message("⚔️ This isn't your battle.", ephemeral=True)
+        msg_id = getattr(interaction.message, "id", None)
+        # Play the turn on a fresh copy of the player under their lock, so gold
+        # or items they gained elsewhere mid-battle aren't overwritten
+        embed = view = None
+        async with db.edit(interaction.user.id) as u:
+            s = battles.get(u) if u else None
+            if s is not None and s.message_id not in (None, msg_id): s = None  # an older battle's message
+            if s is not None:
+                s.message_id = s.message_id or msg_id
+                before = holdings(u)
+                embed, view = self.resolve(s, u, action)
+        if embed is None:
+            return await interaction.response.send_message("⌛ This battle is over. Use `/battle` to fight again.", ephemeral=True)
+        await ledger.record(interaction.user.id, "battle", holdings_delta(before, u))
+        await interaction.response.edit_message(embed=embed, view=view)
+
+    @ui.button(label="Strike", style=discord.ButtonStyle.danger, emoji="⚔️", custom_id="agni:battle:strike")
     async def attack(self, interaction: discord.Interaction, button: ui.Button):
-        if interaction.user.id != self.user.id: return
-        
-        dmg = int(self.stats['atk'] * random.uniform(0.9, 1.1))
-        if random.random() < self.stats['crit']:
-            dmg *= 2
-            self.logs.append(f"💥 **CRIT!** {dmg} DMG!")
-        else:
-            self.logs.append(f"+ Hit for {dmg}.")
-            
-        # LIFESTEAL MECHANIC
-        if self.u['equipment']['wep'] == "Naga Dagger":
-            heal = int(dmg * 0.1)
-            self.u['hp'] = min(self.stats['max_hp'], self.u['hp'] + heal)
-            
-        self.enemy['hp'] -= dmg
-        await self.end_turn(interaction)
+        await self.end_turn(interaction, "strike")
 
-    @ui.button(label="Heal", style=discord.ButtonStyle.success, emoji="🧪", custom_id="heal_btn")
+    @ui.button(label="Heal", style=discord.ButtonStyle.success, emoji="🧪", custom_id="agni:battle:heal")
     async def heal(self, interaction: discord.Interaction, button: ui.Button):
-        if interaction.user.id != self.user.id: return
-        inv = self.u['inventory']
-        
-        if inv.get("Soma", 0) > 0:
-            inv["Soma"] -= 1
-            heal = 150 # Buffed Potion
-            self.u['hp'] = min(self.stats['max_hp'], self.u['hp'] + heal)
-            self.logs.append("+ Soma (+150 HP)")
-            await self.end_turn(interaction)
-        else:
-            # BUFFED REST: 40% Heal
-            heal = int(self.stats['max_hp'] * 0.40)
-            self.u['hp'] = min(self.stats['max_hp'], self.u['hp'] + heal)
-            self.logs.append(f"💤 Deep Rest (+{heal} HP).")
-            await self.end_turn(interaction)
+        await self.end_turn(interaction, "heal")
+
+    @ui.button(label="Auto", style=discord.ButtonStyle.primary, emoji="🤖", custom_id="agni:battle:auto")
+    async def auto(self, interaction: discord.Interaction, button: ui.Button):
+        # The rest of the dungeon in one edit (and one write) instead of a click per turn
+        await self.end_turn(interaction, "auto")
+
+@lru_cache(maxsize=64)
+def battle_buttons(soma):
+    """The (stopped, so never stored or changed) buttons for a battle message, by Soma count."""
+    return CombatView(soma)
+
+# ==============================================================================
+# 🐉 WORLD BOSS
+# ==============================================================================
+
+BOSS_LEVEL = 100
+BOSS_HP_MULT = 10000     # a level-BOSS_LEVEL enemy's HP times this
+BOSS_HIT_COOLDOWN = 1.0  # seconds between a player's counted hits
+BOSS_REWARD = 100        # the gold and XP of this many dungeon clears at BOSS_LEVEL, shared by damage
+BOSS_MIN_GOLD = 50       # ... but everyone who landed a hit gets at least this
+
+class WorldBoss:
+    """One channel's boss, while it is fought in this process.
+
+    A hit only touches memory: hp drops at once, and the player's damage
+    and hit count add up in ``pending`` until WorldBosses saves them.
+    ``totals`` holds everyone's damage, saved or not, for the status board.
+    """
+
+    def __init__(self, row, totals=(), hits=0):
+        self.id, self.channel_id, self.message_id, self.name, self.lvl, self.max_hp, self.hp = row
+        self.totals = Counter(dict(totals))
+        self.pending = {}    # uid -> [damage, hits] not saved yet
+        self.last_hit = {}   # uid -> time.monotonic() of their last counted hit
+        self.hits = hits
+        self.shown = hits    # self.hits when the status message was last edited
+        self.finishing = None
+        self.paid = set()    # uids rewarded by this process, whether or not their paid mark is saved yet
+
+def boss_embed(boss, rewarded=None):
+    """The status message: HP, heroes, and the top five by damage. ``rewarded`` is (heroes, gold) once it has fallen."""
+    if rewarded:
+        e = discord.Embed(title=f"🏆 {boss.name} has fallen!", color=COLORS["GREEN"],
+                          description=f"🪙 {rewarded[1]:,} Gold shared by {rewarded[0]:,} heroes, by damage dealt.")
+    else:
+        e = discord.Embed(title=f"🐉 {boss.name} (Lvl {boss.lvl})", color=COLORS["MYTHIC"],
+                          description="Everyone in this channel can strike. Rewards are shared by damage dealt.")
+    e.add_field(name="HP", value=render_hp(max(0, boss.hp), boss.max_hp, 20), inline=False)
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    top = [f"{medals.get(n, f'`#{n}`')} <@{uid}> — {dmg:,}" for n, (uid, dmg) in enumerate(boss.totals.most_common(5), 1)]
+    e.add_field(name=f"⚔️ {len(boss.totals):,} heroes • {boss.hits:,} hits", value="\n".join(top) or "Be the first to strike!",
+                inline=False)
+    return e
+
+class WorldBosses:
+    """The bosses live in this process; saves their damage and keeps their status messages current.
+
+    One background task, running while any boss is live, wakes every
+    BOSS_STATUS_SECS. It edits the status message of each boss hit since
+    its last edit, and every BOSS_FLUSH_SECS it saves all pending damage in
+    one transaction. However many players click, a boss costs about one
+    commit per BOSS_FLUSH_SECS and one message edit per BOSS_STATUS_SECS.
+    A crash loses at most the last BOSS_FLUSH_SECS of hits.
+
+    Each channel's boss lives in the worker that owns its guild, so workers
+    never share one. After a restart, a boss is loaded again by its first click.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.store = cache.store
+        self.live = {}      # channel_id -> WorldBoss
+        self.hits = 0
+        self.edits = 0
+        self._loading = {}  # channel_id -> task loading it
+        self._finishing = set()
+        self._closing = asyncio.Event()
+        self._task = None
+        # Ahead of the ledger's hook: finishing a boss records its rewards there
+        cache.before_close.insert(0, self.close)
+
+    async def summon(self, channel_id, rng=random):
+        """Start a boss in channel_id. Returns it, or None if the channel already has one."""
+        if await self.get(channel_id): return None
+        row = await self.store.create_boss(channel_id, f"World Boss: {rng.choice(ENEMY_NAMES)}", BOSS_LEVEL,
+                                           enemy_hp(BOSS_LEVEL) * BOSS_HP_MULT)
+        if row is None: return None
+        return self._add(WorldBoss(row))
+
+    async def attach(self, boss, message_id):
+        boss.message_id = message_id
+        await self.store.update_boss(boss.id, message_id=message_id)
+
+    async def get(self, channel_id):
+        """channel_id's live boss, loaded from the database if it isn't in memory; None if there is none."""
+        boss = self.live.get(channel_id)
+        if boss is not None: return boss
+        # One load per channel, however many clicks arrive while it runs
+        task = self._loading.get(channel_id)
+        if task is None:
+            task = self._loading[channel_id] = asyncio.ensure_future(self._load(channel_id))
+            task.add_done_callback(lambda _: self._loading.pop(channel_id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, channel_id):
+        row = await self.store.live_boss(channel_id)
+        if row is None: return None
+        saved = await self.store.boss_damage(row[0])
+        boss = self._add(WorldBoss(row, [(uid, dmg) for uid, dmg, *_ in saved], sum(r[2] for r in saved)))
+        if boss.hp <= 0: self._finish_soon(boss)  # fell before a restart: pay whoever is left
+        return boss
+
+    def _add(self, boss):
+        self.live[boss.channel_id] = boss
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return boss
+
+    def hit(self, boss, uid, stats, now=None):
+        """One Strike by uid: (damage, crit, first hit), or None if the boss is down or they're cooling down."""
+        now = time.monotonic() if now is None else now
+        last = boss.last_hit.get(uid)
+        if boss.hp <= 0 or (last is not None and now - last < BOSS_HIT_COOLDOWN): return None
+        boss.last_hit[uid] = now
+        dmg, crit = roll_hit(stats)
+        dmg = min(dmg, boss.hp)  # no credit for overkill
+        first = uid not in boss.totals
+        boss.hp -= dmg
+        boss.totals[uid] += dmg
+        p = boss.pending.setdefault(uid, [0, 0])
+        p[0] += dmg
+        p[1] += 1
+        boss.hits += 1
+        self.hits += 1
+        if boss.hp <= 0: self._finish_soon(boss)
+        return dmg, crit, first
+
+    async def flush(self):
+        """Save every live boss's pending damage and hp in one transaction."""
+        batch = [(b, b.pending) for b in self.live.values() if b.pending]
+        if not batch: return
+        for b, _ in batch: b.pending = {}
+        try:
+            await self.store.write_boss_damage(
+                [(b.id, max(0, b.hp), [(uid, d, n) for uid, (d, n) in p.items()]) for b, p in batch])
+        except Exception:
+            # Put them back for the next try
+            for b, p in batch:
+                for uid, (d, n) in p.items():
+                    q = b.pending.setdefault(uid, [0, 0])
+                    q[0] += d
+                    q[1] += n
+            raise
+
+    async def edit(self, boss, **fields):
+        """Edit boss's status message. Failures are printed: the fight goes on without it."""
+        if boss.message_id is None: return
+        self.edits += 1
+        try:
+            await bot.get_partial_messageable(boss.channel_id).get_partial_message(boss.message_id).edit(**fields)
+        except discord.HTTPException as e:
+            print(f"⚠️ World boss status edit failed in channel {boss.channel_id}: {e}")
+
+    async def _show(self, boss):
+        boss.shown = boss.hits
+        await self.edit(boss, embed=boss_embed(boss))
+
+    async def _run(self):
+        current_command.set("worldboss")
+        saved_at = time.monotonic()
+        while self.live:
+            await asyncio.sleep(BOSS_STATUS_SECS)
+            try:
+                if time.monotonic() - saved_at >= BOSS_FLUSH_SECS:
+                    saved_at = time.monotonic()
+                    await self.flush()
+                await asyncio.gather(*(self._show(b) for b in list(self.live.values()) if b.hits != b.shown and b.hp > 0))
+            except Exception as e:
+                print(f"⚠️ World boss update failed, will retry: {e}")
+
+    def _finish_soon(self, boss):
+        if boss.finishing is None:
+            boss.finishing = asyncio.create_task(self._finish(boss))
+            self._finishing.add(boss.finishing)
+            boss.finishing.add_done_callback(self._finishing.discard)
+
+    async def _finish(self, boss):
+        """Save the last hits, share out the rewards, then end the boss and post the result.
+
+        Each reward is marked paid in the same transaction as the player's
+        gold, so if some fail (or the process dies part way) the next try pays
+        only the rest. Until everyone is paid the boss stays live but down:
+        retried every BOSS_FLUSH_SECS here, and after a restart by its next load.
+        """
+        while True:
+            try:
+                await self.flush()
+                if await self._pay(boss): break
+            except Exception as e:
+                print(f"⚠️ Finishing world boss {boss.id} failed, will retry: {e}")
+            if self._closing.is_set(): return
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._closing.wait(), BOSS_FLUSH_SECS)
+        try:
+            await self.store.update_boss(boss.id, ended_at=time.time())
+            self.live.pop(boss.channel_id, None)
+            saved = await self.store.boss_damage(boss.id)
+            paid = sum(gold for gold, _ in self._shares(boss, saved).values())
+            await self.edit(boss, embed=boss_embed(boss, (len(saved), paid)), view=None)
+            print(f"🐉 {boss.name} fell in channel {boss.channel_id}: {paid:,} Gold to {len(saved):,} heroes")
+        except Exception as e:
+            print(f"⚠️ Finishing world boss {boss.id} failed: {e}")
+
+    @staticmethod
+    def _shares(boss, saved):
+        """uid -> (gold, xp) for everyone who hit it, by damage dealt."""
+        total = sum(dmg for _, dmg, *_ in saved) or 1
+        pool_gold, pool_xp = 50 * boss.lvl * BOSS_REWARD, 100 * boss.lvl * BOSS_REWARD
+        return {uid: (max(BOSS_MIN_GOLD, pool_gold * dmg // total), pool_xp * dmg // total) for uid, dmg, *_ in saved}
+
+    async def _pay(self, boss):
+        """Pay everyone not paid yet. True once nobody is left."""
+        saved = await self.store.boss_damage(boss.id)
+        shares, failed = self._shares(boss, saved), 0
+        for uid, _, _, paid in saved:
+            # Or paid by an earlier try whose flush failed: the reward is still in the cache, dirty
+            if paid or uid in boss.paid: continue
+            gold, xp = shares[uid]
+            try:
+                async with self.cache.edit(uid) as u:
+                    if u is not None:
+                        u['gold'] += gold
+                        u['xp'] += xp
+                    await self.cache.note_boss_paid(boss.id, uid)
+                boss.paid.add(uid)
+            except Exception as e:
+                failed += 1
+                print(f"⚠️ World boss {boss.id} reward for {uid} failed: {e}")
+                continue
+            if u is not None: await ledger.record(uid, "boss", {"gold": gold})
+        await self.cache.flush()  # the rewards and their paid marks, committed before the boss ends
+        return not failed
+
+    async def close(self):
+        self._closing.set()  # a boss still paying out gets one last try now; the next start carries on
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._finishing:
+            await asyncio.gather(*self._finishing, return_exceptions=True)
+        await self.flush()
+
+bosses = WorldBosses(db)
+
+class BossView(AgniView):
+    """The Strike button on every world boss message (registered at startup, like CombatView)."""
+
+    def __init__(self, stopped=False):
+        super().__init__(timeout=None)
+        if stopped: self.stop()
+
+    @ui.button(label="Strike", style=discord.ButtonStyle.danger, emoji="⚔️", custom_id="agni:boss:strike")
+    async def strike(self, interaction: discord.Interaction, button: ui.Button):
+        boss = await bosses.get(interaction.channel_id)
+        if boss is None or boss.hp <= 0:
+            return await interaction.response.send_message("🏳️ This boss has already fallen.", ephemeral=True)
+        u = await db.get_user(interaction.user.id)
+        if u is None: return await interaction.response.send_message("Use `/start` first.", ephemeral=True)
+        hit = bosses.hit(boss, interaction.user.id, calculate_stats(u))
+        if hit is not None:
+            dmg, crit, first = hit
+            if boss.hp <= 0:
+                return await interaction.response.send_message(f"🏆 **FINAL BLOW!** {dmg:,} DMG. The boss falls!", ephemeral=True)
+            if first:
+                return await interaction.response.send_message(
+                    f"⚔️ You joined the fight{' with a **CRIT**' if crit else ''}: {dmg:,} DMG! "
+                    f"Keep striking; the board updates every few seconds.", ephemeral=True)
+        # Every other click (and one inside the cooldown) is just acknowledged: the board shows the rest
+        await interaction.response.defer()
+
+@lru_cache(maxsize=1)
+def boss_buttons():
+    """The (stopped, so never stored) Strike button for a new boss message."""
+    return BossView(stopped=True)
 
 # ==============================================================================
 # ⚒️ CRAFTING VIEW
 # ==============================================================================
 
-class CraftingView(ui.View):
+class CraftingView(AgniView):
     def __init__(self, uid):
         super().__init__()
         self.uid = uid
         self.add_item(CraftSelect(uid))
 
+CRAFT_OPTIONS = select_options(*(
+    {"label": k, "description": f"{v['type'].upper()} | Req: {', '.join(f'{n}x{q}' for n, q in v['cost'].items())}",
+     "value": k, "emoji": "⚒️"} for k, v in RECIPES.items()))
+
 class CraftSelect(ui.Select):
     def __init__(self, uid):
         self.uid = uid
-        opts = []
-        for k, v in RECIPES.items():
-            reqs = ", ".join([f"{n}x{q}" for n,q in v['cost'].items()])
-            opts.append(discord.SelectOption(
-                label=k, 
-                description=f"{v['type'].upper()} | Req: {reqs}", 
-                value=k, emoji="⚒️"
-            ))
-        super().__init__(placeholder="Select Item to Forge...", options=opts)
+        super().__init__(placeholder="Select Item to Forge...", options=list(CRAFT_OPTIONS))
 
     async def callback(self, interaction: discord.Interaction):
         if interaction.user.id != self.uid: return
         item_name = self.values[0]
         recipe = RECIPES[item_name]
-        u = db.get_user(self.uid)
-        
-        # Check Mats
-        for mat, qty in recipe['cost'].items():
-            if u['materials'].get(mat, 0) < qty:
-                return await interaction.response.send_message(f"❌ Missing Material: Need {qty}x {mat}", ephemeral=True)
-        
-        # Deduct Mats
-        for mat, qty in recipe['cost'].items():
-            u['materials'][mat] -= qty
-            
-        # Add Item
-        if recipe['type'] == 'wep': u['equipment']['wep'] = item_name
-        elif recipe['type'] == 'arm': u['equipment']['arm'] = item_name
-        
-        db.update_user(self.uid, u)
+        missing, swap = None, {}
+        async with db.edit(self.uid, flush=True) as u:
+            if u is None: return
+            # Check Mats
+            missing = next(((mat, qty) for mat, qty in recipe['cost'].items() if u['materials'].get(mat, 0) < qty), None)
+            if not missing:
+                # Deduct Mats
+                for mat, qty in recipe['cost'].items():
+                    u['materials'][mat] -= qty
+
+                # Add Item
+                if recipe['type'] in ('wep', 'arm'):
+                    swap = equip_delta(u['equipment'][recipe['type']], item_name)
+                    u['equipment'][recipe['type']] = item_name
+
+        if missing:
+            mat, qty = missing
+            return await interaction.response.send_message(f"❌ Missing Material: Need {qty}x {mat}", ephemeral=True)
+        await ledger.record(self.uid, "forge", {**{mat: -qty for mat, qty in recipe['cost'].items()}, **swap})
         await interaction.response.send_message(f"🔥 **FUSION SUCCESSFUL!** You forged **{item_name}**!", ephemeral=True)
 
 # ==============================================================================
 # 🐣 MOUNT VIEW
 # ==============================================================================
 
-class MountView(ui.View):
+MOUNT_OPTIONS = select_options(*({"label": v['name'], "description": v['buff'], "value": k, "emoji": "🐾"}
+                                  for k, v in VAHANAS.items()))
+
+class MountView(AgniView):
     def __init__(self, uid):
         super().__init__()
         self.uid = uid
-        self.u = db.get_user(uid)
         
-        select = ui.Select(placeholder="Bond with a Spirit Beast...")
-        for k, v in VAHANAS.items():
-            select.add_option(label=v['name'], description=v['buff'], value=k, emoji="🐾")
+        select = ui.Select(placeholder="Bond with a Spirit Beast...", options=list(MOUNT_OPTIONS))
         
         async def cb(interaction):
             if interaction.user.id != self.uid: return
             val = select.values[0]
-            # Cost check
-            if self.u['gold'] < 500:
+            async with db.edit(self.uid) as u:
+                # Cost check
+                poor = u is None or u['gold'] < 500
+                if not poor:
+                    u['gold'] -= 500
+                    swap = equip_delta(u['equipment']['mount'], val)
+                    u['equipment']['mount'] = val
+            if poor:
                 return await interaction.response.send_message("❌ Need 500 Gold to bond.", ephemeral=True)
-            
-            self.u['gold'] -= 500
-            self.u['equipment']['mount'] = val
-            db.update_user(self.uid, self.u)
+            await ledger.record(self.uid, "mount", {"gold": -500, **swap})
             await interaction.response.send_message(f"🐾 You are now riding the **{VAHANAS[val]['name']}**!", ephemeral=True)
             
         select.callback = cb
@@ -458,73 +2589,172 @@ class MountView(ui.View):
 # 🚀 MAIN COMMANDS
 # ==============================================================================
 
-class AgniBot(commands.Bot):
-    def __init__(self):
-        super().__init__(command_prefix="!", intents=discord.Intents.all())
+class AgniTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        # Runs in the same task as the command, so the tag sticks for its queries
+        name = f"/{(interaction.data or {}).get('name', '?')}"
+        start_command(name)
+        note_member(interaction)
+        return await dispatcher.admit(interaction, name)
+
+def command_hash(tree):
+    """Stable digest of the app-command definitions Discord would receive from tree.sync()."""
+    payload = sorted((c.to_dict() for c in tree.get_commands()), key=lambda c: (c.get("type", 1), c["name"]))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+def gateway_options(profile=GATEWAY_PROFILE):
+    """Client options for a gateway profile (see GATEWAY_PROFILE)."""
+    if profile == "full":
+        return {"intents": discord.Intents.all()}
+    # Interactions carry the user, member and guild id themselves, so nothing
+    # needs members or messages cached, and there's nothing to chunk
+    return {
+        "intents": discord.Intents(guilds=True),
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "max_messages": None,
+        "chunk_guilds_at_startup": False,
+    }
+
+class AgniBot(commands.AutoShardedBot):
+    def __init__(self, profile=GATEWAY_PROFILE, shard_ids=SHARD_IDS, shard_count=SHARD_COUNT):
+        super().__init__(command_prefix="!", tree_cls=AgniTree, shard_ids=shard_ids, shard_count=shard_count,
+                         **gateway_options(profile))
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            metrics.startup[name] = time.perf_counter() - t
+
     async def setup_hook(self):
-        await self.tree.sync()
+        metrics.startup["login"] = time.perf_counter() - BOOT_TIME
+        with self.phase("db"):
+            await db.connect()
+        self.add_view(CombatView())  # battle buttons work on every battle message, even pre-restart ones
+        self.add_view(BossView())
+        if not WORKER_INDEX: backups.start()  # the workers share one file: worker 0 backs it up
+        with self.phase("metrics"):
+            await metrics.start(port=METRICS_PORT and METRICS_PORT + WORKER_INDEX)
+        try:
+            # Heroku stops workers with SIGTERM; close cleanly so the cache is flushed
+            self.loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.create_task(self.close()))
+        except NotImplementedError:
+            pass
+        with self.phase("sync"):
+            synced = await self.sync_commands()
+        print(f"🌐 Slash commands {'synced' if synced else 'unchanged, sync skipped'}.")
         print("🔥 Agni 15.0 (Dharma) is Online.")
 
+    async def sync_commands(self):
+        """tree.sync() is a slow, rate-limited global call, so skip it when nothing changed."""
+        if WORKER_INDEX: return False  # worker 0 syncs for everyone
+        key, digest = f"command_hash:{self.application_id}", command_hash(self.tree)
+        if not FORCE_SYNC and await db.store.get_meta(key) == digest:
+            return False
+        await self.tree.sync()
+        await db.store.set_meta(key, digest)
+        return True
+
+    async def on_ready(self):
+        # Fires again after every reconnect; only the first one is startup
+        if "ready" in metrics.startup: return
+        metrics.startup["ready"] = time.perf_counter() - BOOT_TIME
+        print("⏱️ Startup: " + ", ".join(f"{k} {v:.2f}s" for k, v in metrics.startup.items()))
+    async def close(self):
+        await super().close()
+        await metrics.stop()
+        await db.close()
+        print(f"📊 DB queries per command: {queries_per_command()}")
+
 bot = AgniBot()
 
 @bot.tree.command(name="start", description="Begin your saga")
 async def start(interaction: discord.Interaction):
-    if db.create_user(interaction.user.id):
+    if await db.create_user(interaction.user.id):
+        await ledger.record(interaction.user.id, "start", START_INVENTORY)
         await interaction.response.send_message("⚔️ **Legend Begun.** Use `/battle` to fight.", ephemeral=True)
     else:
         await interaction.response.send_message("You are already playing.", ephemeral=True)
 
 @bot.tree.command(name="battle", description="Fight (5% chance for GOLDEN enemies)")
-async def battle(interaction: discord.Interaction):
-    u = db.get_user(interaction.user.id)
+@app_commands.describe(auto="Play the whole dungeon at once: Strike, and heal below 35% HP")
+async def battle(interaction: discord.Interaction, auto: bool = False):
+    embed = None
+    async with db.edit(interaction.user.id) as u:
+        if u and u['hp'] >= 10:
+            if auto:
+                # Finishes the battle already under way, if there is one
+                before = holdings(u)
+                embed, view = CombatView.resolve(battles.get(u) or BattleSession(u), u, "auto")
+            else:
+                battles.start(u)
     if not u: return await interaction.response.send_message("Use `/start` first.")
-    if u['hp'] < 10: return await interaction.response.send_message("🩸 Too weak! Heal first.", ephemeral=True)
-    await interaction.response.send_message(view=CombatView(interaction.user, u['location']))
+    if embed is not None:
+        await ledger.record(interaction.user.id, "battle", holdings_delta(before, u))
+        # A finished battle has no buttons; send_message only accepts a view or no view at all
+        return await interaction.response.send_message(embed=embed, **({"view": view} if view else {}))
+    if u['hp'] < 10: return await interaction.response.send_message("🩸 Too weak! Heal first, or rest: HP comes back over time.", ephemeral=True)
+    await interaction.response.send_message(view=battle_buttons(u['inventory'].get("Soma", 0)))
+
+@bot.tree.command(name="worldboss", description="Summon a world boss for everyone in this channel")
+@app_commands.guild_only()
+@app_commands.default_permissions(manage_guild=True)
+async def worldboss(interaction: discord.Interaction):
+    boss = await bosses.summon(interaction.channel_id)
+    if boss is None:
+        return await interaction.response.send_message("🐉 A world boss is already here. Strike it!", ephemeral=True)
+    await interaction.response.send_message(embed=boss_embed(boss), view=boss_buttons())
+    await bosses.attach(boss, (await interaction.original_response()).id)
 
 @bot.tree.command(name="spin", description="Gamble Gold (High Risk, High Reward)")
 async def spin(interaction: discord.Interaction, amount: int):
-    u = db.get_user(interaction.user.id)
-    if not u: return
-    if u['gold'] < amount: return await interaction.response.send_message("Not enough Gold.", ephemeral=True)
     if amount < 100: return await interaction.response.send_message("Minimum bet 100.", ephemeral=True)
-    
-    u['gold'] -= amount
-    roll = random.randint(1, 100)
-    
+    async with db.edit(interaction.user.id) as u:
+        if not u: return
+        if u['gold'] < amount: broke = True
+        else:
+            broke = False
+            u['gold'] -= amount
+            roll = random.randint(1, 100)
+            win = amount * 3 if roll >= 90 else int(amount * 1.5) if roll >= 50 else 0
+            u['gold'] += win
+    if broke: return await interaction.response.send_message("Not enough Gold.", ephemeral=True)
+    await ledger.record(interaction.user.id, "spin", {"gold": win - amount})
+
     embed = DharmaEmbed("Divine Wheel", color=COLORS["GOLD"])
     if roll >= 90: # 10% Jackpot
-        win = amount * 3
-        u['gold'] += win
         embed.description = f"🎰 **JACKPOT!** Rolled {roll}.\nWon **{win} Gold!**"
     elif roll >= 50: # Win
-        win = int(amount * 1.5)
-        u['gold'] += win
         embed.description = f"✅ **WIN!** Rolled {roll}.\nWon **{win} Gold!**"
     else:
         embed.description = f"❌ **LOSS.** Rolled {roll}.\nLost {amount} Gold."
         embed.color = COLORS["VOID"]
-        
-    db.update_user(interaction.user.id, u)
     await interaction.response.send_message(embed=embed)
 
 @bot.tree.command(name="reincarnate", description="Reset Level for Permanent Power (Lvl 50+)")
 async def reincarnate(interaction: discord.Interaction):
-    u = db.get_user(interaction.user.id)
+    u = await db.get_user(interaction.user.id)
     if not u: return
     if u['level'] < 50: return await interaction.response.send_message("🔒 Must be Level 50 to Reincarnate.", ephemeral=True)
     
     # Confirmation View
-    view = ui.View()
+    view = AgniView("reincarnate")
     btn = ui.Button(label="ASCEND", style=discord.ButtonStyle.danger, emoji="🌀")
     
     async def confirm(inter):
         if inter.user.id != interaction.user.id: return
-        u['level'] = 1
-        u['xp'] = 0
-        u['rebirths'] += 1
-        # Keep gold, inventory, gear
-        db.update_user(inter.user.id, u)
-        
+        async with db.edit(inter.user.id, flush=True) as u:
+            # Re-check: a second click (or another confirm) may have ascended already
+            locked = not u or u['level'] < 50
+            if not locked:
+                u['level'] = 1
+                u['xp'] = 0
+                u['rebirths'] += 1
+                # Keep gold, inventory, gear
+        if locked: return await inter.response.edit_message(content="🔒 Must be Level 50 to Reincarnate.", view=None)
+
         embed = DharmaEmbed("Ascension", f"🌀 **REBIRTH #{u['rebirths']} COMPLETE!**\n\nAll stats increased by **20%** permanently.\nLevel reset to 1.", COLORS["MYTHIC"])
         await inter.response.edit_message(embed=embed, view=None)
         
@@ -534,29 +2764,31 @@ async def reincarnate(interaction: discord.Interaction):
 
 @bot.tree.command(name="forge", description="Craft Powerful Weapons")
 async def forge(interaction: discord.Interaction):
-    u = db.get_user(interaction.user.id)
+    u = await db.get_user(interaction.user.id)
     if not u: return await interaction.response.send_message("Use `/start` first.")
     
     mat_str = ", ".join([f"{k}: {v}" for k,v in u['materials'].items()]) or "None"
     embed = DharmaEmbed("Cosmic Forge", f"**Materials:** {mat_str}\n\nSelect a recipe to Forge.")
     await interaction.response.send_message(embed=embed, view=CraftingView(interaction.user.id))
 
+SHOP_OPTIONS = select_options(*({"label": f"{k} ({v['price']} G)", "description": v['desc'], "value": k}
+                                 for k, v in ITEMS.items()))
+
 @bot.tree.command(name="shop", description="Buy Potions and Scrolls")
 async def shop(interaction: discord.Interaction):
-    u = db.get_user(interaction.user.id)
-    view = ui.View()
-    select = ui.Select(placeholder="Buy Items...")
-    for k, v in ITEMS.items():
-        select.add_option(label=f"{k} ({v['price']} G)", description=v['desc'], value=k)
+    view = AgniView("shop")
+    select = ui.Select(placeholder="Buy Items...", options=list(SHOP_OPTIONS))
     
     async def cb(inter):
         val = select.values[0]
         cost = ITEMS[val]['price']
-        usr = db.get_user(inter.user.id)
-        if usr['gold'] < cost: return await inter.response.send_message("Too poor.", ephemeral=True)
-        usr['gold'] -= cost
-        usr['inventory'][val] = usr['inventory'].get(val, 0) + 1
-        db.update_user(inter.user.id, usr)
+        async with db.edit(inter.user.id) as usr:
+            poor = not usr or usr['gold'] < cost
+            if not poor:
+                usr['gold'] -= cost
+                usr['inventory'][val] = usr['inventory'].get(val, 0) + 1
+        if poor: return await inter.response.send_message("Too poor.", ephemeral=True)
+        await ledger.record(inter.user.id, "shop", {"gold": -cost, val: 1})
         await inter.response.send_message(f"Bought {val}.")
         
     select.callback = cb
@@ -565,40 +2797,109 @@ async def shop(interaction: discord.Interaction):
 
 @bot.tree.command(name="stables", description="Equip Spirit Mounts")
 async def stables(interaction: discord.Interaction):
+    u = await db.get_user(interaction.user.id)
+    if not u: return await interaction.response.send_message("Use `/start` first.")
     await interaction.response.send_message("🐾 **Divine Stables**\nBond with a creature for 500 Gold.", view=MountView(interaction.user.id))
 
 @bot.tree.command(name="profile", description="View Stats & Rebirths")
 async def profile(interaction: discord.Interaction):
-    u = db.get_user(interaction.user.id)
+    u = await db.get_user(interaction.user.id)
     if not u: return await interaction.response.send_message("Use `/start` first.")
     
     stats = calculate_stats(u)
     eq = u['equipment']
     
-    embed = DharmaEmbed("Hero Profile", user=interaction.user)
+    embed = DharmaEmbed("Hero Profile", u=u)
     embed.add_field(name="Stats (Buffed)", value=f"❤️ HP: {u['hp']}/{stats['max_hp']}\n⚔️ ATK: {stats['atk']}\n🎯 Crit: {int(stats['crit']*100)}%", inline=True)
     embed.add_field(name="Equipment", value=f"🗡️ Wep: {eq['wep']}\n🛡️ Arm: {eq['arm']}\n🐾 Mount: {eq['mount']}", inline=False)
     
     await interaction.response.send_message(embed=embed)
 
+@bot.tree.command(name="leaderboard", description="Top heroes by Level, Rebirths or Gold")
+@app_commands.describe(board="What to rank by", scope="Everyone, or just those who have played in this server", page="Page of 10")
+async def leaderboard(interaction: discord.Interaction, board: Literal["level", "rebirths", "gold"] = "level",
+                      scope: Literal["global", "server"] = "global", page: app_commands.Range[int, 1, 1000] = 1):
+    guild_id = interaction.guild_id if scope == "server" else None
+    rows = await leaderboards.page(board, guild_id, page)
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = []
+    for rank, uid, score in rows:
+        if board == "gold": value = f"{ICONS['gold']} {score[0]:,}"
+        elif board == "rebirths": value = f"{ICONS['rebirth']} {score[0]} • Lvl {score[1]}"
+        else: value = f"Lvl {score[0]} • {ICONS['xp']} {score[1]}"
+        lines.append(f"{medals.get(rank, f'`#{rank}`')} <@{uid}> — {value}")
+    where = "This Server" if guild_id else "All Realms"
+    embed = DharmaEmbed(f"Leaderboard: {board.title()} ({where})", "\n".join(lines) or "No heroes here yet.", COLORS["GOLD"])
+    # Membership is recorded as players use Agni here, so anyone who hasn't
+    # since server boards were added isn't on this one yet
+    embed.set_footer(text=f"Page {page}" + (" • Players who have played in this server" if guild_id else ""))
+    await interaction.response.send_message(embed=embed)
+
+TRAVEL_OPTIONS = select_options(*({"label": k, "description": f"Lvl {v['lvl']}+ | Mats: {', '.join(v['mats'])}", "value": k}
+                                   for k, v in LOCATIONS.items()))
+
 @bot.tree.command(name="travel", description="Move to new regions")
 async def travel(interaction: discord.Interaction):
-    view = ui.View()
-    select = ui.Select(placeholder="Travel to...")
-    for k, v in LOCATIONS.items():
-        select.add_option(label=k, description=f"Lvl {v['lvl']}+ | Mats: {', '.join(v['mats'])}", value=k)
+    view = AgniView("travel")
+    select = ui.Select(placeholder="Travel to...", options=list(TRAVEL_OPTIONS))
     
     async def cb(inter):
         if inter.user.id != interaction.user.id: return
         loc = select.values[0]
-        u = db.get_user(inter.user.id)
-        if u['level'] < LOCATIONS[loc]['lvl']: return await inter.response.send_message("🔒 Level too low.", ephemeral=True)
-        u['location'] = loc
-        db.update_user(inter.user.id, u)
+        async with db.edit(inter.user.id) as u:
+            locked = not u or u['level'] < LOCATIONS[loc]['lvl']
+            if not locked: u['location'] = loc
+        if locked: return await inter.response.send_message("🔒 Level too low.", ephemeral=True)
         await inter.response.send_message(f"🌏 Arrived at **{loc}**.")
     
     select.callback = cb
     view.add_item(select)
     await interaction.response.send_message(view=view)
 
-bot.run(TOKEN)
+async def recommended_shards():
+    http = discord.http.HTTPClient(asyncio.get_running_loop())
+    await http.static_login(TOKEN)
+    try:
+        shards, _ = await http.get_bot_gateway()
+        return shards
+    finally:
+        await http.close()
+
+def launch_workers():
+    """Run WORKERS copies of this script, each owning a contiguous range of shards.
+
+    Workers start 5s per shard apart to stay inside Discord's identify rate
+    limit. If one exits the rest are stopped too, and the dyno restarts.
+    """
+    total = SHARD_COUNT or asyncio.run(recommended_shards())
+    workers = min(WORKERS, total)
+    procs = []
+
+    def stop(signum, _):
+        raise SystemExit(128 + signum)  # unwinds to the finally below, which stops every worker
+    # Before the first spawn: a signal during the staggered start mustn't orphan the workers already running
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        for i in range(workers):
+            ids = list(range(i * total // workers, (i + 1) * total // workers))
+            env = dict(os.environ, AGNI_WORKER=str(i), AGNI_SHARDS=str(total), AGNI_SHARED_DB="1",
+                       AGNI_SHARD_IDS=",".join(map(str, ids)))
+            procs.append(subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env))
+            print(f"🧩 Worker {i}: shards {ids[0]}-{ids[-1]} of {total} (pid {procs[-1].pid})")
+            if i + 1 < workers: time.sleep(5 * len(ids))
+        while all(p.poll() is None for p in procs):
+            time.sleep(1)
+    finally:
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)  # a second signal mustn't cut the cleanup short
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for p in procs:
+            if p.poll() is None: p.terminate()
+        for p in procs: p.wait()
+    sys.exit(max(p.returncode or 0 for p in procs))
+
+if __name__ == "__main__":
+    if WORKERS > 1 and SHARD_IDS is None:
+        launch_workers()
+    else:
+        bot.run(TOKEN)
@@ -0,0 +1,279 @@
+"""Player data export and import, backups and restores for Agni.
+
+    python manage.py export players.jsonl [--db agni_v14.db] [--state export.json]
+    python manage.py export players.parquet [--db agni_v14.db] [--state export.json]
+    python manage.py import players.jsonl [--db restore.db]
+    python manage.py backup [backups] [--db agni_v14.db]
+    python manage.py restore backups/agni_v14-20260101-000000.db [--db agni_v14.db]
+
+Exports stream the users table in key order, EXPORT_BATCH players at a
+time, inside one read snapshot, so memory stays flat however many players
+there are and the bot can keep running. Inventory, materials and equipment
+become flat columns ("inventory.Soma", "materials.Naga Scale",
+"equipment.wep"), empty where the player has none: None in Parquet, left
+out of JSONL lines. Keys no longer in the game data go to "extra" as JSON.
+Players the json_inventories backfill hasn't reached yet are read from
+their old JSON columns, so exporting mid-backfill loses nothing.
+
+A .parquet path writes the same columns in Parquet, one row group per
+batch. That needs pyarrow, which the bot itself does not.
+
+With --state, only players changed since the last export that used the
+same state file are written, walking the updated_at index. A player can
+appear in two consecutive exports (see OVERLAP_SECS). Import upserts each
+player and replaces their items, so applying a full export and then the
+incremental ones, in order, restores the latest state.
+
+backup takes one online backup now, the same way the bot does every
+AGNI_BACKUP_SECS, and is safe while the bot runs. restore is not: stop
+every worker first. It checks the backup, keeps the current database
+as <db>.before-restore-<UTC time>, and then replaces it. If the current
+database fails its check it is kept as it is: move it out of the way first.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import main
+
+EXPORT_BATCH = int(os.getenv("AGNI_EXPORT_BATCH", "5000"))     # players per query
+IMPORT_BATCH = int(os.getenv("AGNI_IMPORT_BATCH", "50000"))    # players per transaction
+# Incremental exports start this long before the previous one did: a write
+# stamped just before that export but committed after its snapshot is not lost
+OVERLAP_SECS = 60
+
+USER_FIELDS = [*main.USER_COLS, "updated_at"]
+CHILD_KEYS = {
+    "inventory": [*main.ITEMS, *main.RECIPES, *main.VAHANAS],
+    "materials": list(main.MATERIALS),
+    "equipment": list(main.DEFAULT_EQUIPMENT),
+}
+COLUMNS = USER_FIELDS + [f"{field}.{k}" for field, keys in CHILD_KEYS.items() for k in keys] + ["extra"]
+
+
+# ==============================================================================
+# 📤 EXPORT
+# ==============================================================================
+
+async def player_batches(conn, since=None):
+    """Yield lists of flat player dicts (COLUMNS), EXPORT_BATCH at a time.
+
+    All players in user_id order, or those with updated_at >= since in
+    (updated_at, user_id) order. Either way each query resumes from the last
+    key seen, so it costs the same on the last batch as on the first.
+    """
+    cols = ", ".join(USER_FIELDS)
+    if since is None:
+        sql, after = f"SELECT {cols} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (-1,)
+    else:
+        sql, after = (f"SELECT {cols} FROM users WHERE (updated_at, user_id) > (?, ?) "
+                      f"ORDER BY updated_at, user_id LIMIT ?"), (since, -1)
+    legacy = "inventory" in {r[1] for r in await conn.execute_fetchall("PRAGMA table_info(users)")}
+    while rows := await conn.execute_fetchall(sql, (*after, EXPORT_BATCH)):
+        players = {}
+        for r in rows:
+            p = players[r[0]] = dict.fromkeys(COLUMNS)
+            p.update(zip(USER_FIELDS, r))
+        uids, items, extras = json.dumps(list(players)), {}, {}
+        for field, (table, key, val) in main.CHILD_TABLES.items():
+            for uid, k, v in await conn.execute_fetchall(
+                    f"SELECT user_id, {key}, {val} FROM {table} WHERE user_id IN (SELECT value FROM json_each(?))", (uids,)):
+                items.setdefault((uid, field), {})[k] = v
+        if legacy:
+            # Players the json_inventories backfill hasn't reached still have their items as
+            # JSON on users. Merged as _copy_json would: rows already in the child tables win
+            for uid, *blobs in await conn.execute_fetchall(
+                    "SELECT user_id, inventory, materials, equipment FROM users "
+                    "WHERE user_id IN (SELECT value FROM json_each(?)) AND inventory IS NOT NULL", (uids,)):
+                for field, blob in zip(main.CHILD_TABLES, blobs):
+                    have = items.setdefault((uid, field), {})
+                    for k, v in json.loads(blob or "{}").items():
+                        have.setdefault(k, v)
+        for (uid, field), kv in items.items():
+            known = CHILD_KEYS[field]
+            for k, v in kv.items():
+                if k in known: players[uid][f"{field}.{k}"] = v
+                else: extras.setdefault(uid, {}).setdefault(field, {})[k] = v
+        for uid, extra in extras.items():
+            players[uid]["extra"] = json.dumps(extra, ensure_ascii=False)
+        yield list(players.values())
+        last = rows[-1]
+        after = (last[0],) if since is None else (last[-1], last[0])
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.f = open(path, "w", encoding="utf-8")
+
+    def write(self, players):
+        # Columns the player has nothing in are left out; import reads them as None
+        self.f.writelines(json.dumps({k: v for k, v in p.items() if v is not None}, ensure_ascii=False) + "\n"
+                          for p in players)
+
+    def close(self):
+        self.f.close()
+
+
+class ParquetWriter:
+    def __init__(self, path):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow: pip install pyarrow") from None
+        types = {"user_id": pa.int64(), "level": pa.int64(), "xp": pa.int64(), "hp": pa.int64(), "max_hp": pa.int64(),
+                 "gold": pa.int64(), "rebirths": pa.int64(), "last_regen_at": pa.float64(),
+                 "updated_at": pa.float64()}
+        self.schema = pa.schema([
+            (c, types.get(c, pa.string() if c.startswith("equipment.") or c in main.USER_COLS or c == "extra"
+                          else pa.int64())) for c in COLUMNS])
+        self.pa = pa
+        self.out = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, players):
+        self.out.write_table(self.pa.Table.from_pylist(players, schema=self.schema))
+
+    def close(self):
+        self.out.close()
+
+
+async def export(path, db_path, state=None):
+    """Write players to ``path`` (.jsonl or .parquet); with ``state``, only those changed since the last run."""
+    last = None
+    if state and os.path.exists(state):
+        with open(state) as f:
+            last = json.load(f)
+    since = last["started_at"] - OVERLAP_SECS if last else None
+    conn = await main.Database(db_path)._open(readonly=True)
+    tmp = path + ".tmp"
+    out = (ParquetWriter if path.endswith(".parquet") else JsonlWriter)(tmp)
+    started, n = time.time(), 0
+    try:
+        await conn.execute_fetchall("BEGIN")  # one snapshot for every batch
+        async for players in player_batches(conn, since):
+            out.write(players)
+            n += len(players)
+        await conn.execute_fetchall("COMMIT")
+    finally:
+        out.close()
+        await conn.close()
+    os.replace(tmp, path)
+    if state:
+        with open(state, "w") as f:
+            json.dump({"started_at": started, "players": n, "path": path}, f)
+    kind = "changed" if since is not None else "all"
+    print(f"📤 Exported {n:,} players ({kind}) to {path} in {time.time() - started:.1f}s")
+    return n
+
+
+# ==============================================================================
+# 📥 IMPORT
+# ==============================================================================
+
+def read_batches(path):
+    """Lists of flat player dicts from an export, IMPORT_BATCH at a time."""
+    if path.endswith(".parquet"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise SystemExit("Parquet input needs pyarrow: pip install pyarrow") from None
+        for batch in pq.ParquetFile(path).iter_batches(IMPORT_BATCH):
+            yield batch.to_pylist()
+        return
+    with open(path, encoding="utf-8") as f:
+        batch = []
+        for line in f:
+            batch.append(json.loads(line))
+            if len(batch) == IMPORT_BATCH:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+async def import_players(path, db_path):
+    """Upsert every player in an export into ``db_path``, IMPORT_BATCH players per transaction."""
+    db = main.Database(db_path, readers=0)
+    await db.connect()
+    cols = ", ".join(USER_FIELDS)
+    sets = ", ".join(f"{c}=excluded.{c}" for c in USER_FIELDS[1:])
+    upsert = (f"INSERT INTO users ({cols}) VALUES ({', '.join('?' * len(USER_FIELDS))}) "
+              f"ON CONFLICT(user_id) DO UPDATE SET {sets}")
+    # Into a database the json_inventories backfill hasn't finished: the players'
+    # old JSON goes too, or the backfill would copy dropped items back later
+    legacy = "inventory" in await db.columns("users")
+    started, n = time.time(), 0
+    try:
+        for players in read_batches(path):
+            children = {field: [] for field in main.CHILD_TABLES}
+            for p in players:
+                extra = json.loads(p.get("extra") or "{}")
+                for field, keys in CHILD_KEYS.items():
+                    items = {k: p.get(f"{field}.{k}") for k in keys}
+                    items.update(extra.get(field, {}))
+                    children[field] += [(p["user_id"], k, v) for k, v in items.items() if v is not None]
+            async with db.transaction():
+                await db.run_many(upsert, [[p.get(c) for c in USER_FIELDS] for p in players])
+                for field, (table, key, val) in main.CHILD_TABLES.items():
+                    await db.run_many(f"DELETE FROM {table} WHERE user_id = ?", [(p["user_id"],) for p in players])
+                    await db.run_many(f"INSERT INTO {table} (user_id, {key}, {val}) VALUES (?, ?, ?)", children[field])
+                if legacy:
+                    await db.run_many("UPDATE users SET inventory=NULL, materials=NULL, equipment=NULL WHERE user_id=?",
+                                      [(p["user_id"],) for p in players])
+            n += len(players)
+    finally:
+        await db.close()
+    print(f"📥 Imported {n:,} players from {path} in {time.time() - started:.1f}s")
+    return n
+
+
+# ==============================================================================
+# 💾 BACKUP AND RESTORE
+# ==============================================================================
+
+def backup(folder, db_path):
+    dest = main.new_backup(db_path, folder)
+    t = time.time()
+    size = main.backup_db(db_path, dest)
+    main.prune_backups(db_path, folder)
+    print(f"💾 Backed up {db_path} to {dest}: {size / 2**20:.1f} MB in {time.time() - t:.1f}s")
+    return dest
+
+
+def restore(path, db_path):
+    t = time.time()
+    before = f"{db_path}.before-restore-{time.strftime('%Y%m%d-%H%M%S', time.gmtime())}"
+    if os.path.exists(before):
+        raise SystemExit(f"{before} already exists: not overwriting it, try again in a second")
+    if os.path.exists(db_path):
+        # A full copy in one step: nothing else should be writing now
+        main.backup_db(db_path, before, pages=-1, pause=0)
+    main.restore_db(path, db_path)
+    kept = f" (the old one is {before})" if os.path.exists(before) else ""
+    print(f"💾 Restored {db_path} from {path} in {time.time() - t:.1f}s{kept}")
+
+
+# ==============================================================================
+# 🚀 ENTRY POINT
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agni player data export and import, backups and restores")
+    parser.add_argument("command", choices=("export", "import", "backup", "restore"))
+    parser.add_argument("path", nargs="?", help="export/import: .jsonl, or .parquet (needs pyarrow); "
+                                                "backup: the folder (default AGNI_BACKUP_DIR); restore: the backup")
+    parser.add_argument("--db", default=main.DB_PATH)
+    parser.add_argument("--state", help="export: only players changed since the last export with this state file")
+    args = parser.parse_args()
+    if args.command == "backup":
+        backup(args.path or main.BACKUP_DIR, args.db)
+    elif not args.path:
+        parser.error(f"{args.command} needs a path")
+    elif args.command == "export":
+        asyncio.run(export(args.path, args.db, args.state))
+    elif args.command == "import":
+        asyncio.run(import_players(args.path, args.db))
+    else:
+        restore(args.path, args.db)
@@ -0,0 +1,254 @@
+"""Monte Carlo balance simulator for Agni's combat rules.
+
+    python simulate.py --battles 1000 --levels 1,10,30,60 --mounts all
+    python simulate.py --levels 30 --paths Vanara --weapons "Naga Dagger" --check 2000
+
+Every combination of level, path, rebirths, weapon, armor, mount and
+location is simulated as one vectorized NumPy batch using the same rules
+and constants as main.Battle. Each cell reports win rate, turns to clear
+a dungeon, and gold/XP/materials per hour of play. ``--check`` replays
+the first cell through main.Battle itself to confirm the two agree.
+"""
+import argparse
+import itertools
+import json
+import random
+import sys
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit("simulate.py needs NumPy: pip install numpy")
+
+import main
+
+MAX_TURNS = 500
+
+
+# ==============================================================================
+# 🧮 GRID
+# ==============================================================================
+
+def parse_list(value, choices, cast=str):
+    if value == "all":
+        return list(choices)
+    out = [cast(v.strip()) for v in value.split(",")]
+    for v in out:
+        if choices is not None and v not in choices:
+            sys.exit(f"Unknown value {v!r}, expected one of: {', '.join(map(str, choices))}")
+    return out
+
+
+def build_grid(args):
+    weapons = ["None"] + [k for k, v in main.RECIPES.items() if v['type'] == 'wep']
+    armors = ["None"] + [k for k, v in main.RECIPES.items() if v['type'] == 'arm']
+    mounts = ["None"] + list(main.VAHANAS)
+    return list(itertools.product(
+        parse_list(args.paths, main.PATHS),
+        parse_list(args.levels, None, int),
+        parse_list(args.rebirths, None, int),
+        parse_list(args.weapons, weapons),
+        parse_list(args.armors, armors),
+        parse_list(args.mounts, mounts),
+        parse_list(args.locations, main.LOCATIONS),
+    ))
+
+
+def make_player(path, level, rebirths, wep, arm, mount, location, soma):
+    return {
+        "path": path, "level": level, "rebirths": rebirths, "xp": 0, "gold": 0, "location": location,
+        "inventory": {"Soma": soma}, "materials": {},
+        "equipment": {"wep": wep, "arm": arm, "mount": mount},
+    }
+
+
+# ==============================================================================
+# ⚡ VECTORIZED ENGINE
+# ==============================================================================
+
+def simulate(grid, battles, soma, heal_below, start_hp, seed):
+    """Run ``battles`` dungeons for every grid cell. Returns per-battle arrays."""
+    rng = np.random.default_rng(seed)
+    cells = len(grid)
+    n = cells * battles
+
+    stats = [main.calculate_stats(make_player(*cell, soma)) for cell in grid]
+    rep = lambda xs, dtype: np.repeat(np.asarray(xs, dtype=dtype), battles)
+    L = rep([c[1] for c in grid], np.int64)
+    M = rep([s['max_hp'] for s in stats], np.int64)
+    A = rep([s['atk'] for s in stats], np.int64)
+    C = rep([s['crit'] for s in stats], np.float64)
+    lifesteal = rep([c[3] == "Naga Dagger" for c in grid], bool)
+    D = rep([0.25 if c[5] == "Suparna" else 0.05 for c in grid], np.float64)
+    mushika = rep([c[5] == "Mushika" for c in grid], bool)
+
+    H = (M * start_hp).astype(np.int64)
+    S = np.full(n, soma, np.int64)
+    W = np.ones(n, np.int64)
+    G = np.zeros(n, bool)
+    EH = np.zeros(n, np.int64)
+    EA = np.zeros(n, np.int64)
+    T = np.zeros(n, np.int64)
+    kills = np.zeros(n, np.int64)
+    golden_kills = np.zeros(n, np.int64)
+    gold = np.zeros(n, np.int64)
+    xp = np.zeros(n, np.int64)
+    done = np.zeros(n, bool)
+    won = np.zeros(n, bool)
+
+    def spawn(idx):
+        golden = rng.random(idx.size) < main.GOLDEN_CHANCE
+        lvl = L[idx] + (W[idx] - 1) * 2
+        G[idx] = golden
+        EH[idx] = np.where(golden, 30, 50 + lvl * 15)
+        EA[idx] = np.where(golden, 5, 10 + lvl * 3)
+
+    spawn(np.arange(n))
+    for _ in range(MAX_TURNS):
+        idx = np.flatnonzero(~done)
+        if idx.size == 0:
+            break
+        h, m = H[idx], M[idx]
+
+        # Player action: Soma/Rest below the threshold, otherwise Strike
+        heal = h < heal_below * m
+        soma_left = S[idx] > 0
+        use_soma = heal & soma_left
+        S[idx] -= use_soma
+        h = np.where(use_soma, np.minimum(m, h + main.SOMA_HEAL), h)
+        h = np.where(heal & ~soma_left, np.minimum(m, h + (m * main.REST_HEAL).astype(np.int64)), h)
+
+        dmg = (A[idx] * rng.uniform(0.9, 1.1, idx.size)).astype(np.int64)
+        dmg = np.where(rng.random(idx.size) < C[idx], dmg * 2, dmg)
+        dmg = np.where(heal, 0, dmg)
+        h = np.where(lifesteal[idx] & ~heal, np.minimum(m, h + (dmg * main.LIFESTEAL).astype(np.int64)), h)
+        EH[idx] -= dmg
+        T[idx] += 1
+
+        # Enemy down: next wave, or dungeon cleared
+        killed = EH[idx] <= 0
+        kills[idx] += killed
+        golden_kills[idx] += killed & G[idx]
+        cleared = killed & (W[idx] >= main.MAX_WAVES)
+        mult = np.where(G[idx], 10, 1) + np.where(mushika[idx], 0.2, 0.0)
+        gold[idx] += np.where(cleared, (50 * L[idx] * mult).astype(np.int64), 0)
+        xp[idx] += np.where(cleared, (100 * L[idx] * mult).astype(np.int64), 0)
+        won[idx[cleared]] = True
+
+        next_wave = killed & ~cleared
+        h = np.where(next_wave, np.minimum(m, h + (m * main.WAVE_REGEN).astype(np.int64)), h)
+        W[idx[next_wave]] += 1
+        spawn(idx[next_wave])
+
+        # Enemy turn
+        fight = ~killed
+        ea = EA[idx]
+        hit = rng.integers((ea * 0.8).astype(np.int64), (ea * 1.2).astype(np.int64) + 1)
+        dodged = rng.random(idx.size) < D[idx]
+        h = np.where(fight & ~dodged, h - hit, h)
+        lost = fight & (h <= 0)
+
+        H[idx] = h
+        done[idx[cleared | lost]] = True
+
+    return {"won": won, "done": done, "turns": T, "gold": gold, "xp": xp,
+            "kills": kills, "golden_kills": golden_kills}
+
+
+def summarize(grid, res, battles, secs_per_turn):
+    rows = []
+    for i, (path, level, rebirths, wep, arm, mount, location) in enumerate(grid):
+        sl = slice(i * battles, (i + 1) * battles)
+        won, turns = res["won"][sl], res["turns"][sl]
+        hours = max(1, turns.sum()) * secs_per_turn / 3600
+        kills, golden = res["kills"][sl].sum(), res["golden_kills"][sl].sum()
+        mats = main.LOCATIONS[location]["mats"]
+        drops = {m: (kills - golden) / len(mats) / hours for m in mats}
+        drops["Amrit Drop"] = drops.get("Amrit Drop", 0) + golden / hours
+        rows.append({
+            "path": path, "level": level, "rebirths": rebirths, "wep": wep, "arm": arm, "mount": mount,
+            "location": location,
+            "win_rate": round(float(won.mean()), 4),
+            "turns_to_clear": round(float(turns[won].mean()), 2) if won.any() else None,
+            "gold_per_hour": round(float(res["gold"][sl].sum() / hours)),
+            "xp_per_hour": round(float(res["xp"][sl].sum() / hours)),
+            "drops_per_hour": {k: round(float(v), 1) for k, v in drops.items()},
+            "timeouts": int((~res["done"][sl]).sum()),
+        })
+    return rows
+
+
+# ==============================================================================
+# 🔍 CROSS-CHECK AGAINST main.Battle
+# ==============================================================================
+
+def play(u, stats, rng, heal_below):
+    # The /battle auto policy is the same one simulate() models
+    b = main.Battle(u, stats, u['location'], rng)
+    outcome = b.auto(heal_below, MAX_TURNS)
+    return outcome == "win", b.turns, (b.rewards or {}).get("gold", 0)
+
+
+def check(cell, battles, soma, heal_below, start_hp, seed):
+    rng = random.Random(seed)
+    wins = turns = gold = 0
+    for _ in range(battles):
+        u = make_player(*cell, soma)
+        stats = main.calculate_stats(u)
+        u['hp'] = int(stats['max_hp'] * start_hp)
+        w, t, g = play(u, stats, rng, heal_below)
+        wins += w
+        turns += t
+        gold += g
+    return {"win_rate": round(wins / battles, 4), "mean_turns": round(turns / battles, 2),
+            "mean_gold": round(gold / battles, 1)}
+
+
+# ==============================================================================
+# 🚀 ENTRY POINT
+# ==============================================================================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agni combat balance simulator")
+    parser.add_argument("--battles", type=int, default=1000, help="battles per grid cell")
+    parser.add_argument("--paths", default="all")
+    parser.add_argument("--levels", default="1,10,30,60")
+    parser.add_argument("--rebirths", default="0")
+    parser.add_argument("--weapons", default="all")
+    parser.add_argument("--armors", default="all")
+    parser.add_argument("--mounts", default="all")
+    parser.add_argument("--locations", default="Ayodhya")
+    parser.add_argument("--soma", type=int, default=5, help="Soma carried into each dungeon")
+    parser.add_argument("--heal-below", type=float, default=main.AUTO_HEAL_BELOW, help="heal when HP falls below this fraction")
+    parser.add_argument("--start-hp", type=float, default=1.0, help="starting HP as a fraction of max")
+    parser.add_argument("--secs-per-turn", type=float, default=2.0, help="seconds a player spends per click")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--check", type=int, default=0, metavar="N", help="replay N battles of the first cell through main.Battle")
+    parser.add_argument("--json", help="also write the per-cell results to this file")
+    args = parser.parse_args()
+
+    grid = build_grid(args)
+    t = time.perf_counter()
+    res = simulate(grid, args.battles, args.soma, args.heal_below, args.start_hp, args.seed)
+    elapsed = time.perf_counter() - t
+    rows = summarize(grid, res, args.battles, args.secs_per_turn)
+
+    print(f"{len(grid)} cells x {args.battles} battles = {len(grid) * args.battles:,} battles in {elapsed:.2f}s\n")
+    print(f"{'path':<10} {'lvl':>3} {'rb':>2} {'weapon':<13} {'armor':<13} {'mount':<9} {'win%':>6} {'turns':>6} {'gold/h':>9} {'xp/h':>9}")
+    for r in rows:
+        turns = f"{r['turns_to_clear']:.1f}" if r['turns_to_clear'] is not None else "-"
+        print(f"{r['path']:<10} {r['level']:>3} {r['rebirths']:>2} {r['wep']:<13} {r['arm']:<13} {r['mount']:<9} "
+              f"{r['win_rate'] * 100:>5.1f}% {turns:>6} {r['gold_per_hour']:>9,} {r['xp_per_hour']:>9,}")
+
+    if args.check:
+        fast = rows[0]
+        slow = check(grid[0], args.check, args.soma, args.heal_below, args.start_hp, args.seed)
+        first = res["turns"][:args.battles]
+        print(f"\nCheck {grid[0]}:")
+        print(f"  vectorized  win_rate={fast['win_rate']}  mean_turns={first.mean():.2f}  mean_gold={res['gold'][:args.battles].mean():.1f}")
+        print(f"  main.Battle win_rate={slow['win_rate']}  mean_turns={slow['mean_turns']}  mean_gold={slow['mean_gold']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "elapsed_s": elapsed, "cells": rows}, f, indent=2)